@@ -0,0 +1,424 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+import httpx
+
+from bench.stubs import add_stub_arguments
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+FIXTURES_DIR = BACKEND_DIR.parent / "test"
+DEFAULT_ASSIGNMENTS = ("message.pdf", "message.txt")
+DEFAULT_RUBRIC = "rubric.png"
+
+STARTUP_TIMEOUT_SECONDS = 30.0
+SAMPLE_INTERVAL_SECONDS = 0.1
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _read_status(pid: int) -> dict[str, int]:
+    """VmRSS/VmHWM (kB) and Threads from ``/proc/<pid>/status``."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in ("VmRSS", "VmHWM", "Threads"):
+                    values[name] = int(rest.split()[0])
+    except (FileNotFoundError, ProcessLookupError, ValueError):
+        pass
+    return values
+
+
+class ResourceSampler:
+    """Tracks peak RSS and thread count of a process while running."""
+
+    def __init__(self, pid: int | None):
+        self.pid = pid
+        self.peak_rss_kb = 0
+        self.max_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "ResourceSampler":
+        if self.pid is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.pid is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        # VmHWM catches peaks between samples.
+        self.peak_rss_kb = max(self.peak_rss_kb, _read_status(self.pid).get("VmHWM", 0))
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            status = _read_status(self.pid)
+            self.peak_rss_kb = max(self.peak_rss_kb, status.get("VmRSS", 0))
+            self.max_threads = max(self.max_threads, status.get("Threads", 0))
+            self._stop.wait(SAMPLE_INTERVAL_SECONDS)
+
+    def report(self) -> dict | None:
+        if self.pid is None:
+            return None
+        return {
+            "pid": self.pid,
+            "peak_rss_mb": round(self.peak_rss_kb / 1024, 1),
+            "max_threads": self.max_threads,
+        }
+
+
+def percentile(ordered: list[float], q: float) -> float | None:
+    """Linear-interpolated percentile of an already sorted list."""
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _load_fixtures(names: list[str], rubric: str) -> tuple[list, tuple]:
+    assignments = [(name, (FIXTURES_DIR / name).read_bytes()) for name in names]
+    return assignments, (rubric, (FIXTURES_DIR / rubric).read_bytes())
+
+
+async def _wait_ready(url: str, process: subprocess.Popen | None = None) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"{process.args} exited with {process.returncode}")
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up in {STARTUP_TIMEOUT_SECONDS}s")
+
+
+def _stub_argv(args: argparse.Namespace) -> list[str]:
+    argv = [
+        "--generate-ms",
+        str(args.generate_ms),
+        "--upload-ms",
+        str(args.upload_ms),
+        "--delete-ms",
+        str(args.delete_ms),
+        "--sapling-ms",
+        str(args.sapling_ms),
+        "--latency-spread",
+        str(args.latency_spread),
+        "--throttle-rate",
+        str(args.throttle_rate),
+        "--rpm",
+        str(args.rpm),
+    ]
+    if args.seed is not None:
+        argv += ["--seed", str(args.seed)]
+    return argv
+
+
+@contextmanager
+def spawn_stack(args: argparse.Namespace):
+    """
+    Start the Gemini/Sapling stand-ins and an API server pointed at them.
+
+    Yields ``(api_url, api_pid, stub_urls)``. Caches and stores go to a
+    temporary directory so runs don't share state.
+    """
+    gemini_port, sapling_port, api_port = _free_port(), _free_port(), _free_port()
+    gemini_url = f"http://127.0.0.1:{gemini_port}"
+    sapling_url = f"http://127.0.0.1:{sapling_port}"
+    api_url = f"http://127.0.0.1:{api_port}"
+
+    with tempfile.TemporaryDirectory(prefix="grader-bench-") as tmp:
+        env = {
+            **os.environ,
+            "GEMINI_API_KEY": "bench",
+            "GEMINI_BASE_URL": gemini_url,
+            "SAPLING_API_KEY": "bench",
+            "SAPLING_API_URL": f"{sapling_url}/api/v1/aidetect",
+            "GRADE_CACHE_PATH": f"{tmp}/grading_results.sqlite3",
+            "CORPUS_INDEX_PATH": f"{tmp}/corpus.sqlite3",
+            "RENDER_CACHE_DIR": f"{tmp}/renders",
+            "DOCUMENT_STORE_DIR": f"{tmp}/documents",
+            "JOB_STORE_PATH": f"{tmp}/jobs.sqlite3",
+        }
+        for item in args.server_env:
+            name, _, value = item.partition("=")
+            env[name] = value
+
+        stubs = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "bench.stubs",
+                "--gemini-port",
+                str(gemini_port),
+                "--sapling-port",
+                str(sapling_port),
+                *_stub_argv(args),
+            ],
+            cwd=BACKEND_DIR,
+            stdout=subprocess.DEVNULL,
+        )
+        api = None
+        try:
+            asyncio.run(_wait_ready(f"{gemini_url}/_stats", stubs))
+            asyncio.run(_wait_ready(f"{sapling_url}/_stats", stubs))
+            api = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "uvicorn",
+                    "main:app",
+                    "--host",
+                    "127.0.0.1",
+                    "--port",
+                    str(api_port),
+                    "--log-level",
+                    "warning",
+                ],
+                cwd=BACKEND_DIR,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=None if args.server_logs else subprocess.DEVNULL,
+            )
+            asyncio.run(_wait_ready(f"{api_url}/api/health", api))
+            yield api_url, api.pid, {"gemini": gemini_url, "sapling": sapling_url}
+        finally:
+            for process in (api, stubs):
+                if process is None:
+                    continue
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+async def run_load(
+    url: str,
+    path: str,
+    assignments: list[tuple[str, bytes]],
+    rubric: tuple[str, bytes],
+    params: dict[str, str],
+    concurrency: int,
+    requests: int,
+    warmup: int,
+    timeout: float,
+) -> dict:
+    """Closed-loop load: ``concurrency`` clients each send one request at a time."""
+    latencies: list[float] = []
+    first_bytes: list[float] = []
+    statuses: Counter = Counter()
+    errors: Counter = Counter()
+    counter = iter(range(-warmup, requests))
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=url, timeout=timeout, limits=limits
+    ) as client:
+
+        async def send(index: int) -> None:
+            name, data = assignments[index % len(assignments)]
+            files = {"assignment": (name, data), "rubric": rubric}
+            started = time.perf_counter()
+            first_byte = None
+            body = bytearray()
+            try:
+                async with client.stream(
+                    "POST", path, params=params, files=files
+                ) as response:
+                    async for chunk in response.aiter_bytes():
+                        if first_byte is None:
+                            first_byte = time.perf_counter() - started
+                        body += chunk
+                elapsed = time.perf_counter() - started
+                failed = response.status_code != 200 or _is_error(response, body)
+            except (httpx.HTTPError, ValueError) as e:
+                if index >= 0:
+                    errors[type(e).__name__] += 1
+                return
+            if index < 0:
+                return
+            statuses[response.status_code] += 1
+            if failed:
+                errors["error_response"] += 1
+            latencies.append(elapsed)
+            first_bytes.append(first_byte if first_byte is not None else elapsed)
+
+        async def worker() -> None:
+            for index in counter:
+                await send(index)
+
+        # Warm-up requests go first so they don't overlap the measured window.
+        warm = [send(next(counter)) for _ in range(warmup)]
+        for start in range(0, len(warm), concurrency):
+            await asyncio.gather(*warm[start : start + concurrency])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "completed": len(latencies),
+        "errors": dict(errors),
+        "status_codes": {str(code): n for code, n in sorted(statuses.items())},
+        "duration_seconds": round(duration, 3),
+        "rps": round(len(latencies) / duration, 2) if duration else None,
+        "latency_ms": _summary(latencies),
+        # For SSE endpoints this is the time to the first event.
+        "first_byte_ms": _summary(first_bytes),
+    }
+
+
+def _is_error(response: httpx.Response, body: bytes) -> bool:
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        return b"event: error" in body
+    return "error" in json.loads(body)
+
+
+def _summary(seconds: list[float]) -> dict:
+    ordered = sorted(seconds)
+    return {
+        name: round(value * 1000, 1) if value is not None else None
+        for name, value in (
+            ("p50", percentile(ordered, 50)),
+            ("p95", percentile(ordered, 95)),
+            ("p99", percentile(ordered, 99)),
+            ("mean", sum(ordered) / len(ordered) if ordered else None),
+            ("max", ordered[-1] if ordered else None),
+        )
+    }
+
+
+def _stub_stats(stub_urls: dict[str, str]) -> dict:
+    stats = {}
+    for name, url in stub_urls.items():
+        try:
+            stats[name] = httpx.get(f"{url}/_stats", timeout=5).json()
+        except httpx.HTTPError:
+            stats[name] = None
+    return stats
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.load",
+        description=(
+            "Replay the test/ fixtures against /api/gradev2 and report latency "
+            "percentiles, throughput and server resource use as JSON."
+        ),
+    )
+    parser.add_argument(
+        "--url",
+        help="benchmark a running server instead of spawning one with stand-ins",
+    )
+    parser.add_argument(
+        "--pid", type=int, help="server process to sample RSS/threads from (--url)"
+    )
+    parser.add_argument("--path", default="/api/gradev2")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument(
+        "--assignments",
+        nargs="+",
+        default=list(DEFAULT_ASSIGNMENTS),
+        help="fixture names under test/, sent round-robin",
+    )
+    parser.add_argument("--rubric", default=DEFAULT_RUBRIC)
+    parser.add_argument(
+        "--params",
+        default="cache=bypass",
+        help="query string for each request, e.g. 'cache=bypass&detect_ai=true'",
+    )
+    parser.add_argument(
+        "--server-env",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="extra environment for the spawned server (repeatable)",
+    )
+    parser.add_argument("--server-logs", action="store_true")
+    parser.add_argument("--output", help="also write the JSON report here")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    assignments, rubric = _load_fixtures(args.assignments, args.rubric)
+    params = dict(parse_qsl(args.params))
+
+    def measure(url: str, pid: int | None) -> dict:
+        with ResourceSampler(pid) as sampler:
+            result = asyncio.run(
+                run_load(
+                    url,
+                    args.path,
+                    assignments,
+                    rubric,
+                    params,
+                    args.concurrency,
+                    args.requests,
+                    args.warmup,
+                    args.timeout,
+                )
+            )
+        return {**result, "server": sampler.report()}
+
+    config = {
+        "path": args.path,
+        "concurrency": args.concurrency,
+        "warmup": args.warmup,
+        "assignments": args.assignments,
+        "rubric": args.rubric,
+        "params": params,
+    }
+    if args.url:
+        report = {"config": {**config, "url": args.url}, **measure(args.url, args.pid)}
+    else:
+        with spawn_stack(args) as (url, pid, stub_urls):
+            result = measure(url, pid)
+            stubs = _stub_stats(stub_urls)
+        config["stubs"] = {
+            "generate_ms": args.generate_ms,
+            "upload_ms": args.upload_ms,
+            "delete_ms": args.delete_ms,
+            "sapling_ms": args.sapling_ms,
+            "latency_spread": args.latency_spread,
+            "throttle_rate": args.throttle_rate,
+            "rpm": args.rpm,
+            "seed": args.seed,
+        }
+        config["server_env"] = args.server_env
+        report = {"config": config, **result, "stubs": stubs}
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,509 @@
+import argparse
+import gc
+import io
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+
+# Measure the single-process render path so results don't depend on the
+# machine's core count; set RENDER_POOL_SIZE explicitly to include the pool.
+os.environ.setdefault("RENDER_POOL_SIZE", "1")
+
+import fitz  # noqa: E402
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from services.file_to_image import (  # noqa: E402
+    TEXT_PADDING,
+    TEXT_PAGE_WIDTH,
+    _wrap_text,
+    image_to_png,
+    pdf_to_images,
+    txt_to_images,
+)
+from utils import JsonStreamParser, parse_json_response  # noqa: E402
+
+DEFAULT_BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "micro.json"
+DEFAULT_TOLERANCE = 0.25
+# Roughly the size of the text in one streamed Gemini chunk.
+STREAM_CHUNK_CHARS = 120
+
+# Each round runs the case enough times to take at least this long, so very
+# fast cases aren't dominated by timer resolution.
+MIN_ROUND_SECONDS = 0.05
+DEFAULT_ROUNDS = 11
+
+# A case only counts as a regression when its median is also this many
+# interquartile ranges above the baseline median, so noisy cases need a
+# bigger slowdown to fail the check.
+NOISE_IQRS = 3
+# Baselines are only enforced on a machine matching these fields.
+MACHINE_KEYS = ("python", "platform", "processor", "cpus", "pymupdf", "pillow")
+
+# A log-log slope above this between neighbouring sizes is flagged.
+SUPERLINEAR_EXPONENT = 1.3
+
+KB = 1024
+MB = 1024 * KB
+
+WORDS = (
+    "the student argues that evidence from primary sources supports a "
+    "nuanced reading of economic policy although several counterexamples "
+    "weaken the conclusion and the organization of paragraphs could improve "
+    "transitions between claims analysis citations rubric criteria essay"
+).split()
+
+
+@dataclass(frozen=True)
+class Case:
+    group: str
+    label: str
+    size: int  # input size along the scaling axis (pages, bytes, pixels)
+    setup: Callable[[], tuple]
+    func: Callable
+
+    @property
+    def name(self) -> str:
+        return f"{self.group}[{self.label}]"
+
+
+@lru_cache(maxsize=None)
+def make_text(size: int, seed: int = 0) -> str:
+    """Prose-like text of ``size`` bytes with a paragraph break every ~80 words."""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    count = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        count += 1
+        sep = "\n\n" if count % 80 == 0 else " "
+        parts.append(word + sep)
+        length += len(word) + len(sep)
+    return "".join(parts)[:size]
+
+
+@lru_cache(maxsize=None)
+def make_pdf(pages: int) -> bytes:
+    """A text-heavy letter-size PDF with a heading and a rule on every page."""
+    doc = fitz.open()
+    body = make_text(2 * KB)
+    for number in range(1, pages + 1):
+        page = doc.new_page(width=612, height=792)
+        page.insert_text((72, 72), f"Essay page {number}", fontsize=18)
+        page.draw_line((72, 84), (540, 84))
+        # A negative result means the text overflowed and nothing was drawn.
+        assert page.insert_textbox(fitz.Rect(72, 96, 540, 720), body, fontsize=11) >= 0
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@lru_cache(maxsize=None)
+def make_photo(width: int, height: int) -> bytes:
+    """A JPEG with smooth gradients plus sensor-like noise, like a phone photo."""
+    rng = np.random.default_rng(width * height)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack(
+        [
+            128 + 100 * np.sin(x / width * 3.1),
+            128 + 100 * np.cos(y / height * 2.3),
+            128 + 60 * np.sin((x + y) / (width + height) * 5.7),
+        ],
+        axis=-1,
+    )
+    noise = rng.normal(0, 12, size=base.shape).astype(np.float32)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=None)
+def make_json(size: int, variant: str) -> str:
+    """
+    A grading response of roughly ``size`` bytes as Gemini might return it.
+
+    ``plain`` is bare JSON, ``fenced`` wraps it in a markdown code block,
+    ``prose`` surrounds it with unfenced commentary and ``malformed`` cuts
+    it off mid-object so parsing fails.
+    """
+    rng = random.Random(size)
+
+    def criterion(number: int) -> dict:
+        return {
+            "criteria_title": f"Criterion {number}",
+            "score": rng.randint(0, 10),
+            "score_max": 10,
+            "feedback": make_text(400, seed=number).replace("\n", " "),
+        }
+
+    per_criterion = len(json.dumps(criterion(0), indent=2))
+    payload = json.dumps(
+        {
+            "name": "Bench Student",
+            "overall_feedback": "Solid work overall.",
+            "criteria_feedback": [
+                criterion(number) for number in range(1, size // per_criterion + 2)
+            ],
+        },
+        indent=2,
+    )
+    if variant == "fenced":
+        return f"Here is the grading:\n```json\n{payload}\n```\n"
+    if variant == "prose":
+        return f"Sure! The result is {payload} and let me know if {{more}} helps."
+    if variant == "malformed":
+        return f"```json\n{payload[: len(payload) * 2 // 3]}\n```"
+    return payload
+
+
+def _parse_or_fail(content: str) -> None:
+    try:
+        parse_json_response(content)
+    except ValueError:
+        pass
+
+
+def _parse_streamed(content: str) -> None:
+    parser = JsonStreamParser()
+    for start in range(0, len(content), STREAM_CHUNK_CHARS):
+        parser.feed(content[start : start + STREAM_CHUNK_CHARS])
+
+
+def _size_label(size: int) -> str:
+    if size >= MB:
+        return f"{size // MB}MB"
+    if size >= KB:
+        return f"{size // KB}KB"
+    return f"{size}B"
+
+
+def build_cases() -> list[Case]:
+    wrap_width = TEXT_PAGE_WIDTH - TEXT_PADDING * 2
+    cases = [
+        Case(
+            "pdf_to_images",
+            f"{pages}p",
+            pages,
+            lambda p=pages: (make_pdf(p),),
+            pdf_to_images,
+        )
+        for pages in (1, 10, 50, 200)
+    ]
+    for size in (KB, 10 * KB, 100 * KB, MB):
+        cases.append(
+            Case(
+                "wrap_text",
+                _size_label(size),
+                size,
+                lambda s=size: (make_text(s), wrap_width),
+                _wrap_text,
+            )
+        )
+    for size in (KB, 10 * KB, 100 * KB, MB):
+        cases.append(
+            Case(
+                "txt_to_images",
+                _size_label(size),
+                size,
+                lambda s=size: (make_text(s).encode(),),
+                txt_to_images,
+            )
+        )
+    for width, height in ((640, 480), (2000, 1500), (4000, 3000)):
+        cases.append(
+            Case(
+                "image_to_png",
+                f"{width * height / 1e6:.1f}MP",
+                width * height,
+                lambda w=width, h=height: (make_photo(w, h),),
+                image_to_png,
+            )
+        )
+    for variant in ("plain", "fenced", "prose", "malformed"):
+        for size in (KB, 10 * KB, 100 * KB, MB):
+            cases.append(
+                Case(
+                    f"parse_json_{variant}",
+                    _size_label(size),
+                    size,
+                    lambda s=size, v=variant: (make_json(s, v),),
+                    _parse_or_fail,
+                )
+            )
+    for size in (KB, 10 * KB, 100 * KB, MB):
+        cases.append(
+            Case(
+                "parse_json_stream",
+                _size_label(size),
+                size,
+                lambda s=size: (make_json(s, "fenced"),),
+                _parse_streamed,
+            )
+        )
+    return cases
+
+
+def measure(case: Case, rounds: int) -> dict:
+    """Time ``case`` over ``rounds`` rounds; returns per-call seconds."""
+    args = case.setup()
+    # The first call also warms caches, fonts and lazy imports; fast cases
+    # are timed again for an accurate loop count, slow ones aren't worth it.
+    started = time.perf_counter()
+    case.func(*args)
+    single = time.perf_counter() - started
+    if single < MIN_ROUND_SECONDS:
+        started = time.perf_counter()
+        case.func(*args)
+        single = time.perf_counter() - started
+    loops = max(1, math.ceil(MIN_ROUND_SECONDS / max(single, 1e-9)))
+
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for _ in range(loops):
+                case.func(*args)
+            samples.append((time.perf_counter() - started) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return {
+        "group": case.group,
+        "size": case.size,
+        "median_s": statistics.median(samples),
+        "min_s": min(samples),
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "iqr_s": _iqr(samples),
+        "rounds": rounds,
+        "loops": loops,
+    }
+
+
+def _iqr(samples: list[float]) -> float:
+    if len(samples) < 2:
+        return 0.0
+    q1, _, q3 = statistics.quantiles(samples, n=4)
+    return q3 - q1
+
+
+def scaling(results: dict[str, dict]) -> dict[str, dict]:
+    """
+    Log-log slope of time against input size per group.
+
+    1 is linear; 2 is quadratic. ``steps`` are the slopes between
+    neighbouring sizes, so growth that only kicks in at large inputs shows.
+    """
+    groups: dict[str, list[tuple[int, float]]] = {}
+    for result in results.values():
+        groups.setdefault(result["group"], []).append(
+            (result["size"], result["median_s"])
+        )
+
+    curves = {}
+    for group, points in groups.items():
+        points.sort()
+        if len(points) < 2:
+            continue
+        xs = [math.log(size) for size, _ in points]
+        ys = [math.log(seconds) for _, seconds in points]
+        mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+        exponent = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum(
+            (x - mean_x) ** 2 for x in xs
+        )
+        steps = [
+            (ys[i + 1] - ys[i]) / (xs[i + 1] - xs[i]) for i in range(len(points) - 1)
+        ]
+        curves[group] = {
+            "exponent": round(exponent, 2),
+            "steps": [round(step, 2) for step in steps],
+            "superlinear": max(steps) > SUPERLINEAR_EXPONENT,
+        }
+    return curves
+
+
+def compare(
+    results: dict[str, dict], baseline: dict[str, dict], tolerance: float
+) -> list[str]:
+    """
+    Names of cases slower than their baseline beyond tolerance and noise.
+
+    A case regresses when its median is more than ``tolerance`` above the
+    baseline median and also more than ``NOISE_IQRS`` interquartile ranges
+    (of whichever run was noisier) above it.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        noise = NOISE_IQRS * max(result["iqr_s"], base.get("iqr_s", 0.0))
+        limit = max(base["median_s"] * (1 + tolerance), base["median_s"] + noise)
+        if result["median_s"] > limit:
+            regressions.append(name)
+    return regressions
+
+
+def machine_mismatch(recorded: dict, current: dict) -> list[str]:
+    """Fields of ``MACHINE_KEYS`` that differ between two machine records."""
+    return [key for key in MACHINE_KEYS if recorded.get(key) != current.get(key)]
+
+
+def _machine() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "pymupdf": fitz.VersionBind,
+        "pillow": Image.__version__,
+    }
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.micro",
+        description=(
+            "Benchmark the rendering and JSON parsing hot paths on generated "
+            "inputs of increasing size."
+        ),
+    )
+    parser.add_argument(
+        "-k", dest="filter", help="only run cases whose name contains this"
+    )
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE_PATH)
+    parser.add_argument(
+        "--save", action="store_true", help="store the results as the new baseline"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help=(
+            "exit 1 if a case is slower than its baseline beyond --tolerance; "
+            "advisory only when the baseline came from a different machine"
+        ),
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="allowed slowdown as a fraction of the baseline (default: 0.25)",
+    )
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    mismatch = []
+    machine = _machine()
+    if args.baseline.exists():
+        recorded = json.loads(args.baseline.read_text())
+        baseline = recorded.get("cases", {})
+        mismatch = machine_mismatch(recorded.get("machine", {}), machine)
+
+    cases = {}
+    results = {}
+    for case in build_cases():
+        if args.filter and args.filter not in case.name:
+            continue
+        cases[case.name] = case
+        result = measure(case, args.rounds)
+        results[case.name] = result
+        line = (
+            f"{case.name:<32} median {_format_seconds(result['median_s']):>10}"
+            f"  iqr {_format_seconds(result['iqr_s']):>10}"
+        )
+        if case.name in baseline:
+            change = result["median_s"] / baseline[case.name]["median_s"] - 1
+            line += f"  {change:+.0%} vs baseline"
+        print(line, file=sys.stderr, flush=True)
+
+    curves = scaling(results)
+    print(file=sys.stderr)
+    for group, curve in curves.items():
+        steps = ", ".join(f"{step:.2f}" for step in curve["steps"])
+        flag = "  <- superlinear" if curve["superlinear"] else ""
+        print(
+            f"{group:<32} exponent {curve['exponent']:.2f} (steps {steps}){flag}",
+            file=sys.stderr,
+        )
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        # Re-measure before reporting, so one burst of load on the machine
+        # doesn't fail the check.
+        for name in regressions:
+            results[name] = measure(cases[name], args.rounds)
+        regressions = compare(
+            {name: results[name] for name in regressions}, baseline, args.tolerance
+        )
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": machine,
+        "cases": results,
+        "scaling": curves,
+        "regressions": regressions,
+        "machine_mismatch": mismatch,
+        "tolerance": args.tolerance,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        # Merge so a filtered run only replaces the cases it measured.
+        saved = {
+            **report,
+            "cases": {**baseline, **results},
+            "regressions": [],
+            "machine_mismatch": [],
+        }
+        args.baseline.write_text(json.dumps(saved, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+
+    if args.check:
+        if not baseline:
+            sys.exit(f"No baseline at {args.baseline}; run with --save first")
+        for name in regressions:
+            print(
+                f"REGRESSION {name}: {_format_seconds(results[name]['median_s'])}"
+                f" vs {_format_seconds(baseline[name]['median_s'])} baseline",
+                file=sys.stderr,
+            )
+        if mismatch:
+            print(
+                f"Baseline was recorded on a different machine "
+                f"({', '.join(mismatch)} differ); not failing the check",
+                file=sys.stderr,
+            )
+        elif regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Tokens Gemini bills for an image or document part, roughly.
+FILE_PART_TOKENS = 258
+
+# Streamed responses: the first chunk arrives after this share of the
+# sampled latency and the rest are spread evenly over the remainder.
+STREAM_FIRST_CHUNK_SHARE = 0.15
+STREAM_CHUNK_CHARS = 120
+
+
+@dataclass
+class Latency:
+    """Log-normal latency around a median; ``spread`` 0 makes it fixed."""
+
+    median_ms: float = 0.0
+    spread: float = 0.5
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        return self.median_ms / 1000 * math.exp(rng.gauss(0, self.spread))
+
+
+@dataclass
+class StubConfig:
+    generate: Latency = field(default_factory=lambda: Latency(2000))
+    upload: Latency = field(default_factory=lambda: Latency(150))
+    delete: Latency = field(default_factory=lambda: Latency(50))
+    sapling: Latency = field(default_factory=lambda: Latency(300))
+    # Share of generate calls answered with a 429, on top of the quota.
+    throttle_rate: float = 0.0
+    # Emulated generate requests-per-minute quota (0 = unlimited).
+    rpm: int = 0
+    seed: int | None = None
+
+
+class _Quota:
+    """Sliding one-minute window of accepted requests."""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self._accepted: deque[float] = deque()
+
+    def retry_after(self) -> float | None:
+        """Admit a request, or return how long until one would be admitted."""
+        if self.per_minute <= 0:
+            return None
+        now = time.monotonic()
+        while self._accepted and self._accepted[0] <= now - 60:
+            self._accepted.popleft()
+        if len(self._accepted) >= self.per_minute:
+            return self._accepted[0] + 60 - now
+        self._accepted.append(now)
+        return None
+
+
+def _throttled(retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={
+            "error": {
+                "code": 429,
+                "message": "Resource has been exhausted (e.g. check quota).",
+                "status": "RESOURCE_EXHAUSTED",
+                "details": [
+                    {
+                        "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                        "retryDelay": f"{max(1, math.ceil(retry_after))}s",
+                    }
+                ],
+            }
+        },
+    )
+
+
+def _prompt_tokens(body: dict) -> int:
+    tokens = 0
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                tokens += len(part["text"]) // 4
+            else:
+                tokens += FILE_PART_TOKENS
+    return tokens
+
+
+def _grading_response(rng: random.Random, ordering: list[str] | None = None) -> str:
+    criteria = [
+        {
+            "criteria_title": title,
+            "score": rng.randint(5, 10),
+            "score_max": 10,
+            "feedback": f"Stand-in feedback on {title.lower()}.",
+        }
+        for title in ("Thesis", "Evidence", "Organization", "Style")
+    ]
+    response = {
+        "name": "Bench Student",
+        "overall_feedback": "Stand-in overall feedback. " * 20,
+        "criteria_feedback": criteria,
+    }
+    ordering = [key for key in ordering or [] if key in response]
+    return json.dumps({key: response[key] for key in [*ordering, *response]})
+
+
+def _candidate(text: str, finish: bool) -> dict:
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    return candidate
+
+
+def create_gemini_app(config: StubConfig) -> FastAPI:
+    """Emulates (stream)generateContent and the Files API upload/list/delete calls."""
+    app = FastAPI()
+    rng = random.Random(config.seed)
+    quota = _Quota(config.rpm)
+    files: dict[str, dict] = {}
+    sessions: dict[str, dict] = {}
+    stats = {"generate": 0, "throttled": 0, "uploads": 0, "deletes": 0}
+
+    @app.post("/{version}/models/{target}")
+    async def generate(version: str, target: str, request: Request):
+        model, _, method = target.partition(":")
+        if method not in ("generateContent", "streamGenerateContent"):
+            return JSONResponse(status_code=404, content={"error": {"code": 404}})
+        body = await request.json()
+        retry_after = quota.retry_after()
+        if retry_after is None and rng.random() < config.throttle_rate:
+            retry_after = 1.0
+        if retry_after is not None:
+            stats["throttled"] += 1
+            return _throttled(retry_after)
+
+        latency = config.generate.sample(rng)
+        schema = body.get("generationConfig", {}).get("responseSchema") or {}
+        ordering = schema.get("propertyOrdering") or schema.get("property_ordering")
+        text = _grading_response(rng, ordering)
+        prompt_tokens = _prompt_tokens(body)
+
+        def usage(output: str) -> dict:
+            return {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": len(output) // 4,
+                "totalTokenCount": prompt_tokens + len(output) // 4,
+            }
+
+        if method == "generateContent":
+            await asyncio.sleep(latency)
+            stats["generate"] += 1
+            return {
+                "candidates": [_candidate(text, finish=True)],
+                "usageMetadata": usage(text),
+                "modelVersion": model,
+            }
+
+        async def chunks():
+            pieces = [
+                text[i : i + STREAM_CHUNK_CHARS]
+                for i in range(0, len(text), STREAM_CHUNK_CHARS)
+            ]
+            await asyncio.sleep(latency * STREAM_FIRST_CHUNK_SHARE)
+            interval = latency * (1 - STREAM_FIRST_CHUNK_SHARE) / len(pieces)
+            sent = ""
+            for number, piece in enumerate(pieces, 1):
+                if number > 1:
+                    await asyncio.sleep(interval)
+                sent += piece
+                chunk = {
+                    "candidates": [_candidate(piece, finish=number == len(pieces))],
+                    "usageMetadata": usage(sent),
+                    "modelVersion": model,
+                }
+                yield f"data: {json.dumps(chunk)}\r\n\r\n"
+            stats["generate"] += 1
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.post("/upload/{version}/files")
+    async def start_upload(version: str, request: Request):
+        body = await request.json()
+        session = uuid.uuid4().hex
+        meta = body.get("file", {})
+        sessions[session] = {
+            "displayName": meta.get("display_name") or meta.get("displayName"),
+            "mimeType": meta.get("mime_type")
+            or meta.get("mimeType")
+            or request.headers.get("x-goog-upload-header-content-type"),
+        }
+        url = f"{request.base_url}upload/{version}/files/sessions/{session}"
+        return Response(content="{}", headers={"x-goog-upload-url": url})
+
+    @app.post("/upload/{version}/files/sessions/{session}")
+    async def finish_upload(version: str, session: str, request: Request):
+        data = await request.body()
+        await asyncio.sleep(config.upload.sample(rng))
+        meta = sessions.pop(session, {})
+        now = datetime.now(timezone.utc)
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        file = {
+            "name": name,
+            "uri": f"{request.base_url}{version}/{name}",
+            "displayName": meta.get("displayName"),
+            "mimeType": meta.get("mimeType"),
+            "sizeBytes": str(len(data)),
+            "createTime": now.isoformat(),
+            "expirationTime": (now + timedelta(hours=48)).isoformat(),
+            "state": "ACTIVE",
+        }
+        files[file["name"]] = file
+        stats["uploads"] += 1
+        return JSONResponse(
+            content={"file": file}, headers={"x-goog-upload-status": "final"}
+        )
+
+    @app.get("/{version}/files")
+    async def list_files(version: str):
+        return {"files": list(files.values())}
+
+    @app.delete("/{version}/files/{file_id}")
+    async def delete_file(version: str, file_id: str):
+        await asyncio.sleep(config.delete.sample(rng))
+        files.pop(f"files/{file_id}", None)
+        stats["deletes"] += 1
+        return {}
+
+    @app.get("/_stats")
+    async def get_stats():
+        return {**stats, "files": len(files)}
+
+    return app
+
+
+def create_sapling_app(config: StubConfig) -> FastAPI:
+    """Emulates Sapling's AI detection endpoint."""
+    app = FastAPI()
+    rng = random.Random(config.seed)
+    stats = {"requests": 0}
+
+    @app.post("/api/v1/aidetect")
+    async def aidetect(request: Request):
+        body = await request.json()
+        await asyncio.sleep(config.sapling.sample(rng))
+        stats["requests"] += 1
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", body.get("text", "")) if s]
+        scores = [rng.random() for _ in sentences]
+        return {
+            "score": sum(scores) / len(scores) if scores else 0.0,
+            "sentence_scores": [
+                {"sentence": sentence, "score": score}
+                for sentence, score in zip(sentences, scores)
+            ],
+        }
+
+    @app.get("/_stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+async def serve(
+    config: StubConfig, host: str, gemini_port: int, sapling_port: int
+) -> None:
+    servers = [
+        uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        for app, port in (
+            (create_gemini_app(config), gemini_port),
+            (create_sapling_app(config), sapling_port),
+        )
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--generate-ms", type=float, default=2000)
+    parser.add_argument("--upload-ms", type=float, default=150)
+    parser.add_argument("--delete-ms", type=float, default=50)
+    parser.add_argument("--sapling-ms", type=float, default=300)
+    parser.add_argument(
+        "--latency-spread",
+        type=float,
+        default=0.5,
+        help="log-normal sigma of every latency (0 = fixed)",
+    )
+    parser.add_argument(
+        "--throttle-rate", type=float, default=0.0, help="share of random 429s"
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=0, help="emulated generate quota (0 = none)"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def stub_config(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        generate=Latency(args.generate_ms, args.latency_spread),
+        upload=Latency(args.upload_ms, args.latency_spread),
+        delete=Latency(args.delete_ms, args.latency_spread),
+        sapling=Latency(args.sapling_ms, args.latency_spread),
+        throttle_rate=args.throttle_rate,
+        rpm=args.rpm,
+        seed=args.seed,
+    )
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.stubs",
+        description="Serve local stand-ins for the Gemini and Sapling APIs.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--gemini-port", type=int, default=8701)
+    parser.add_argument("--sapling-port", type=int, default=8702)
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    print(
+        f"GEMINI_BASE_URL=http://{args.host}:{args.gemini_port}\n"
+        f"SAPLING_API_URL=http://{args.host}:{args.sapling_port}/api/v1/aidetect",
+        flush=True,
+    )
+    asyncio.run(
+        serve(stub_config(args), args.host, args.gemini_port, args.sapling_port)
+    )
+
+
+if __name__ == "__main__":
+    main()
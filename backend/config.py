@@ -1,5 +1,8 @@
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 ALLOWED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".txt"}
 
 GEMINI_NATIVE_FORMATS = {
@@ -13,6 +16,46 @@ GEMINI_NATIVE_FORMATS = {
 
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
+DEFAULT_BATCH_CONCURRENCY = 8
+
+DEFAULT_RUBRIC_CACHE_MAX_ENTRIES = 32
+DEFAULT_RUBRIC_CACHE_TTL_SECONDS = 46 * 60 * 60  # Files API keeps uploads 48h
+
+DEFAULT_INLINE_MAX_BYTES = 1024 * 1024  # 1MB
+
+DEFAULT_FILE_SWEEP_INTERVAL_SECONDS = 10 * 60
+DEFAULT_FILE_SWEEP_MAX_AGE_SECONDS = 60 * 60
+
+DEFAULT_RENDER_PARALLEL_MIN_PAGES = 8
+
+DEFAULT_RENDER_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512MB
+
+DEFAULT_DOCUMENT_STORE_MAX_BYTES = 1024 * 1024 * 1024  # 1GB
+
+DEFAULT_SAPLING_API_URL = "https://api.sapling.ai/api/v1/aidetect"
+DEFAULT_SAPLING_TIMEOUT_SECONDS = 30.0
+DEFAULT_SAPLING_MAX_RETRIES = 3
+DEFAULT_SAPLING_CONCURRENCY = 8
+DEFAULT_SAPLING_CHUNK_CHARS = 20_000  # the API accepts up to 200,000
+DEFAULT_AI_DETECTION_CACHE_MAX_ENTRIES = 1024
+
+DEFAULT_TEXT_CACHE_MAX_ENTRIES = 256
+DEFAULT_TEXT_MIN_CHARS_PER_PAGE = 200
+
+DEFAULT_GEMINI_MAX_CONCURRENCY = 32
+DEFAULT_GEMINI_MAX_RETRIES = 4
+
+DEFAULT_JOB_WORKERS = 4
+DEFAULT_JOB_LEASE_SECONDS = 60.0
+DEFAULT_JOB_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+_TRUE_WORDS = {"1", "true", "yes", "on"}
+_FALSE_WORDS = {"0", "false", "no", "off"}
+
+GRADE_CACHE_BACKENDS = {"off", "memory", "sqlite"}
+DEFAULT_GRADE_CACHE_MAX_ENTRIES = 1024
+DEFAULT_GRADE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 256MB
+
 DEFAULT_GRADING_SCALE = {"type": "numeric", "max_points": 10}
 
 STANDARD_LETTER_GRADE_BOUNDARIES = {
@@ -70,14 +113,261 @@ DEFAULT_ESSAY_RUBRIC = {
 }
 
 
+def _int_env(
+    name: str, default: int, minimum: int | None = None, maximum: int | None = None
+) -> int:
+    """Read an integer setting, falling back to ``default`` when it is invalid."""
+    return _clamp(_number_env(name, default, int), minimum, maximum)
+
+
+def _float_env(name: str, default: float, minimum: float | None = None) -> float:
+    """Read a float setting, falling back to ``default`` when it is invalid."""
+    return float(_clamp(_number_env(name, default, float), minimum, None))
+
+
+def _bool_env(name: str, default: bool) -> bool:
+    """Read an on/off setting; anything but a recognised word keeps ``default``."""
+    value = os.getenv(name, "").strip().lower()
+    if value in _TRUE_WORDS:
+        return True
+    if value in _FALSE_WORDS:
+        return False
+    if value:
+        logger.warning(f"Ignoring invalid {name}={value!r}; using {default}")
+    return default
+
+
+def _number_env(name: str, default, parse):
+    value = os.getenv(name, "").strip()
+    if not value:
+        return default
+    try:
+        return parse(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {name}={value!r}; using {default}")
+        return default
+
+
+def _clamp(value, minimum, maximum):
+    if minimum is not None:
+        value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
+
+
 def get_gemini_model() -> str:
     """Get the configured Gemini model."""
     return os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 
 
+def get_gemini_base_url() -> str | None:
+    """Get an alternative Gemini API endpoint (e.g. a local stand-in), if set."""
+    return os.getenv("GEMINI_BASE_URL", "").strip() or None
+
+
 def get_api_key() -> str:
     """Get the Gemini API key from environment."""
     return (
         os.getenv("GEMINI_API_KEY", "").strip()
         or os.getenv("GOOGLE_API_KEY", "").strip()
     )
+
+
+def get_gemini_rpm() -> int:
+    """Get the Gemini requests-per-minute quota to stay under (0 = no limit)."""
+    return _int_env("GEMINI_RPM", 0, minimum=0)
+
+
+def get_gemini_tpm() -> int:
+    """Get the Gemini tokens-per-minute quota to stay under (0 = no limit)."""
+    return _int_env("GEMINI_TPM", 0, minimum=0)
+
+
+def get_gemini_max_concurrency() -> int:
+    """Get the ceiling for adaptive Gemini request concurrency."""
+    return _int_env("GEMINI_MAX_CONCURRENCY", DEFAULT_GEMINI_MAX_CONCURRENCY, minimum=1)
+
+
+def get_gemini_max_retries() -> int:
+    """Get how many times a throttled or failed Gemini call is retried."""
+    return _int_env("GEMINI_MAX_RETRIES", DEFAULT_GEMINI_MAX_RETRIES, minimum=0)
+
+
+def get_batch_concurrency() -> int:
+    """Get the maximum number of assignments graded at once in a batch."""
+    return _int_env("GRADE_BATCH_CONCURRENCY", DEFAULT_BATCH_CONCURRENCY, minimum=1)
+
+
+def get_rubric_cache_max_entries() -> int:
+    """Get the number of uploaded rubric handles kept in the Files API cache."""
+    return _int_env(
+        "RUBRIC_CACHE_MAX_ENTRIES", DEFAULT_RUBRIC_CACHE_MAX_ENTRIES, minimum=1
+    )
+
+
+def get_rubric_cache_ttl_seconds() -> float:
+    """Get how long an uploaded rubric handle is reused before re-uploading."""
+    return _float_env(
+        "RUBRIC_CACHE_TTL_SECONDS", DEFAULT_RUBRIC_CACHE_TTL_SECONDS, minimum=0.0
+    )
+
+
+def get_grade_cache_backend() -> str:
+    """Get the grading result cache backend: off (default), memory or sqlite."""
+    backend = os.getenv("GRADE_CACHE_BACKEND", "off").strip().lower()
+    return backend if backend in GRADE_CACHE_BACKENDS else "off"
+
+
+def get_grade_cache_path() -> str:
+    """Get the SQLite file used by the sqlite grading result cache."""
+    return os.getenv("GRADE_CACHE_PATH", ".cache/grading_results.sqlite3")
+
+
+def get_grade_cache_max_entries() -> int:
+    """Get the number of results kept by the memory grading result cache."""
+    return _int_env(
+        "GRADE_CACHE_MAX_ENTRIES", DEFAULT_GRADE_CACHE_MAX_ENTRIES, minimum=1
+    )
+
+
+def get_grade_cache_max_bytes() -> int:
+    """Get the size cap of the sqlite grading result cache."""
+    return _int_env("GRADE_CACHE_MAX_BYTES", DEFAULT_GRADE_CACHE_MAX_BYTES, minimum=0)
+
+
+def get_corpus_index_path() -> str:
+    """Get the SQLite file holding the plagiarism corpus of past submissions."""
+    return os.getenv("CORPUS_INDEX_PATH", ".cache/corpus.sqlite3")
+
+
+def get_inline_max_bytes() -> int:
+    """Get the size up to which files are sent inline instead of uploaded."""
+    return _int_env("GEMINI_INLINE_MAX_BYTES", DEFAULT_INLINE_MAX_BYTES, minimum=0)
+
+
+def get_file_sweep_interval_seconds() -> float:
+    """Get how often stale Files API uploads are swept."""
+    return _float_env(
+        "FILE_SWEEP_INTERVAL_SECONDS", DEFAULT_FILE_SWEEP_INTERVAL_SECONDS, minimum=1.0
+    )
+
+
+def get_file_sweep_max_age_seconds() -> float:
+    """Get the age after which an assignment upload is considered orphaned."""
+    return _float_env(
+        "FILE_SWEEP_MAX_AGE_SECONDS", DEFAULT_FILE_SWEEP_MAX_AGE_SECONDS, minimum=0.0
+    )
+
+
+def get_render_pool_size() -> int:
+    """Get the number of processes used to render PDF pages in parallel."""
+    return _int_env("RENDER_POOL_SIZE", os.cpu_count() or 1, minimum=1)
+
+
+def get_render_parallel_min_pages() -> int:
+    """Get the page count from which PDFs are rendered in the process pool."""
+    return _int_env(
+        "RENDER_PARALLEL_MIN_PAGES", DEFAULT_RENDER_PARALLEL_MIN_PAGES, minimum=1
+    )
+
+
+def get_render_cache_dir() -> str:
+    """Get the directory holding cached rendered page images."""
+    return os.getenv("RENDER_CACHE_DIR", ".cache/renders")
+
+
+def get_render_cache_max_bytes() -> int:
+    """Get the size cap of the render cache (0 disables it)."""
+    return _int_env("RENDER_CACHE_MAX_BYTES", DEFAULT_RENDER_CACHE_MAX_BYTES, minimum=0)
+
+
+def get_document_store_dir() -> str:
+    """Get the directory holding uploaded documents served as lazy page images."""
+    return os.getenv("DOCUMENT_STORE_DIR", ".cache/documents")
+
+
+def get_document_store_max_bytes() -> int:
+    """Get the size cap of the uploaded document store."""
+    return _int_env(
+        "DOCUMENT_STORE_MAX_BYTES", DEFAULT_DOCUMENT_STORE_MAX_BYTES, minimum=0
+    )
+
+
+def get_sapling_api_url() -> str:
+    """Get the Sapling AI detector endpoint (overridable for a local stand-in)."""
+    return os.getenv("SAPLING_API_URL", DEFAULT_SAPLING_API_URL).strip()
+
+
+def get_sapling_timeout_seconds() -> float:
+    """Get the timeout of a single Sapling request."""
+    value = _float_env("SAPLING_TIMEOUT_SECONDS", DEFAULT_SAPLING_TIMEOUT_SECONDS)
+    return value if value > 0 else DEFAULT_SAPLING_TIMEOUT_SECONDS
+
+
+def get_sapling_max_retries() -> int:
+    """Get how many times a Sapling request is retried on 429/5xx or connect errors."""
+    return _int_env("SAPLING_MAX_RETRIES", DEFAULT_SAPLING_MAX_RETRIES, minimum=0)
+
+
+def get_sapling_concurrency() -> int:
+    """Get how many Sapling requests may be in flight at once."""
+    return _int_env("SAPLING_CONCURRENCY", DEFAULT_SAPLING_CONCURRENCY, minimum=1)
+
+
+def get_sapling_chunk_chars() -> int:
+    """Get the size of the sentence-aligned chunks long texts are split into."""
+    return _int_env(
+        "SAPLING_CHUNK_CHARS",
+        DEFAULT_SAPLING_CHUNK_CHARS,
+        minimum=1000,
+        maximum=200_000,
+    )
+
+
+def get_ai_detection_cache_max_entries() -> int:
+    """Get the number of AI detection results kept, keyed by text hash."""
+    return _int_env(
+        "AI_DETECTION_CACHE_MAX_ENTRIES",
+        DEFAULT_AI_DETECTION_CACHE_MAX_ENTRIES,
+        minimum=1,
+    )
+
+
+def get_gemini_text_first() -> bool:
+    """Whether assignments with a usable text layer are graded from their text."""
+    return _bool_env("GEMINI_TEXT_FIRST", True)
+
+
+def get_text_min_chars_per_page() -> int:
+    """Get the text density below which a PDF is treated as a scan."""
+    return _int_env(
+        "TEXT_MIN_CHARS_PER_PAGE", DEFAULT_TEXT_MIN_CHARS_PER_PAGE, minimum=0
+    )
+
+
+def get_text_cache_max_entries() -> int:
+    """Get the number of uploads whose extracted text is kept in memory."""
+    return _int_env("TEXT_CACHE_MAX_ENTRIES", DEFAULT_TEXT_CACHE_MAX_ENTRIES, minimum=1)
+
+
+def get_job_store_path() -> str:
+    """Get the SQLite file holding queued and finished grading jobs."""
+    return os.getenv("JOB_STORE_PATH", ".cache/jobs.sqlite3")
+
+
+def get_job_workers() -> int:
+    """Get the number of grading jobs run at once by each server process."""
+    return _int_env("JOB_WORKERS", DEFAULT_JOB_WORKERS, minimum=1)
+
+
+def get_job_lease_seconds() -> float:
+    """Get how long a running job may go without a heartbeat before it is retried."""
+    return _float_env("JOB_LEASE_SECONDS", DEFAULT_JOB_LEASE_SECONDS, minimum=5.0)
+
+
+def get_job_retention_seconds() -> float:
+    """Get how long finished jobs and their results are kept."""
+    return _float_env(
+        "JOB_RETENTION_SECONDS", DEFAULT_JOB_RETENTION_SECONDS, minimum=0.0
+    )
@@ -1,21 +1,89 @@
 import asyncio
+import json
 import logging
 import os
-import tempfile
+import time
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from typing import Literal
+from urllib.parse import urlencode
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, UploadFile
+from fastapi import (
+    Depends,
+    FastAPI,
+    File,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
-from services.file_to_image import convert_to_image
-from services.graderv2 import grade_work
+from config import ALLOWED_EXTENSIONS, get_batch_concurrency, get_gemini_text_first
+from services.corpus_index import corpus_id
+from services.detector import (
+    analyze_essay_authenticity_cached,
+    close_detector,
+    error_result,
+)
+from services.document_store import get_document_store
+from services.file_cleanup import file_cleanup
+from services.file_to_image import (
+    ImageOptions,
+    convert_to_image,
+    count_pages,
+    iter_images,
+    render_page,
+    shutdown_render_pool,
+)
+from services.gemini_client import close_client, init_client
+from services.gemini_scheduler import Priority, get_gemini_scheduler
+from services.graderv2 import grade_work, stream_grade_work
+from services.jobs import IdempotencyConflict, JobInput, job_queue
+from services.metrics import (
+    CONTENT_TYPE,
+    GEMINI_CONCURRENCY_LIMIT,
+    GEMINI_IN_FLIGHT,
+    GEMINI_QUEUED,
+    HTTP_REQUEST_SECONDS,
+    JOBS,
+    render_metrics,
+    request_timings,
+    server_timing,
+)
+from services.rubric_cache import rubric_cache
+from services.plagiarism import add_to_corpus, check_plagiarism
+from services.text_extraction import (
+    TEXT_EXTRACTABLE_EXTENSIONS,
+    get_extracted_text,
+)
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    client = init_client()
+    if client is not None:
+        file_cleanup.start(client)
+    job_queue.start(_run_grading_job)
+    yield
+    await job_queue.stop()
+    rubric_cache.clear()
+    await file_cleanup.stop()
+    await close_client()
+    shutdown_render_pool()
+    close_detector()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,15 +91,148 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
 
-def _save_temp(upload_file: UploadFile) -> str:
-    suffix = os.path.splitext(upload_file.filename or "")[1]
-    upload_file.file.seek(0)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(upload_file.file.read())
-        return tmp.name
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    """Time each request and report its stages in a Server-Timing header."""
+    timings: dict[str, float] = {}
+    token = request_timings.set(timings)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    # Streaming responses are timed to their headers; their stages still
+    # land in the stage histograms as they finish.
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        elapsed,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code,
+    )
+    response.headers["Server-Timing"] = server_timing(timings, elapsed)
+    return response
+
+
+def image_options(
+    image_format: Literal["png", "jpeg", "webp"] = "png",
+    image_quality: int = Query(85, ge=1, le=100),
+    image_dpi: int = Query(144, ge=18, le=600),
+    image_max_dimension: int | None = Query(None, ge=16, le=10000),
+    thumbnails: bool = False,
+) -> ImageOptions:
+    try:
+        return ImageOptions(
+            format=image_format,
+            quality=image_quality,
+            dpi=image_dpi,
+            max_dimension=image_max_dimension,
+            thumbnails=thumbnails,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _image_query(options: ImageOptions) -> str:
+    params = {
+        "image_format": options.format,
+        "image_quality": options.quality,
+        "image_dpi": options.dpi,
+    }
+    if options.max_dimension is not None:
+        params["image_max_dimension"] = options.max_dimension
+    if options.thumbnails:
+        params["thumbnails"] = "true"
+    return urlencode(params)
+
+
+def _document_reference(data: bytes, ext: str, options: ImageOptions) -> dict:
+    """Store an upload and describe its pages as lazily rendered image URLs."""
+    store = get_document_store()
+    doc_id = store.save(data, ext)
+    page_count = count_pages(data, ext, doc_id)
+    base = f"/api/documents/{doc_id}/pages"
+
+    page_query = _image_query(
+        ImageOptions(
+            format=options.format,
+            quality=options.quality,
+            dpi=options.dpi,
+            max_dimension=options.max_dimension,
+        )
+    )
+    reference = {
+        "id": doc_id,
+        "page_count": page_count,
+        "mime_type": options.mime_type,
+        "pages": [f"{base}/{i}?{page_query}" for i in range(page_count)],
+    }
+    if options.thumbnails:
+        thumbnail_query = _image_query(options)
+        reference["thumbnails"] = [
+            f"{base}/{i}?{thumbnail_query}" for i in range(page_count)
+        ]
+    return reference
+
+
+def _start_extraction(
+    data: bytes, ext: str, always: bool = False
+) -> asyncio.Task | None:
+    """
+    Start extracting an upload's text once, for grading, AI detection and
+    plagiarism, without waiting for it.
+
+    Grading only reads it with GEMINI_TEXT_FIRST on, so otherwise it is only
+    extracted when ``always`` is set. Returns None for file types without
+    text; each consumer awaits the task and handles a failed extraction.
+    """
+    if ext not in TEXT_EXTRACTABLE_EXTENSIONS:
+        return None
+    if not always and not get_gemini_text_first():
+        return None
+    task = asyncio.create_task(asyncio.to_thread(get_extracted_text, data, ext))
+    # A consumer that returns early never awaits it; don't log its error then.
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+async def _extracted_text(extraction: asyncio.Task | None) -> str:
+    """The text an extraction task produced, or "" when there is none."""
+    if extraction is None:
+        return ""
+    try:
+        return (await extraction).text
+    except Exception as e:
+        logger.error(f"Text extraction failed: {str(e)}")
+        return ""
+
+
+async def _ai_detection(extraction: asyncio.Task | None, ext: str) -> dict | None:
+    """Score an assignment's text for AI authorship (None when it has no text)."""
+    if ext not in TEXT_EXTRACTABLE_EXTENSIONS or extraction is None:
+        return None
+    try:
+        text = (await extraction).text
+    except Exception as e:
+        logger.error(f"Text extraction failed: {str(e)}")
+        return error_result("AI detection failed", "Text extraction failed")
+    try:
+        if not text.strip():
+            return None
+        analysis = await analyze_essay_authenticity_cached(text)
+    except Exception as e:
+        logger.error(f"AI detection failed: {str(e)}")
+        return error_result("AI detection failed", str(e))
+    return {
+        **analysis["ai_detection"],
+        "authentic": analysis["authentic"],
+        "flags": analysis["flags"],
+    }
 
 
 def _format_response(grading_result: dict, ai_detection: dict | None = None) -> dict:
@@ -81,21 +282,47 @@ def health():
         "status": "ok",
         "gemini_configured": has_key,
         "model": os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
+        "file_cleanup": file_cleanup.stats(),
+        "gemini_scheduler": get_gemini_scheduler().stats(),
+        "jobs": job_queue.stats(),
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    scheduler = get_gemini_scheduler().stats()
+    GEMINI_CONCURRENCY_LIMIT.set(scheduler["concurrency_limit"])
+    GEMINI_IN_FLIGHT.set(scheduler["in_flight"])
+    for lane, queued in scheduler["queued"].items():
+        GEMINI_QUEUED.set(queued, lane=lane)
+    jobs = await asyncio.to_thread(job_queue.store.counts)
+    for status, count in jobs.items():
+        JOBS.set(count, status=status)
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+
 @app.post("/api/gradev2")
 async def gradev2(
     assignment: UploadFile = File(...),
     rubric: UploadFile = File(...),
     notes: str = "",
+    cache: str = "use",
+    stream: bool = False,
+    image_mode: Literal["inline", "lazy"] = "inline",
+    detect_ai: bool = False,
+    options: ImageOptions = Depends(image_options),
 ):
     logger.info(
         f"Received gradev2 request - assignment: {assignment.filename}, rubric: {rubric.filename}"
     )
-    rubric_path = None
-    assignment_path = None
+    if stream and image_mode == "lazy":
+        # Lazy mode has no page images to stream; its pages are fetched by URL.
+        raise HTTPException(
+            status_code=400, detail="stream=true can't be combined with lazy images"
+        )
     try:
+        # Each upload is read exactly once; the same buffer feeds grading,
+        # rendering and hashing without a temp file round trip.
         logger.info("Reading rubric file")
         rubric.file.seek(0)
         rubric_bytes = rubric.file.read()
@@ -115,44 +342,480 @@ async def gradev2(
             ".txt",
         }
 
-        assignment_path = None
-        if assignment_ext in allowed_ext:
-            assignment_path = _save_temp(assignment)
-            image_task = asyncio.to_thread(convert_to_image, assignment_path)
-        else:
-
-            async def no_image():
-                return {}
+        has_images = assignment_ext in allowed_ext
 
-            image_task = no_image()
-
-        grading_task = asyncio.to_thread(
-            grade_work,
+        # Grading and detection share one extraction of the text, which runs
+        # alongside the rubric upload and rendering.
+        assignment_text = _start_extraction(
+            assignment_bytes, assignment_ext, always=detect_ai
+        )
+        grading_task = grade_work(
             rubric=rubric_bytes,
             rubric_filename=rubric.filename or "rubric.pdf",
             notes=notes,
             assignment=assignment_bytes,
             assignment_filename=assignment.filename or "assignment.pdf",
+            cache_mode=cache,
+            assignment_text=assignment_text,
         )
+        # Detection runs alongside grading and rendering, so it adds no
+        # wall-clock time unless it is the slowest stage.
+        detection_task = (
+            _ai_detection(assignment_text, assignment_ext) if detect_ai else None
+        )
+
+        if image_mode == "lazy":
+            # Pages are rendered on demand by GET /api/documents/{id}/pages/{n}.
+            result, document, detection = await asyncio.gather(
+                grading_task,
+                (
+                    asyncio.to_thread(
+                        _document_reference, assignment_bytes, assignment_ext, options
+                    )
+                    if has_images
+                    else asyncio.sleep(0, None)
+                ),
+                detection_task or asyncio.sleep(0, None),
+            )
+            if "error" in result:
+                logger.error(f"Grade work returned error: {result}")
+                return result
+            if document is not None:
+                result["document"] = document
+            if detection is not None:
+                result["ai_detection"] = detection
+            logger.info("gradev2 request completed successfully")
+            return result
+
+        if stream:
+            return StreamingResponse(
+                _stream_gradev2(
+                    grading_task,
+                    assignment_bytes if has_images else None,
+                    assignment_ext,
+                    options,
+                    detection_task,
+                ),
+                media_type="application/x-ndjson",
+            )
+
+        if has_images:
+            image_task = asyncio.to_thread(
+                convert_to_image, assignment_bytes, assignment_ext, options
+            )
+        else:
 
-        result, image_result = await asyncio.gather(grading_task, image_task)
+            async def no_image():
+                return {}
+
+            image_task = no_image()
+
+        result, image_result, detection = await asyncio.gather(
+            grading_task, image_task, detection_task or asyncio.sleep(0, None)
+        )
 
         if "error" in result:
             logger.error(f"Grade work returned error: {result}")
             return result
 
-        if assignment_ext in allowed_ext:
+        if has_images:
             result["images"] = image_result.get("images", []) if image_result else []
+            result["image_mime_type"] = options.mime_type
+            if options.thumbnails and image_result:
+                result["thumbnails"] = image_result.get("thumbnails", [])
             logger.info("Image conversion completed")
 
+        if detection is not None:
+            result["ai_detection"] = detection
+
         logger.info("gradev2 request completed successfully")
         return result
 
     except Exception as e:
         logger.error(f"gradev2 request failed: {str(e)}")
         return {"error": "Grading failed", "detail": str(e)}
+
+
+async def _stream_gradev2(
+    grading,
+    assignment: bytes | None,
+    ext: str,
+    options: ImageOptions,
+    detection=None,
+):
+    """
+    Stream NDJSON events for a gradev2 request.
+
+    Each page image (and its thumbnail, when requested) is written as soon
+    as it is rendered, independently of grading, and only one rendered page
+    is held at a time. The grading result
+    and, when requested, the ``ai_detection`` event are written whenever they
+    finish, followed by a final ``done`` event.
+    """
+    grading_task = asyncio.ensure_future(grading)
+    pages = iter_images(assignment, ext, options) if assignment else iter(())
+    thumbnails = (
+        iter_images(assignment, ext, options.thumbnail_options())
+        if assignment and options.thumbnails
+        else None
+    )
+
+    def render_next():
+        image = next(pages, None)
+        if image is None or thumbnails is None:
+            return image, None
+        return image, next(thumbnails, None)
+
+    next_page = asyncio.ensure_future(asyncio.to_thread(render_next))
+    pending = {grading_task, next_page}
+    detection_task = None
+    if detection is not None:
+        detection_task = asyncio.ensure_future(detection)
+        pending.add(detection_task)
+    page_count = 0
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if grading_task in done:
+                try:
+                    result = grading_task.result()
+                except Exception as e:
+                    logger.error(f"gradev2 stream grading failed: {str(e)}")
+                    result = {"error": "Grading failed", "detail": str(e)}
+                if "error" in result:
+                    yield json.dumps({"type": "error", **result}) + "\n"
+                else:
+                    yield json.dumps({"type": "result", **result}) + "\n"
+
+            if detection_task in done:
+                detection_result = detection_task.result()
+                if detection_result is not None:
+                    yield json.dumps(
+                        {"type": "ai_detection", **detection_result}
+                    ) + "\n"
+
+            if next_page in done:
+                try:
+                    image, thumbnail = next_page.result()
+                except Exception as e:
+                    logger.error(f"gradev2 stream image conversion failed: {str(e)}")
+                    yield json.dumps(
+                        {"type": "error", "error": "Image conversion failed"}
+                    ) + "\n"
+                    continue
+                if image is None:
+                    continue
+                page = {
+                    "type": "page",
+                    "index": page_count,
+                    "mime_type": options.mime_type,
+                    "image": image,
+                }
+                if thumbnail is not None:
+                    page["thumbnail"] = thumbnail
+                yield json.dumps(page) + "\n"
+                page_count += 1
+                next_page = asyncio.ensure_future(asyncio.to_thread(render_next))
+                pending.add(next_page)
+
+        yield json.dumps({"type": "done", "page_count": page_count}) + "\n"
+        logger.info("gradev2 stream completed successfully")
     finally:
-        if rubric_path and os.path.isfile(rubric_path):
-            os.unlink(rubric_path)
-        if assignment_path and os.path.isfile(assignment_path):
-            os.unlink(assignment_path)
+        grading_task.cancel()
+        if detection_task is not None:
+            detection_task.cancel()
+
+        # Close the renderers now, not at GC, so a client that disconnects
+        # doesn't keep the PDF open and its render pool slot taken. A page
+        # still rendering in its thread is allowed to finish first.
+        def close_renderers():
+            for renderer in (pages, thumbnails):
+                close = getattr(renderer, "close", None)
+                if close is not None:
+                    close()
+
+        if next_page.done():
+            close_renderers()
+        else:
+            next_page.add_done_callback(lambda _: close_renderers())
+
+
+@app.post("/api/gradev2/events")
+async def gradev2_events(
+    assignment: UploadFile = File(...),
+    rubric: UploadFile = File(...),
+    notes: str = "",
+    cache: str = "use",
+):
+    logger.info(
+        f"Received gradev2 events request - assignment: {assignment.filename}, rubric: {rubric.filename}"
+    )
+    rubric.file.seek(0)
+    rubric_bytes = rubric.file.read()
+    assignment.file.seek(0)
+    assignment_bytes = assignment.file.read()
+
+    # Server-Sent Events: a ``criterion`` per criteria_feedback item and then
+    # ``overall_feedback`` as Gemini writes them, followed by the validated
+    # ``result`` (as /api/gradev2 returns it) or an ``error``.
+    async def events():
+        async for event, data in stream_grade_work(
+            rubric=rubric_bytes,
+            rubric_filename=rubric.filename or "rubric.pdf",
+            notes=notes,
+            assignment=assignment_bytes,
+            assignment_filename=assignment.filename or "assignment.pdf",
+            cache_mode=cache,
+        ):
+            if event == "error":
+                logger.error(f"Streamed grading returned error: {data}")
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/documents/{doc_id}/pages/{page}")
+async def document_page(
+    doc_id: str,
+    page: int,
+    request: Request,
+    options: ImageOptions = Depends(image_options),
+):
+    document = await asyncio.to_thread(get_document_store().load, doc_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    render_options = options.thumbnail_options() if options.thumbnails else options
+    # Documents are content addressed, so a page URL always maps to the same bytes.
+    etag = f'"{doc_id}-{render_options.cache_key()}-{page}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        data = await asyncio.to_thread(
+            render_page, *document, page, render_options, doc_id
+        )
+    except IndexError:
+        raise HTTPException(status_code=404, detail="Page not found")
+
+    return Response(content=data, media_type=render_options.mime_type, headers=headers)
+
+
+@app.post("/api/gradev2/batch")
+async def gradev2_batch(
+    assignments: list[UploadFile] = File(...),
+    rubric: UploadFile = File(...),
+    notes: str = "",
+    stream: bool = False,
+    cache: str = "use",
+    plagiarism: bool = False,
+    corpus: bool = False,
+    term: str | None = None,
+):
+    logger.info(
+        f"Received gradev2 batch request - {len(assignments)} assignments, rubric: {rubric.filename}"
+    )
+    rubric.file.seek(0)
+    rubric_bytes = rubric.file.read()
+    rubric_filename = rubric.filename or "rubric.pdf"
+
+    # Uploads are read up front: in streaming mode the form files are closed
+    # once the endpoint returns, before every task has started.
+    uploads = []
+    for i, assignment in enumerate(assignments):
+        assignment.file.seek(0)
+        uploads.append(
+            (assignment.filename or f"assignment_{i}.pdf", assignment.file.read())
+        )
+
+    semaphore = asyncio.Semaphore(get_batch_concurrency())
+    # Each upload's text, extracted once while grading it and reused by the
+    # plagiarism check.
+    extractions: list[asyncio.Task | None] = [None] * len(uploads)
+
+    corpus_ids = [corpus_id(data, term) for _, data in uploads]
+
+    async def plagiarism_report() -> dict:
+        texts = list(await asyncio.gather(*map(_extracted_text, extractions)))
+        filenames = [f for f, _ in uploads]
+        report = await check_plagiarism(
+            texts, filenames, use_corpus=corpus, corpus_ids=corpus_ids
+        )
+        if corpus:
+            # Indexed after the check so the batch doesn't match itself.
+            await add_to_corpus(texts, corpus_ids, term, filenames)
+        return report
+
+    async def grade_one(index: int, filename: str, assignment_bytes: bytes) -> dict:
+        async with semaphore:
+            try:
+                extractions[index] = _start_extraction(
+                    assignment_bytes,
+                    os.path.splitext(filename)[1].lower(),
+                    always=plagiarism or corpus,
+                )
+                result = await grade_work(
+                    rubric=rubric_bytes,
+                    rubric_filename=rubric_filename,
+                    notes=notes,
+                    assignment=assignment_bytes,
+                    assignment_filename=filename,
+                    cache_mode=cache,
+                    assignment_text=extractions[index],
+                    priority=Priority.BULK,
+                )
+            except Exception as e:
+                logger.error(f"Batch grading failed for {filename}: {str(e)}")
+                result = {"error": "Grading failed", "detail": str(e)}
+
+        if "error" in result:
+            result.setdefault("name", filename)
+        return {"index": index, "filename": filename, **result}
+
+    tasks = [
+        asyncio.create_task(grade_one(i, filename, assignment_bytes))
+        for i, (filename, assignment_bytes) in enumerate(uploads)
+    ]
+
+    if stream:
+
+        async def stream_results():
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    yield json.dumps(await next_done) + "\n"
+                if plagiarism or corpus:
+                    yield json.dumps({"plagiarism": await plagiarism_report()}) + "\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    results = await asyncio.gather(*tasks)
+    logger.info(f"gradev2 batch request completed - {len(results)} results")
+    response = {"results": results, "total": len(results)}
+    if plagiarism or corpus:
+        response["plagiarism"] = await plagiarism_report()
+    return response
+
+
+# SSE comment lines sent while a job is unchanged, so proxies don't close
+# the idle connection.
+JOB_EVENTS_KEEPALIVE_SECONDS = 15.0
+
+
+async def _run_grading_job(job: JobInput) -> dict:
+    """Grade a queued assignment; the result matches gradev2's lazy response."""
+    ext = os.path.splitext(job.assignment_filename)[1].lower()
+    detect_ai = job.params.get("detect_ai", False)
+    assignment_text = _start_extraction(job.assignment, ext, always=detect_ai)
+    grading = grade_work(
+        rubric=job.rubric,
+        rubric_filename=job.rubric_filename,
+        notes=job.params.get("notes", ""),
+        assignment=job.assignment,
+        assignment_filename=job.assignment_filename,
+        cache_mode=job.params.get("cache", "use"),
+        assignment_text=assignment_text,
+        priority=Priority.BULK,
+    )
+    detection = _ai_detection(assignment_text, ext) if detect_ai else None
+    result, detection = await asyncio.gather(
+        grading, detection or asyncio.sleep(0, None)
+    )
+    if "error" in result:
+        return result
+
+    if ext in ALLOWED_EXTENSIONS:
+        options = ImageOptions(**job.params.get("image", {}))
+        result["document"] = await asyncio.to_thread(
+            _document_reference, job.assignment, ext, options
+        )
+    if detection is not None:
+        result["ai_detection"] = detection
+    return result
+
+
+def _job_response(job: dict) -> dict:
+    return {
+        **job,
+        "status_url": f"/api/jobs/{job['id']}",
+        "events_url": f"/api/jobs/{job['id']}/events",
+    }
+
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(
+    response: Response,
+    assignment: UploadFile = File(...),
+    rubric: UploadFile = File(...),
+    notes: str = "",
+    cache: str = "use",
+    detect_ai: bool = False,
+    options: ImageOptions = Depends(image_options),
+    idempotency_key: str | None = Header(None),
+):
+    logger.info(
+        f"Received job request - assignment: {assignment.filename}, rubric: {rubric.filename}"
+    )
+    rubric.file.seek(0)
+    assignment.file.seek(0)
+    job_input = JobInput(
+        rubric=rubric.file.read(),
+        rubric_filename=rubric.filename or "rubric.pdf",
+        assignment=assignment.file.read(),
+        assignment_filename=assignment.filename or "assignment.pdf",
+        params={
+            "notes": notes,
+            "cache": cache,
+            "detect_ai": detect_ai,
+            "image": asdict(options),
+        },
+    )
+
+    try:
+        job, created = await job_queue.submit(job_input, idempotency_key)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if not created:
+        response.status_code = 200
+    response.headers["Location"] = f"/api/jobs/{job['id']}"
+    return _job_response(job)
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    if await job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async for job in job_queue.watch(job_id, JOB_EVENTS_KEEPALIVE_SECONDS):
+            if job is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,7 +1,8 @@
-from .detector import detect_ai_text, analyze_essay_authenticity
+from .detector import detect_ai_batch, detect_ai_text, analyze_essay_authenticity
 from .plagiarism import check_plagiarism
 
 __all__ = [
+    "detect_ai_batch",
     "detect_ai_text",
     "analyze_essay_authenticity",
     "check_plagiarism",
@@ -0,0 +1,334 @@
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from config import get_corpus_index_path
+from services.minhash import band_keys, overlap, shingle, signature
+from services.text_extraction import extract_pages
+
+logger = logging.getLogger(__name__)
+
+CORPUS_EXTENSIONS = (".txt", ".docx", ".pdf")
+
+# Candidates are ranked by how many LSH bands they share with the query and
+# only the best are scored, so boilerplate shared by a whole cohort (e.g. the
+# assignment prompt) can't make a query scan the corpus.
+MAX_CANDIDATES = 200
+
+BULK_BATCH_SIZE = 500
+
+
+class CorpusIndex:
+    """
+    On-disk index of past submissions for cross-term plagiarism checks.
+
+    Each document stores its MinHash signature and unique shingle hashes; its
+    LSH band keys go in a bucket table keyed by (band, key), so a query costs
+    one indexed lookup per band plus scoring a bounded set of candidates.
+    Adding a document touches only that document's rows. Removing one drops
+    its bucket rows at once, so it stops being a candidate, and leaves a
+    tombstone that ``compact`` purges.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "id INTEGER PRIMARY KEY, external_id TEXT NOT NULL UNIQUE, "
+                "term TEXT, filename TEXT, signature BLOB NOT NULL, "
+                "shingles BLOB NOT NULL, added REAL NOT NULL, "
+                "deleted INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "band INTEGER NOT NULL, key INTEGER NOT NULL, "
+                "doc_id INTEGER NOT NULL, PRIMARY KEY (band, key, doc_id)"
+                ") WITHOUT ROWID"
+            )
+
+    def add(
+        self,
+        text: str,
+        external_id: str,
+        term: str | None = None,
+        filename: str | None = None,
+    ) -> bool:
+        """
+        Index a submission, replacing any earlier one with the same id.
+
+        Returns False when the text is too short to fingerprint.
+        """
+        return self.add_many([(text, external_id, term, filename)]) == 1
+
+    def add_many(self, items: list[tuple[str, str, str | None, str | None]]) -> int:
+        """Index ``(text, external_id, term, filename)`` tuples in one transaction."""
+        rows = []
+        for text, external_id, term, filename in items:
+            unique = shingle(text).unique()
+            if len(unique) == 0:
+                continue
+            rows.append((external_id, term, filename, signature(unique), unique))
+
+        with self._lock, self._conn:
+            for external_id, term, filename, sig, unique in rows:
+                self._purge_external_id(external_id)
+                cursor = self._conn.execute(
+                    "INSERT INTO documents "
+                    "(external_id, term, filename, signature, shingles, added) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        external_id,
+                        term,
+                        filename,
+                        sig.tobytes(),
+                        unique.tobytes(),
+                        time.time(),
+                    ),
+                )
+                doc_id = cursor.lastrowid
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO buckets (band, key, doc_id) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (band, int(key), doc_id)
+                        for band, key in enumerate(_bucket_keys(sig))
+                    ],
+                )
+        return len(rows)
+
+    def remove(self, external_id: str) -> bool:
+        """Hide a submission from queries; ``compact`` reclaims its row."""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id, signature FROM documents "
+                "WHERE external_id = ? AND deleted = 0",
+                (external_id,),
+            ).fetchone()
+            if row is None:
+                return False
+            # Its buckets go now: left in place they would still count
+            # toward MAX_CANDIDATES and could push live matches out.
+            self._delete_buckets(*row)
+            self._conn.execute(
+                "UPDATE documents SET deleted = 1 WHERE id = ?", (row[0],)
+            )
+        return True
+
+    def query(
+        self,
+        text: str,
+        top_k: int = 10,
+        min_similarity: float = 0.0,
+        exclude_term: str | None = None,
+    ) -> list[dict]:
+        """
+        Find indexed submissions similar to ``text``, most similar first.
+
+        Each match has the submission's id, term and filename with Jaccard
+        similarity and containment as percentages.
+        """
+        unique = shingle(text).unique()
+        if len(unique) == 0:
+            return []
+        keys = _bucket_keys(signature(unique))
+
+        values = ", ".join("(?, ?)" for _ in keys)
+        params = [v for band, key in enumerate(keys) for v in (band, int(key))]
+        with self._lock:
+            rows = self._conn.execute(
+                f"WITH q (band, key) AS (VALUES {values}) "
+                "SELECT d.external_id, d.term, d.filename, d.shingles "
+                "FROM documents d JOIN ("
+                "  SELECT b.doc_id, COUNT(*) AS shared_bands FROM q "
+                "  JOIN buckets b ON b.band = q.band AND b.key = q.key "
+                "  GROUP BY b.doc_id ORDER BY shared_bands DESC LIMIT ?"
+                ") c ON c.doc_id = d.id WHERE d.deleted = 0",
+                (*params, MAX_CANDIDATES),
+            ).fetchall()
+
+        matches = []
+        for external_id, term, filename, shingles in rows:
+            if exclude_term is not None and term == exclude_term:
+                continue
+            similarity, containment = overlap(
+                unique, np.frombuffer(shingles, dtype=np.uint64)
+            )
+            if similarity <= 0 or similarity < min_similarity:
+                continue
+            matches.append(
+                {
+                    "id": external_id,
+                    "term": term,
+                    "filename": filename,
+                    "similarity_percent": round(similarity * 100, 2),
+                    "containment_percent": round(containment * 100, 2),
+                }
+            )
+        matches.sort(key=lambda m: m["similarity_percent"], reverse=True)
+        return matches[:top_k]
+
+    def compact(self) -> int:
+        """Purge removed submissions and reclaim their space."""
+        with self._lock:
+            with self._conn:
+                rows = self._conn.execute(
+                    "SELECT id, signature FROM documents WHERE deleted = 1"
+                ).fetchall()
+                for doc_id, sig in rows:
+                    self._purge(doc_id, sig)
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA optimize")
+        if rows:
+            logger.info(f"Compacted {len(rows)} removed submissions from the corpus")
+        return len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            (documents,) = self._conn.execute(
+                "SELECT COUNT(*) FROM documents WHERE deleted = 0"
+            ).fetchone()
+            (removed,) = self._conn.execute(
+                "SELECT COUNT(*) FROM documents WHERE deleted = 1"
+            ).fetchone()
+            terms = self._conn.execute(
+                "SELECT term, COUNT(*) FROM documents WHERE deleted = 0 "
+                "GROUP BY term ORDER BY term"
+            ).fetchall()
+        return {
+            "documents": documents,
+            "removed": removed,
+            "terms": {term or "": count for term, count in terms},
+        }
+
+    def _purge_external_id(self, external_id: str) -> None:
+        row = self._conn.execute(
+            "SELECT id, signature FROM documents WHERE external_id = ?",
+            (external_id,),
+        ).fetchone()
+        if row is not None:
+            self._purge(*row)
+
+    def _purge(self, doc_id: int, sig: bytes) -> None:
+        self._delete_buckets(doc_id, sig)
+        self._conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+
+    def _delete_buckets(self, doc_id: int, sig: bytes) -> None:
+        # Bucket rows are found through the primary key by recomputing the
+        # document's band keys, so no separate doc_id index is needed.
+        keys = _bucket_keys(np.frombuffer(sig, dtype=np.uint32))
+        self._conn.executemany(
+            "DELETE FROM buckets WHERE band = ? AND key = ? AND doc_id = ?",
+            [(band, int(key), doc_id) for band, key in enumerate(keys)],
+        )
+
+
+def corpus_id(data: bytes, term: str | None) -> str:
+    """
+    The id a submission is indexed under: its term plus its content hash.
+
+    Backfilled files and graded uploads share it, so the same essay is stored
+    once per term and is never reported as matching itself.
+    """
+    return f"{term or ''}/{hashlib.sha256(data).hexdigest()}"
+
+
+def _bucket_keys(sig: np.ndarray) -> np.ndarray:
+    # SQLite integers are signed 64-bit.
+    return band_keys(sig)[0].view(np.int64)
+
+
+_index: CorpusIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_corpus_index() -> CorpusIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CorpusIndex(get_corpus_index_path())
+        return _index
+
+
+def _read_file(path: str) -> tuple[bytes, str]:
+    with open(path, "rb") as f:
+        data = f.read()
+    # Not memoized: historical files are read once and shouldn't crowd live
+    # uploads out of the text cache.
+    return data, "\n\n".join(extract_pages(data, os.path.splitext(path)[1]))
+
+
+def _iter_files(paths: list[str]):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                if name.lower().endswith(CORPUS_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def bulk_load(index: CorpusIndex, paths: list[str], term: str) -> int:
+    """Backfill a term's submissions from files and directories."""
+    loaded = 0
+    batch = []
+    for path in _iter_files(paths):
+        try:
+            data, text = _read_file(path)
+        except Exception as e:
+            logger.warning(f"Skipping {path}: {e}")
+            continue
+        batch.append((text, corpus_id(data, term), term, os.path.basename(path)))
+        if len(batch) >= BULK_BATCH_SIZE:
+            loaded += index.add_many(batch)
+            batch = []
+    if batch:
+        loaded += index.add_many(batch)
+    return loaded
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m services.corpus_index",
+        description="Manage the plagiarism corpus of past submissions.",
+    )
+    parser.add_argument("--path", help="index file (default: CORPUS_INDEX_PATH)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("load", help="bulk-load a term's submissions")
+    load.add_argument("--term", required=True, help="term label, e.g. 2025-fall")
+    load.add_argument("paths", nargs="+", help=".txt/.docx/.pdf files or folders")
+    commands.add_parser("compact", help="purge removed submissions")
+    commands.add_parser("stats", help="show corpus size per term")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    index = CorpusIndex(args.path) if args.path else get_corpus_index()
+
+    if args.command == "load":
+        started = time.perf_counter()
+        loaded = bulk_load(index, args.paths, args.term)
+        elapsed = time.perf_counter() - started
+        print(f"Loaded {loaded} submissions into {args.term} in {elapsed:.1f}s")
+    elif args.command == "compact":
+        print(f"Purged {index.compact()} removed submissions")
+    else:
+        print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,119 +1,260 @@
+import asyncio
+import hashlib
 import os
+import re
+import threading
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    CancelledError,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
+from config import (
+    get_ai_detection_cache_max_entries,
+    get_sapling_api_url,
+    get_sapling_chunk_chars,
+    get_sapling_concurrency,
+    get_sapling_max_retries,
+    get_sapling_timeout_seconds,
+)
+from services.metrics import record_cache, timed
+from services.result_cache import MemoryResultCache
 
-def detect_ai_with_sapling(text: str, api_key: Optional[str] = None) -> dict:
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+_session: requests.Session | None = None
+_executor: ThreadPoolExecutor | None = None
+_detection_cache: MemoryResultCache | None = None
+_lock = threading.Lock()
+
+
+class SaplingError(Exception):
+    pass
+
+
+def _get_session() -> requests.Session:
     """
-    Detect whether the given text was written by AI or a human
-    using the Sapling.ai AI Detector API.
+    Shared keep-alive session that retries 429/5xx and connect errors with
+    jittered backoff.
 
-    Args:
-        text: The essay text to analyze
-        api_key: Uses SAPLING_API_KEY environment variable
+    Read timeouts and dropped responses aren't retried: Sapling may already
+    have scored (and billed) the chunk.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            retry = Retry(
+                total=get_sapling_max_retries(),
+                read=False,
+                other=0,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset({"POST"}),
+                backoff_factor=0.5,
+                backoff_jitter=0.5,
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_maxsize=get_sapling_concurrency(), max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
 
-    Returns:
-        Dictionary with detection results or error dict
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_sapling_concurrency(), thread_name_prefix="sapling"
+            )
+        return _executor
+
+
+def close_detector() -> None:
+    """Close pooled connections and stop the request threads."""
+    global _session, _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def error_result(message: str, detail: str | None = None) -> dict:
+    """A detection result that reports ``message`` and scores nothing."""
+    result = {
+        "error": message,
+        "is_ai_generated": False,
+        "ai_probability": 0.0,
+        "overall_score": 0.0,
+        "sentence_scores": [],
+        "confidence": "unknown",
+        "threshold_used": 0.5,
+    }
+    if detail is not None:
+        result["detail"] = detail
+    return result
+
+
+def _result(ai_score: float, sentence_scores: list[float]) -> dict:
+    if ai_score > 0.8 or ai_score < 0.2:
+        confidence = "high"
+    elif ai_score > 0.6 or ai_score < 0.4:
+        confidence = "medium"
+    else:
+        confidence = "low"
+
+    return {
+        "is_ai_generated": ai_score > 0.5,
+        "ai_probability": round(ai_score, 4),
+        "overall_score": round(ai_score, 4),
+        "sentence_scores": sentence_scores,
+        "confidence": confidence,
+        "threshold_used": 0.5,
+    }
+
+
+def split_into_chunks(text: str, max_chars: int) -> list[str]:
+    """Split text at sentence boundaries into chunks of at most ``max_chars``."""
+    if len(text) <= max_chars:
+        return [text]
+
+    chunks = []
+    current: list[str] = []
+    size = 0
+    for sentence in _SENTENCE_END.split(text):
+        while len(sentence) > max_chars:
+            # A "sentence" longer than a chunk (no punctuation): hard split.
+            if current:
+                chunks.append(" ".join(current))
+                current, size = [], 0
+            chunks.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and size + 1 + len(sentence) > max_chars:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += len(sentence) + (1 if size else 0)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def _score_chunk(text: str, api_key: str) -> tuple[float, list[float]]:
+    try:
+        response = _get_session().post(
+            get_sapling_api_url(),
+            json={"key": api_key, "text": text},
+            timeout=get_sapling_timeout_seconds(),
+        )
+    except requests.exceptions.Timeout:
+        raise SaplingError("Sapling API request timed out")
+    except requests.exceptions.RequestException as e:
+        raise SaplingError(f"Request failed: {str(e)}")
+
+    if response.status_code != 200:
+        raise SaplingError(f"Sapling API error: HTTP {response.status_code}")
+
+    data = response.json()
+    sentence_scores = [
+        float(s.get("score", 0.0)) for s in data.get("sentence_scores", [])
+    ]
+    return float(data.get("score", 0.0)), sentence_scores
+
+
+def _merge(chunks: list[str], futures: list[Future]) -> dict:
+    """
+    Combine chunk scores, weighting each chunk's score by its length.
+
+    The first failed chunk fails the whole text, and the text's chunks that
+    haven't been sent yet are cancelled so they don't spend Sapling quota.
+    Chunks cancelled by ``close_detector`` fail the text the same way.
+    """
+    wait(futures, return_when=FIRST_EXCEPTION)
+    for future in futures:
+        if future.done() and (future.cancelled() or future.exception()):
+            for pending in futures:
+                pending.cancel()
+            try:
+                future.result()
+            except CancelledError:
+                return error_result("Detection cancelled")
+            except SaplingError as e:
+                return error_result(str(e))
+            except Exception as e:
+                return error_result(f"Detection failed: {str(e)}")
+
+    sentence_scores: list[float] = []
+    weighted = 0.0
+    total = 0
+    for chunk, future in zip(chunks, futures):
+        score, scores = future.result()
+        sentence_scores.extend(scores)
+        weighted += score * len(chunk)
+        total += len(chunk)
+    return _result(weighted / total if total else 0.0, sentence_scores)
+
+
+def detect_ai_batch(texts: list[str], api_key: Optional[str] = None) -> list[dict]:
+    """
+    Score many texts with the Sapling AI detector concurrently.
+
+    Long texts are split into sentence-aligned chunks; every chunk of every
+    text shares one bounded pool of keep-alive connections. Returns one
+    result per text, in order, in the shape of ``detect_ai_with_sapling``.
     """
     if api_key is None:
         api_key = os.getenv("SAPLING_API_KEY", "").strip()
 
     if not api_key:
-        return {
-            "error": "SAPLING_API_KEY is not set",
-            "is_ai_generated": False,
-            "ai_probability": 0.0,
-            "overall_score": 0.0,
-            "sentence_scores": [],
-            "confidence": "unknown",
-            "threshold_used": 0.5,
-        }
-
-    if not text or len(text.strip()) < 10:
-        return {
-            "error": "Text too short for reliable detection",
-            "is_ai_generated": False,
-            "ai_probability": 0.0,
-            "overall_score": 0.0,
-            "sentence_scores": [],
-            "confidence": "unknown",
-            "threshold_used": 0.5,
-        }
-
-    try:
-        truncated_text = text[:200000]
+        return [error_result("SAPLING_API_KEY is not set") for _ in texts]
 
-        response = requests.post(
-            "https://api.sapling.ai/api/v1/aidetect",
-            json={"key": api_key, "text": truncated_text},
-            timeout=30,
+    executor = _get_executor()
+    chunk_size = get_sapling_chunk_chars()
+    jobs: list[tuple[list[str], list[Future]] | dict] = []
+    for text in texts:
+        if not text or len(text.strip()) < 10:
+            jobs.append(error_result("Text too short for reliable detection"))
+            continue
+        chunks = split_into_chunks(text, chunk_size)
+        jobs.append(
+            (chunks, [executor.submit(_score_chunk, c, api_key) for c in chunks])
         )
 
-        if response.status_code != 200:
-            return {
-                "error": f"Sapling API error: HTTP {response.status_code}",
-                "is_ai_generated": False,
-                "ai_probability": 0.0,
-                "overall_score": 0.0,
-                "sentence_scores": [],
-                "confidence": "unknown",
-                "threshold_used": 0.5,
-            }
+    return [job if isinstance(job, dict) else _merge(*job) for job in jobs]
 
-        data = response.json()
-        ai_score = float(data.get("score", 0.0))
 
-        sentence_scores = [
-            float(s.get("score", 0.0)) for s in data.get("sentence_scores", [])
-        ]
+def detect_ai_with_sapling(text: str, api_key: Optional[str] = None) -> dict:
+    """
+    Detect whether the given text was written by AI or a human
+    using the Sapling.ai AI Detector API.
 
-        if ai_score > 0.8 or ai_score < 0.2:
-            confidence = "high"
-        elif ai_score > 0.6 or ai_score < 0.4:
-            confidence = "medium"
-        else:
-            confidence = "low"
+    Texts longer than SAPLING_CHUNK_CHARS are scored as sentence-aligned
+    chunks in parallel; the overall score is the length-weighted mean.
 
-        return {
-            "is_ai_generated": ai_score > 0.5,
-            "ai_probability": round(ai_score, 4),
-            "overall_score": round(ai_score, 4),
-            "sentence_scores": sentence_scores,
-            "confidence": confidence,
-            "threshold_used": 0.5,
-        }
+    Args:
+        text: The essay text to analyze
+        api_key: Uses SAPLING_API_KEY environment variable
 
-    except requests.exceptions.Timeout:
-        return {
-            "error": "Sapling API request timed out",
-            "is_ai_generated": False,
-            "ai_probability": 0.0,
-            "overall_score": 0.0,
-            "sentence_scores": [],
-            "confidence": "unknown",
-            "threshold_used": 0.5,
-        }
-    except requests.exceptions.RequestException as e:
-        return {
-            "error": f"Request failed: {str(e)}",
-            "is_ai_generated": False,
-            "ai_probability": 0.0,
-            "overall_score": 0.0,
-            "sentence_scores": [],
-            "confidence": "unknown",
-            "threshold_used": 0.5,
-        }
-    except Exception as e:
-        return {
-            "error": f"Detection failed: {str(e)}",
-            "is_ai_generated": False,
-            "ai_probability": 0.0,
-            "overall_score": 0.0,
-            "sentence_scores": [],
-            "confidence": "unknown",
-            "threshold_used": 0.5,
-        }
+    Returns:
+        Dictionary with detection results or error dict
+    """
+    return detect_ai_batch([text], api_key)[0]
 
 
 def analyze_essay_authenticity(essay_text: str, api_key: Optional[str] = None) -> dict:
@@ -175,6 +316,33 @@ def analyze_essay_authenticity(essay_text: str, api_key: Optional[str] = None) -
     return {"authentic": authentic, "flags": flags, "ai_detection": ai_detection}
 
 
+def _get_detection_cache() -> MemoryResultCache:
+    global _detection_cache
+    with _lock:
+        if _detection_cache is None:
+            _detection_cache = MemoryResultCache(get_ai_detection_cache_max_entries())
+        return _detection_cache
+
+
+async def analyze_essay_authenticity_cached(essay_text: str) -> dict:
+    """
+    Run ``analyze_essay_authenticity`` off the event loop, reusing the result
+    for text that was already scored (failed detections are not cached).
+    """
+    key = hashlib.sha256(essay_text.encode("utf-8")).hexdigest()
+    cache = _get_detection_cache()
+    cached = cache.get(key)
+    record_cache("ai_detection", cached is not None)
+    if cached is not None:
+        return cached
+
+    with timed("ai_detection"):
+        result = await asyncio.to_thread(analyze_essay_authenticity, essay_text)
+    if "error" not in result["ai_detection"]:
+        cache.set(key, result)
+    return result
+
+
 def detect_ai_text(text: str) -> dict:
     """Detect whether the given text was written by AI or a human."""
     return detect_ai_with_sapling(text)
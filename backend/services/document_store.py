@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from config import get_document_store_dir, get_document_store_max_bytes
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_EXTENSIONS = (
+    ".pdf",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".webp",
+    ".txt",
+    ".docx",
+)
+
+
+class DocumentStore:
+    """
+    Content-addressed store of uploaded assignment files.
+
+    Lets page images be rendered lazily, after the grading response has been
+    sent, from the document id handed to the client. Bounded by total size,
+    evicting the least recently used documents.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] | None = None
+        self._total_bytes = 0
+
+    def save(self, data: bytes, ext: str) -> str:
+        """Store the bytes (if not already present) and return their id."""
+        ext = ext.lower()
+        if ext not in DOCUMENT_EXTENSIONS:
+            raise ValueError(f"Unsupported file type: {ext}")
+        doc_id = hashlib.sha256(data).hexdigest()
+        path = self._path(doc_id, ext)
+
+        with self._lock:
+            entries = self._load_entries()
+        if os.path.isfile(path):
+            self._touch(path)
+            return doc_id
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes += len(data) - entries.get(path, 0)
+            entries[path] = len(data)
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(entries) > 1:
+                evicted_path, size = entries.popitem(last=False)
+                self._total_bytes -= size
+                evicted.append(evicted_path)
+        for evicted_path in evicted:
+            try:
+                os.unlink(evicted_path)
+            except OSError:
+                pass
+        return doc_id
+
+    def load(self, doc_id: str) -> tuple[bytes, str] | None:
+        """Read a stored document's bytes and extension, or None if unknown."""
+        if len(doc_id) != 64 or not all(c in "0123456789abcdef" for c in doc_id):
+            return None
+        for ext in DOCUMENT_EXTENSIONS:
+            path = self._path(doc_id, ext)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            self._touch(path)
+            return data, ext
+        return None
+
+    def _path(self, doc_id: str, ext: str) -> str:
+        return os.path.join(self.directory, doc_id[:2], f"{doc_id}{ext}")
+
+    def _touch(self, path: str) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            entries = self._load_entries()
+            if path in entries:
+                entries.move_to_end(path)
+
+    def _load_entries(self) -> OrderedDict[str, int]:
+        if self._entries is not None:
+            return self._entries
+
+        found = []
+        if os.path.isdir(self.directory):
+            for shard in os.listdir(self.directory):
+                shard_dir = os.path.join(self.directory, shard)
+                if not os.path.isdir(shard_dir):
+                    continue
+                for name in os.listdir(shard_dir):
+                    if ".tmp-" in name:
+                        continue
+                    path = os.path.join(shard_dir, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, path, stat.st_size))
+
+        self._entries = OrderedDict()
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._total_bytes += size
+        return self._entries
+
+
+_document_store: DocumentStore | None = None
+_document_store_lock = threading.Lock()
+
+
+def get_document_store() -> DocumentStore:
+    global _document_store
+    with _document_store_lock:
+        if _document_store is None:
+            _document_store = DocumentStore(
+                get_document_store_dir(), get_document_store_max_bytes()
+            )
+        return _document_store
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+
+from google.genai import errors
+from google.genai.client import AsyncClient
+
+from config import (
+    get_file_sweep_interval_seconds,
+    get_file_sweep_max_age_seconds,
+    get_rubric_cache_ttl_seconds,
+)
+from services.gemini_client import get_client
+from services.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Every file we upload is tagged with one of these display names so the
+# sweeper can tell our uploads apart from anything else on the API key.
+DISPLAY_NAME_PREFIX = "grader-"
+RUBRIC_DISPLAY_NAME = f"{DISPLAY_NAME_PREFIX}rubric"
+ASSIGNMENT_DISPLAY_NAME = f"{DISPLAY_NAME_PREFIX}assignment"
+
+DELETE_BATCH_SIZE = 16
+MAX_DELETE_ATTEMPTS = 5
+RETRY_BASE_DELAY_SECONDS = 1.0
+
+
+class FileCleanupWorker:
+    """
+    Background deletion queue for Files API uploads.
+
+    Deletes are taken off the request path, sent in concurrent batches and
+    retried with backoff. A periodic sweeper removes uploads orphaned by a
+    crashed worker.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue[tuple[str, int]] | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._client: AsyncClient | None = None
+        self._pending_retries = 0
+        self.deleted = 0
+        self.failed = 0
+        self.retried = 0
+        self.swept = 0
+
+    def start(self, client: AsyncClient, sweep: bool = True) -> None:
+        if self._tasks:
+            return
+        self._client = client
+        self._queue = asyncio.Queue()
+        self._tasks.append(asyncio.create_task(self._delete_loop()))
+        if sweep:
+            self._tasks.append(asyncio.create_task(self._sweep_loop()))
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Drain queued deletes (up to ``timeout`` seconds) and stop the tasks."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Stopped file cleanup with {self._queue.qsize()} deletes pending"
+            )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, name: str | None) -> None:
+        """Schedule a remote file for deletion."""
+        if not name:
+            return
+        if not self._tasks:
+            # Used outside the app lifespan: start on the caller's loop.
+            client = get_client()
+            if client is None:
+                return
+            self.start(client, sweep=False)
+        self._queue.put_nowait((name, 1))
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": (self._queue.qsize() if self._queue else 0)
+            + self._pending_retries,
+            "deleted": self.deleted,
+            "failed": self.failed,
+            "retried": self.retried,
+            "swept": self.swept,
+        }
+
+    async def _delete_loop(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < DELETE_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            await asyncio.gather(
+                *(self._delete(name, attempt) for name, attempt in batch)
+            )
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _delete(self, name: str, attempt: int) -> None:
+        try:
+            with timed("delete"):
+                await self._client.files.delete(name=name)
+            self.deleted += 1
+            logger.info(f"Deleted remote file: {name}")
+        except errors.APIError as e:
+            if e.code == 404:
+                # Already gone (expired, or deleted by the sweeper elsewhere).
+                self.deleted += 1
+                return
+            self._retry(name, attempt, e)
+        except Exception as e:
+            self._retry(name, attempt, e)
+
+    def _retry(self, name: str, attempt: int, error: Exception) -> None:
+        if attempt >= MAX_DELETE_ATTEMPTS:
+            self.failed += 1
+            logger.warning(f"Giving up deleting remote file {name}: {error}")
+            return
+
+        self.retried += 1
+        delay = RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1)
+        delay *= random.uniform(0.5, 1.5)
+        logger.info(f"Retrying delete of {name} in {delay:.1f}s: {error}")
+        self._pending_retries += 1
+        asyncio.get_running_loop().call_later(delay, self._requeue, name, attempt + 1)
+
+    def _requeue(self, name: str, attempt: int) -> None:
+        self._pending_retries -= 1
+        if self._tasks:
+            self._queue.put_nowait((name, attempt))
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(get_file_sweep_interval_seconds())
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"Remote file sweep failed: {e}")
+
+    async def sweep(self) -> int:
+        """Queue deletion of stale uploads tagged with our display names."""
+        from services.rubric_cache import rubric_cache
+
+        now = datetime.now(timezone.utc)
+        assignment_cutoff = now - timedelta(seconds=get_file_sweep_max_age_seconds())
+        rubric_cutoff = now - timedelta(seconds=get_rubric_cache_ttl_seconds())
+        live_rubrics = rubric_cache.file_names()
+
+        stale = 0
+        async for file in await self._client.files.list(config={"page_size": 100}):
+            display_name = file.display_name or ""
+            if not display_name.startswith(DISPLAY_NAME_PREFIX) or not file.name:
+                continue
+            if file.create_time is None or file.name in live_rubrics:
+                continue
+            if display_name == RUBRIC_DISPLAY_NAME:
+                # Other workers may still be reusing a cached rubric upload.
+                cutoff = rubric_cutoff
+            else:
+                cutoff = assignment_cutoff
+            if file.create_time < cutoff:
+                self._queue.put_nowait((file.name, 1))
+                stale += 1
+
+        if stale:
+            self.swept += stale
+            logger.info(f"Sweeper queued {stale} stale remote files for deletion")
+        return stale
+
+
+file_cleanup = FileCleanupWorker()
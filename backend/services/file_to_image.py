@@ -1,161 +1,582 @@
 import base64
+import hashlib
 import io
-import os
+import multiprocessing
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from multiprocessing import shared_memory
 from typing import Literal
 
 import fitz  # PyMuPDF
 from PIL import Image, ImageDraw, ImageFont
 
+from config import get_render_parallel_min_pages, get_render_pool_size
+from services.metrics import PAGES_RENDERED, timed
+from services.render_cache import get_render_cache
+
+_render_pool: ProcessPoolExecutor | None = None
+_render_pool_lock = threading.Lock()
+
+IMAGE_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# PDF pages are laid out in points: 72 per inch.
+PDF_BASE_DPI = 72
+
+# Text documents (.txt/.docx) are laid out onto fixed-size, letter-shaped
+# pages rather than one image as tall as the whole document.
+TEXT_EXTENSIONS = {".txt", ".docx"}
+TEXT_FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+TEXT_FONT_SIZE = 24
+TEXT_LINE_HEIGHT = TEXT_FONT_SIZE + 10
+TEXT_PADDING = 40
+TEXT_PAGE_WIDTH = 1000
+TEXT_PAGE_HEIGHT = 1294
+TEXT_WORD_CACHE_SIZE = 8192
+TEXT_LAYOUT_CACHE_SIZE = 16
+
+
+@dataclass(frozen=True)
+class ImageOptions:
+    """How rendered page images are encoded."""
+
+    format: Literal["png", "jpeg", "webp"] = "png"
+    quality: int = 85  # JPEG/WebP only
+    dpi: int = 144  # PDF render resolution (144 = the previous 2x zoom)
+    max_dimension: int | None = None  # cap on the longest side, in pixels
+    thumbnails: bool = False
+    thumbnail_dimension: int = 256
+
+    def __post_init__(self):
+        if self.format not in IMAGE_MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {self.format}")
+        if not 1 <= self.quality <= 100:
+            raise ValueError("Image quality must be between 1 and 100")
+        if self.dpi <= 0:
+            raise ValueError("Image DPI must be positive")
+        if self.max_dimension is not None and self.max_dimension <= 0:
+            raise ValueError("Image max dimension must be positive")
+
+    @property
+    def mime_type(self) -> str:
+        return IMAGE_MIME_TYPES[self.format]
+
+    def cache_key(self) -> str:
+        """Identify the encoded output (thumbnails are cached separately)."""
+        return f"{self.format}-q{self.quality}-d{self.dpi}-m{self.max_dimension or 0}"
+
+    def thumbnail_options(self) -> "ImageOptions":
+        return replace(self, max_dimension=self.thumbnail_dimension, thumbnails=False)
+
+
+def _encode_image(img: Image.Image, options: ImageOptions) -> bytes:
+    if options.max_dimension is not None:
+        img = img.copy()
+        img.thumbnail(
+            (options.max_dimension, options.max_dimension),
+            Image.Resampling.BILINEAR,
+            reducing_gap=2.0,
+        )
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
 
-def _get_text_dimensions(text: str, font: ImageFont.FreeTypeFont) -> tuple[int, int]:
-    left, top, right, bottom = font.getbbox(text)
-    return int(right - left), int(bottom - top)
+    buffer = io.BytesIO()
+    if options.format == "png":
+        img.save(buffer, format="PNG")
+    elif options.format == "jpeg":
+        img.save(buffer, format="JPEG", quality=options.quality)
+    else:
+        img.save(buffer, format="WEBP", quality=options.quality, method=4)
+    return buffer.getvalue()
 
 
-def _wrap_text(text: str, font: ImageFont.FreeTypeFont, max_width: int) -> list[str]:
-    words = text.split(" ")
-    lines = []
-    current_line = ""
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("utf-8")
 
-    for word in words:
-        test_line = current_line + (" " if current_line else "") + word
-        width, _ = _get_text_dimensions(test_line, font)
-        if width <= max_width:
-            current_line = test_line
-        else:
-            if current_line:
-                lines.append(current_line)
-            current_line = word
 
-    if current_line:
-        lines.append(current_line)
+def _encode_image_b64(img: Image.Image, options: ImageOptions) -> str:
+    return _b64(_encode_image(img, options))
 
-    return lines
 
+def _render_pdf_page(page: fitz.Page, options: ImageOptions) -> bytes:
+    zoom = options.dpi / PDF_BASE_DPI
+    if options.max_dimension is not None:
+        # Render straight at the target size rather than downscaling after.
+        longest_side = max(page.rect.width, page.rect.height)
+        zoom = min(zoom, options.max_dimension / longest_side)
 
-def pdf_to_images(file_path: str) -> list[str]:
-    images: list[str] = []
-    doc = fitz.open(file_path)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    if options.format == "png":
+        return pix.tobytes("png")
+    if options.format == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=options.quality)
+    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    return _encode_image(img, replace(options, max_dimension=None))
 
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-        img_bytes = pix.tobytes("png")
-        images.append(base64.b64encode(img_bytes).decode("utf-8"))
 
-    doc.close()
-    return images
+@lru_cache(maxsize=1)
+def _text_font() -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
+    try:
+        return ImageFont.truetype(TEXT_FONT_PATH, TEXT_FONT_SIZE)
+    except Exception:
+        return ImageFont.load_default()
 
 
-def docx_to_image(file_path: str) -> str:
-    from docx import Document
+@lru_cache(maxsize=TEXT_WORD_CACHE_SIZE)
+def _word_width(word: str) -> float:
+    return _text_font().getlength(word)
 
-    doc = Document(file_path)
-    paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
 
-    if not paragraphs:
-        paragraphs = ["[Empty document]"]
+@lru_cache(maxsize=TEXT_WORD_CACHE_SIZE)
+def _word_mask(word: str) -> tuple[Image.Image, int]:
+    """Rasterize a word once; returns its glyph mask and x offset."""
+    font = _text_font()
+    left, _, right, _ = font.getbbox(word)
+    offset = min(0, int(left))
+    mask = Image.new("L", (max(1, int(right) - offset + 1), TEXT_LINE_HEIGHT), 0)
+    ImageDraw.Draw(mask).text((-offset, 0), word, fill=255, font=font)
+    return mask, offset
 
-    font_size = 24
-    try:
-        font = ImageFont.truetype(
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", font_size
-        )
-    except Exception:
-        font = ImageFont.load_default()
 
-    line_height = font_size + 10
-    padding = 40
-    max_width = 1000
+def _wrap_text(text: str, max_width: float) -> list[str]:
+    """
+    Greedily wrap text to ``max_width`` pixels.
 
-    wrapped_lines = []
-    for para in paragraphs:
-        wrapped = _wrap_text(para, font, max_width - padding * 2)
-        wrapped_lines.extend(wrapped)
-        wrapped_lines.append("")
+    Newlines start a new line (blank lines are kept). Line widths are
+    accumulated from cached per-word advances instead of re-measuring the
+    growing line, so layout is linear in the length of the text. Words wider
+    than a line are broken across lines.
+    """
+    space_width = _word_width(" ")
+    lines = []
 
-    if not wrapped_lines:
-        wrapped_lines = ["[No content]"]
+    for paragraph in text.splitlines():
+        current: list[str] = []
+        current_width = 0.0
+
+        for word in paragraph.split():
+            word_width = _word_width(word)
+            if word_width > max_width:
+                if current:
+                    lines.append(" ".join(current))
+                pieces = _break_word(word, max_width)
+                lines.extend(pieces[:-1])
+                current = [pieces[-1]]
+                current_width = _word_width(pieces[-1])
+                continue
+
+            if current and current_width + space_width + word_width <= max_width:
+                current.append(word)
+                current_width += space_width + word_width
+            else:
+                if current:
+                    lines.append(" ".join(current))
+                current = [word]
+                current_width = word_width
+
+        lines.append(" ".join(current))
 
-    text_height = len(wrapped_lines) * line_height
-    img_height = text_height + padding * 2
-    img_width = max_width
+    return lines
 
-    img = Image.new("RGB", (img_width, img_height), color="white")
-    draw = ImageDraw.Draw(img)
 
-    y = padding
-    for line in wrapped_lines:
-        draw.text((padding, y), line, fill="black", font=font)
-        y += line_height
+def _break_word(word: str, max_width: float) -> list[str]:
+    pieces = []
+    start = 0
+    width = 0.0
+    for i, char in enumerate(word):
+        char_width = _word_width(char)
+        if i > start and width + char_width > max_width:
+            pieces.append(word[start:i])
+            start = i
+            width = 0.0
+        width += char_width
+    pieces.append(word[start:])
+    return pieces
+
+
+def _paginate(lines: list[str]) -> list[list[str]]:
+    """Split wrapped lines into fixed-height pages."""
+    per_page = max(1, (TEXT_PAGE_HEIGHT - TEXT_PADDING * 2) // TEXT_LINE_HEIGHT)
+    pages = []
+    current: list[str] = []
+    for line in lines:
+        if not current and not line.strip() and pages:
+            # Don't start a continuation page with blank lines.
+            continue
+        current.append(line)
+        if len(current) == per_page:
+            pages.append(current)
+            current = []
+    if current or not pages:
+        pages.append(current)
+    return pages
+
+
+def _draw_text_page(lines: list[str]) -> Image.Image:
+    """
+    Draw one page of wrapped lines in grayscale.
+
+    Words are pasted from cached glyph masks at the same advances used for
+    layout, which matches drawing each line with the font but skips
+    rasterizing repeated words again.
+    """
+    img = Image.new("L", (TEXT_PAGE_WIDTH, TEXT_PAGE_HEIGHT), color=255)
+    space_width = _word_width(" ")
+    y = TEXT_PADDING
+    for line in lines:
+        x = float(TEXT_PADDING)
+        for word in line.split(" "):
+            if word:
+                mask, offset = _word_mask(word)
+                img.paste(0, (round(x) + offset, y), mask)
+            x += _word_width(word) + space_width
+        y += TEXT_LINE_HEIGHT
+    return img
+
+
+def _text_layout(text: str) -> list[list[str]]:
+    return _paginate(_wrap_text(text, TEXT_PAGE_WIDTH - TEXT_PADDING * 2))
+
+
+_text_layouts: OrderedDict[str, list[list[str]]] = OrderedDict()
+_text_layouts_lock = threading.Lock()
+
+
+def _text_pages(data: bytes, ext: str, digest: str | None = None) -> list[list[str]]:
+    """
+    Lay a text document out into pages, reusing recent documents' layouts.
+
+    Counting pages and rendering any single page both need the whole layout,
+    so a client fetching every page lazily lays the document out once rather
+    than once per page.
+    """
+    key = f"{digest or _digest(data)}{ext}"
+    with _text_layouts_lock:
+        pages = _text_layouts.get(key)
+        if pages is not None:
+            _text_layouts.move_to_end(key)
+            return pages
+
+    pages = _text_layout(_text_source(data, ext))
+    with _text_layouts_lock:
+        _text_layouts[key] = pages
+        _text_layouts.move_to_end(key)
+        while len(_text_layouts) > TEXT_LAYOUT_CACHE_SIZE:
+            _text_layouts.popitem(last=False)
+    return pages
+
+
+def _open_pdf(data: bytes | memoryview) -> fitz.Document:
+    return fitz.open(stream=data, filetype="pdf")
+
+
+def iter_pdf_pages(data: bytes, options: ImageOptions | None = None) -> Iterator[bytes]:
+    """Render a PDF one page at a time so only one page is held in memory."""
+    options = options or ImageOptions()
+    doc = _open_pdf(data)
+    try:
+        for page_num in range(len(doc)):
+            yield _render_pdf_page(doc.load_page(page_num), options)
+    finally:
+        doc.close()
+
+
+def _render_pdf_range(
+    shm_name: str, size: int, start: int, end: int, options: ImageOptions
+) -> list[bytes]:
+    """
+    Render pages [start, end) of a PDF. Runs inside a render pool worker,
+    reading the document from shared memory rather than a pickled copy.
+    """
+    pages: list[bytes] = []
+    shm = shared_memory.SharedMemory(name=shm_name)
+    view = shm.buf[:size]
+    try:
+        with _open_pdf(view) as doc:
+            for page_num in range(start, end):
+                pages.append(_render_pdf_page(doc.load_page(page_num), options))
+    finally:
+        view.release()
+        shm.close()
+    return pages
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            # spawn, not fork: the server process is multi-threaded.
+            _render_pool = ProcessPoolExecutor(
+                max_workers=get_render_pool_size(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _render_pool
+
+
+def shutdown_render_pool() -> None:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(cancel_futures=True)
+            _render_pool = None
+
+
+def render_pdf_pages(data: bytes, options: ImageOptions | None = None) -> list[bytes]:
+    options = options or ImageOptions()
+    with _open_pdf(data) as doc:
+        page_count = len(doc)
+
+    pool_size = get_render_pool_size()
+    if pool_size <= 1 or page_count < get_render_parallel_min_pages():
+        return list(iter_pdf_pages(data, options))
+
+    # The document is copied once into shared memory that every worker maps,
+    # instead of being pickled to each chunk.
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    try:
+        shm.buf[: len(data)] = data
+
+        # Split into contiguous page ranges, a couple per worker so uneven
+        # pages balance out, and reassemble them in page order.
+        chunk_size = max(1, -(-page_count // (pool_size * 2)))
+        pool = _get_render_pool()
+        futures = [
+            pool.submit(
+                _render_pdf_range,
+                shm.name,
+                len(data),
+                start,
+                min(start + chunk_size, page_count),
+                options,
+            )
+            for start in range(0, page_count, chunk_size)
+        ]
+        pages: list[bytes] = []
+        for future in futures:
+            pages.extend(future.result())
+        return pages
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def pdf_to_images(data: bytes, options: ImageOptions | None = None) -> list[str]:
+    return [_b64(page) for page in render_pdf_pages(data, options)]
+
+
+def _docx_text(data: bytes) -> str:
+    from docx import Document
 
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    doc = Document(io.BytesIO(data))
+    paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
 
+    if not paragraphs:
+        paragraphs = ["[Empty document]"]
+
+    return "\n\n".join(paragraphs)
 
-def txt_to_image(file_path: str) -> str:
-    with open(file_path, "r", encoding="utf-8") as f:
-        text = f.read()
 
+def _txt_text(data: bytes) -> str:
+    text = data.decode("utf-8")
     if not text.strip():
         text = "[Empty file]"
+    return text
 
-    font_size = 24
-    try:
-        font = ImageFont.truetype(
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", font_size
-        )
-    except Exception:
-        font = ImageFont.load_default()
 
-    line_height = font_size + 10
-    padding = 40
-    max_width = 1000
+def _text_source(data: bytes, ext: str) -> str:
+    return _docx_text(data) if ext == ".docx" else _txt_text(data)
 
-    wrapped_lines = _wrap_text(text, font, max_width - padding * 2)
-    text_height = len(wrapped_lines) * line_height
-    img_height = text_height + padding * 2
-    img_width = max_width
 
-    img = Image.new("RGB", (img_width, img_height), color="white")
-    draw = ImageDraw.Draw(img)
+def txt_to_images(data: bytes, options: ImageOptions | None = None) -> list[str]:
+    options = options or ImageOptions()
+    return [
+        _encode_image_b64(_draw_text_page(page), options)
+        for page in _text_layout(_txt_text(data))
+    ]
 
-    y = padding
-    for line in wrapped_lines:
-        draw.text((padding, y), line, fill="black", font=font)
-        y += line_height
 
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-
-def image_to_png(file_path: str) -> str:
-    img = Image.open(file_path)
+def _raster_image(data: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(data))
     if img.mode != "RGB":
         img = img.convert("RGB")
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return img
 
 
-def convert_to_image(
-    file_path: str,
-) -> dict[Literal["images"], list[str]]:
-    ext = os.path.splitext(file_path)[1].lower()
+def image_to_png(data: bytes, options: ImageOptions | None = None) -> str:
+    """Re-encode an uploaded image (PNG unless ``options`` says otherwise)."""
+    return _encode_image_b64(_raster_image(data), options or ImageOptions())
 
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _render_pages_uncached(data: bytes, ext: str, options: ImageOptions) -> list[bytes]:
     if ext == ".pdf":
-        images = pdf_to_images(file_path)
-        return {"images": images}
-    elif ext == ".docx":
-        image = docx_to_image(file_path)
-        return {"images": [image]}
-    elif ext == ".txt":
-        image = txt_to_image(file_path)
-        return {"images": [image]}
-    elif ext in {".png", ".jpg", ".jpeg", ".gif", ".webp"}:
-        image = image_to_png(file_path)
-        return {"images": [image]}
+        return render_pdf_pages(data, options)
+    if ext in TEXT_EXTENSIONS:
+        return [
+            _encode_image(_draw_text_page(page), options)
+            for page in _text_layout(_text_source(data, ext))
+        ]
+    if ext in {".png", ".jpg", ".jpeg", ".gif", ".webp"}:
+        img = _raster_image(data)
     else:
         raise ValueError(f"Unsupported file type: {ext}")
+    return [_encode_image(img, options)]
+
+
+def render_pages(
+    data: bytes,
+    ext: str,
+    options: ImageOptions | None = None,
+    digest: str | None = None,
+) -> list[bytes]:
+    """
+    Render a file's bytes to encoded page images, served from the render
+    cache when the same bytes were already rendered with the same options.
+    """
+    options = options or ImageOptions()
+    ext = ext.lower()
+    digest = digest or _digest(data)
+    key = f"{digest}-{options.cache_key()}"
+    with timed("render"):
+        return get_render_cache().get_or_render(
+            key, lambda: _render_pages_uncached(data, ext, options)
+        )
+
+
+def count_pages(data: bytes, ext: str, digest: str | None = None) -> int:
+    """Count the page images a file renders to, without rendering them."""
+    ext = ext.lower()
+    if ext == ".pdf":
+        with _open_pdf(data) as doc:
+            return len(doc)
+    if ext in TEXT_EXTENSIONS:
+        return len(_text_pages(data, ext, digest))
+    return 1
+
+
+def _render_pdf_single_page(data: bytes, index: int, options: ImageOptions) -> bytes:
+    with _open_pdf(data) as doc:
+        return _render_pdf_page(doc.load_page(index), options)
+
+
+def render_page(
+    data: bytes,
+    ext: str,
+    index: int,
+    options: ImageOptions | None = None,
+    digest: str | None = None,
+) -> bytes:
+    """
+    Render one page image, leaving the rest of the document untouched.
+
+    Served from a whole-document cache entry when one exists; otherwise the
+    page is rendered and cached on its own. Raises IndexError for pages
+    outside the document.
+    """
+    options = options or ImageOptions()
+    ext = ext.lower()
+    digest = digest or _digest(data)
+    cache = get_render_cache()
+    key = f"{digest}-{options.cache_key()}"
+
+    page = cache.get_page(key, index)
+    if page is not None:
+        cache.record_hit()
+        return page
+
+    if ext != ".pdf" and ext not in TEXT_EXTENSIONS:
+        pages = render_pages(data, ext, options, digest)
+        if not 0 <= index < len(pages):
+            raise IndexError(f"Page {index} out of range")
+        return pages[index]
+
+    # Text documents are laid out once; the same layout checks the range and
+    # supplies the page to draw.
+    pages = _text_pages(data, ext, digest) if ext in TEXT_EXTENSIONS else None
+    page_count = count_pages(data, ext) if pages is None else len(pages)
+    if not 0 <= index < page_count:
+        raise IndexError(f"Page {index} out of range")
+
+    def render() -> list[bytes]:
+        if pages is None:
+            return [_render_pdf_single_page(data, index, options)]
+        return [_encode_image(_draw_text_page(pages[index]), options)]
+
+    with timed("render"):
+        return cache.get_or_render(f"{key}-p{index}", render)[0]
+
+
+def iter_pages(
+    data: bytes, ext: str, options: ImageOptions | None = None
+) -> Iterator[bytes]:
+    """Yield encoded page images as each one is rendered (or read from cache)."""
+    options = options or ImageOptions()
+    ext = ext.lower()
+    if ext != ".pdf":
+        yield from render_pages(data, ext, options)
+        return
+
+    cache = get_render_cache()
+    key = f"{_digest(data)}-{options.cache_key()}"
+    cached = cache.get_pages(key)
+    if cached is not None:
+        cache.record_hit()
+        yield from cached
+        return
+
+    cache.record_miss()
+    writer = cache.open_writer(key)
+    try:
+        for page in iter_pdf_pages(data, options):
+            PAGES_RENDERED.inc()
+            if writer is not None:
+                writer.add(page)
+            yield page
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.commit()
+
+
+def iter_images(
+    data: bytes, ext: str, options: ImageOptions | None = None
+) -> Iterator[str]:
+    """Yield the base64 page images of a file as each one is rendered."""
+    with closing(iter_pages(data, ext, options)) as pages:
+        for page in pages:
+            yield _b64(page)
+
+
+def convert_to_image(
+    data: bytes, ext: str, options: ImageOptions | None = None
+) -> dict[str, list[str] | str]:
+    """
+    Render a file's bytes to base64 page images.
+
+    ``ext`` is the upload's file extension (e.g. ``".pdf"``); nothing is
+    written to disk. Returns ``images``, their ``mime_type`` and, when
+    ``options.thumbnails`` is set, a matching list of low-resolution
+    ``thumbnails``.
+    """
+    options = options or ImageOptions()
+    digest = _digest(data)
+
+    result: dict[str, list[str] | str] = {
+        "images": [_b64(page) for page in render_pages(data, ext, options, digest)],
+        "mime_type": options.mime_type,
+    }
+    if options.thumbnails:
+        result["thumbnails"] = [
+            _b64(page)
+            for page in render_pages(data, ext, options.thumbnail_options(), digest)
+        ]
+    return result
@@ -0,0 +1,51 @@
+import logging
+
+from google import genai
+from google.genai import types
+from google.genai.client import AsyncClient
+
+from config import get_api_key, get_gemini_base_url
+
+logger = logging.getLogger(__name__)
+
+_client: genai.Client | None = None
+
+
+def init_client() -> AsyncClient | None:
+    """
+    Create the process-wide Gemini client.
+
+    Called from the FastAPI lifespan hook so every request shares one client
+    and its pooled connections. Returns None when no API key is configured.
+    """
+    global _client
+    if _client is None:
+        api_key = get_api_key()
+        if not api_key:
+            logger.warning("GEMINI_API_KEY not configured, Gemini client disabled")
+            return None
+        base_url = get_gemini_base_url()
+        http_options = types.HttpOptions(base_url=base_url) if base_url else None
+        logger.info(f"Initializing Gemini client ({base_url or 'default endpoint'})")
+        _client = genai.Client(api_key=api_key, http_options=http_options)
+    return _client.aio
+
+
+def get_client() -> AsyncClient | None:
+    """Get the shared async Gemini client, creating it on first use."""
+    if _client is None:
+        return init_client()
+    return _client.aio
+
+
+async def close_client() -> None:
+    """Close the shared client and its connection pool."""
+    global _client
+    if _client is None:
+        return
+    client, _client = _client, None
+    try:
+        await client.aio.aclose()
+        client.close()
+    except Exception as e:
+        logger.warning(f"Failed to close Gemini client: {e}")
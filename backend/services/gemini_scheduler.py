@@ -0,0 +1,432 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import aclosing
+from enum import IntEnum
+from typing import Any, TypeVar
+
+import httpx
+from google.genai import errors, types
+
+from config import (
+    get_gemini_max_concurrency,
+    get_gemini_max_retries,
+    get_gemini_rpm,
+    get_gemini_tpm,
+)
+from services.metrics import GEMINI_ERRORS, timed
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    """Scheduling lanes; lower values are dispatched first."""
+
+    INTERACTIVE = 0  # a user is waiting on the response
+    BULK = 1  # batches and queued jobs
+
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Responses that mean we are sending too much, not that the call was bad.
+THROTTLE_STATUS_CODES = {429, 503}
+
+RETRY_BASE_DELAY_SECONDS = 1.0
+RETRY_MAX_DELAY_SECONDS = 30.0
+
+# AIMD: add one slot per window of saturated successes, halve on throttling,
+# and, under a configured quota, back off gently when latency climbs well
+# above its long-run average. Without a quota there is nothing to probe for,
+# so the limit starts at the maximum and only throttling lowers it.
+MIN_CONCURRENCY = 1
+INITIAL_CONCURRENCY = 4
+THROTTLE_BACKOFF = 0.5
+LATENCY_BACKOFF = 0.9
+LATENCY_TOLERANCE = 2.0
+FAST_LATENCY_WEIGHT = 0.2
+SLOW_LATENCY_WEIGHT = 0.02
+
+# Rough prompt size estimates, reconciled with the reported usage afterwards.
+CHARS_PER_TOKEN = 4
+FILE_TOKEN_ESTIMATE = 1500
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously; a zero rate never limits."""
+
+    def __init__(self, per_minute: float, now: float | None = None):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic() if now is None else now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` can be taken (0 if it can be now)."""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float, now: float) -> None:
+        if self.capacity <= 0:
+            return
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float) -> None:
+        """Charge (or refund) the difference once the real cost is known."""
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level - amount)
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self.level = min(self.capacity, self.level + elapsed * self.capacity / 60)
+        self._updated = now
+
+
+class GeminiScheduler:
+    """
+    Admission control shared by every Gemini generation call.
+
+    Calls wait in priority lanes for a concurrency slot and for room in the
+    requests- and tokens-per-minute buckets, so bursts queue here instead of
+    turning into 429s. The concurrency limit adapts (AIMD) to throttling and,
+    when a quota is configured, to latency, which keeps throughput near the
+    quota ceiling without repeatedly overshooting it. Throttled and transient failures are retried
+    with jittered backoff, honouring the server's retry delay.
+    """
+
+    def __init__(
+        self,
+        rpm: int,
+        tpm: int,
+        max_concurrency: int,
+        max_retries: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._clock = clock
+        self.requests = TokenBucket(rpm, clock())
+        self.tokens = TokenBucket(tpm, clock())
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._has_quota = rpm > 0 or tpm > 0
+        initial = INITIAL_CONCURRENCY if self._has_quota else max_concurrency
+        self.limit = float(min(initial, max_concurrency))
+        self.in_flight = 0
+        self.completed = 0
+        self.throttled = 0
+        self.retries = 0
+        self._waiting: list[tuple[int, int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._fast_latency: float | None = None
+        self._slow_latency: float | None = None
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[T]],
+        tokens: int = 0,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> T:
+        """
+        Run ``call`` within the limits, retrying throttled/transient errors.
+
+        ``call`` creates a fresh coroutine per attempt. ``tokens`` is the
+        estimated prompt size charged against the token bucket.
+        """
+        return await self._with_retries(lambda: self._run_once(call, tokens, priority))
+
+    async def stream(
+        self,
+        call: Callable[[], Awaitable[AsyncIterator[T]]],
+        tokens: int = 0,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> AsyncIterator[T]:
+        """
+        Like ``run`` for streaming calls, yielding each chunk as it arrives.
+
+        The slot is held until the stream ends. Failures are only retried
+        before the first chunk, since chunks already yielded can't be undone.
+        """
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async with aclosing(
+                    self._stream_once(call, tokens, priority)
+                ) as chunks:
+                    async for chunk in chunks:
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                delay = None if started else self._backoff(e, attempt)
+                if delay is None:
+                    if started:
+                        GEMINI_ERRORS.inc(type=_error_type(e))
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def retry(self, call: Callable[[], Awaitable[T]]) -> T:
+        """Retry transient errors of a call outside the generation quota."""
+        return await self._with_retries(call)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": {
+                lane.name.lower(): sum(
+                    1
+                    for priority, _, _, future in self._waiting
+                    if priority == lane and not future.done()
+                )
+                for lane in Priority
+            },
+            "completed": self.completed,
+            "throttled": self.throttled,
+            "retries": self.retries,
+        }
+
+    async def _with_retries(self, call: Callable[[], Awaitable[T]]) -> T:
+        attempt = 0
+        while True:
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def _backoff(self, error: Exception, attempt: int) -> float | None:
+        """Count a failed attempt; returns the backoff, or None to give up."""
+        GEMINI_ERRORS.inc(type=_error_type(error))
+        if not _is_retryable(error) or attempt >= self.max_retries:
+            return None
+        self.retries += 1
+        delay = _retry_delay(error, attempt + 1)
+        logger.warning(
+            f"Gemini call failed, retry {attempt + 1} in {delay:.1f}s: {error}"
+        )
+        return delay
+
+    async def _run_once(
+        self, call: Callable[[], Awaitable[T]], tokens: int, priority: Priority
+    ) -> T:
+        with timed("gemini_queue"):
+            await self._acquire(tokens, priority)
+        saturated = self.in_flight >= int(self.limit)
+        started = self._clock()
+        try:
+            with timed("gemini"):
+                result = await call()
+        except Exception as e:
+            if _status_code(e) in THROTTLE_STATUS_CODES:
+                self._on_throttle(e)
+            raise
+        finally:
+            self.in_flight -= 1
+            self._dispatch()
+
+        self.completed += 1
+        self._on_success(self._clock() - started, saturated)
+        usage = getattr(result, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None)
+        if actual is not None:
+            self.tokens.adjust(actual - tokens)
+        return result
+
+    async def _stream_once(
+        self,
+        call: Callable[[], Awaitable[AsyncIterator[T]]],
+        tokens: int,
+        priority: Priority,
+    ) -> AsyncIterator[T]:
+        with timed("gemini_queue"):
+            await self._acquire(tokens, priority)
+        saturated = self.in_flight >= int(self.limit)
+        started = self._clock()
+        last = None
+        try:
+            with timed("gemini"):
+                async with aclosing(await call()) as chunks:
+                    async for chunk in chunks:
+                        last = chunk
+                        yield chunk
+        except Exception as e:
+            if _status_code(e) in THROTTLE_STATUS_CODES:
+                self._on_throttle(e)
+            raise
+        finally:
+            self.in_flight -= 1
+            self._dispatch()
+
+        self.completed += 1
+        self._on_success(self._clock() - started, saturated)
+        # Streamed usage is cumulative; the last chunk carries the total.
+        usage = getattr(last, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None)
+        if actual is not None:
+            self.tokens.adjust(actual - tokens)
+
+    async def _acquire(self, tokens: int, priority: Priority) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._sequence), tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted a slot just as the caller went away.
+                self.in_flight -= 1
+                self._dispatch()
+            raise
+
+    def _dispatch(self) -> None:
+        """Hand out slots to waiting calls, highest priority lane first."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        now = self._clock()
+        while self._waiting:
+            _, _, tokens, future = self._waiting[0]
+            if future.done():
+                heapq.heappop(self._waiting)
+                continue
+            if self.in_flight >= int(self.limit):
+                return
+            wait = max(
+                self._paused_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(tokens, now),
+            )
+            if wait > 0:
+                # Later lanes wait too, so bulk work can't starve a pending
+                # interactive call of its quota.
+                self._timer = asyncio.get_running_loop().call_later(
+                    wait, self._dispatch
+                )
+                return
+            heapq.heappop(self._waiting)
+            self.requests.take(1, now)
+            self.tokens.take(tokens, now)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _on_throttle(self, error: Exception) -> None:
+        self.throttled += 1
+        now = self._clock()
+        # Everything dispatched in the same window sees the same 429s; back
+        # off once per window rather than once per failed call.
+        if now - self._last_decrease >= (self._fast_latency or 1.0):
+            self.limit = max(MIN_CONCURRENCY, self.limit * THROTTLE_BACKOFF)
+            self._last_decrease = now
+            logger.info(f"Gemini throttled, concurrency limit now {int(self.limit)}")
+        delay = _server_retry_delay(error)
+        if delay is not None:
+            self._paused_until = max(self._paused_until, now + delay)
+
+    def _on_success(self, latency: float, saturated: bool) -> None:
+        if self._fast_latency is None:
+            self._fast_latency = self._slow_latency = latency
+        else:
+            self._fast_latency += FAST_LATENCY_WEIGHT * (latency - self._fast_latency)
+            self._slow_latency += SLOW_LATENCY_WEIGHT * (latency - self._slow_latency)
+
+        now = self._clock()
+        if (
+            self._has_quota
+            and self._fast_latency > LATENCY_TOLERANCE * self._slow_latency
+        ):
+            if now - self._last_decrease >= self._fast_latency:
+                self.limit = max(MIN_CONCURRENCY, self.limit * LATENCY_BACKOFF)
+                self._last_decrease = now
+        elif saturated and self.limit < self.max_concurrency:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._dispatch()
+
+
+def estimate_tokens(contents: list[Any]) -> int:
+    """Rough prompt token count of ``generate_content`` contents."""
+    total = 0
+    for part in contents:
+        if isinstance(part, str):
+            total += len(part) // CHARS_PER_TOKEN
+        elif (
+            isinstance(part, types.Part)
+            and part.inline_data is not None
+            and (part.inline_data.mime_type or "").startswith("text/")
+        ):
+            total += len(part.inline_data.data or b"") // CHARS_PER_TOKEN
+        else:
+            total += FILE_TOKEN_ESTIMATE
+    return total
+
+
+def _status_code(error: Exception) -> int | None:
+    return error.code if isinstance(error, errors.APIError) else None
+
+
+def _error_type(error: Exception) -> str:
+    code = _status_code(error)
+    return str(code) if code is not None else type(error).__name__
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def _server_retry_delay(error: Exception) -> float | None:
+    """The ``retryDelay`` a 429 response asks for, in seconds."""
+    if not isinstance(error, errors.APIError) or not isinstance(error.details, dict):
+        return None
+    for detail in error.details.get("error", {}).get("details", []) or []:
+        delay = isinstance(detail, dict) and detail.get("retryDelay")
+        if isinstance(delay, str) and delay.endswith("s"):
+            try:
+                return float(delay[:-1])
+            except ValueError:
+                return None
+    return None
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    delay = RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1)
+    delay = min(RETRY_MAX_DELAY_SECONDS, delay) * random.uniform(0.5, 1.5)
+    server_delay = _server_retry_delay(error)
+    if server_delay is not None:
+        delay = max(delay, server_delay * random.uniform(1.0, 1.2))
+    return delay
+
+
+_scheduler: GeminiScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_gemini_scheduler() -> GeminiScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GeminiScheduler(
+                get_gemini_rpm(),
+                get_gemini_tpm(),
+                get_gemini_max_concurrency(),
+                get_gemini_max_retries(),
+            )
+        return _scheduler
@@ -1,11 +1,27 @@
+import asyncio
 import io
 import logging
 import os
+import time
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+from dataclasses import dataclass
 
-from google import genai
-from google.genai import types
+from google.genai import errors, types
 
-from utils import parse_json_response
+from config import get_gemini_text_first, get_inline_max_bytes
+from services.file_cleanup import ASSIGNMENT_DISPLAY_NAME, file_cleanup
+from services.gemini_client import get_client
+from services.gemini_scheduler import Priority, estimate_tokens, get_gemini_scheduler
+from services.metrics import GEMINI_UPLOAD_BYTES, STAGE_SECONDS, record_cache, timed
+from services.result_cache import get_result_cache, grading_cache_key
+from services.rubric_cache import rubric_cache
+from services.text_extraction import (
+    TEXT_EXTRACTABLE_EXTENSIONS,
+    ExtractedText,
+    get_extracted_text,
+)
+from utils import JsonStreamParser, parse_grading_response, validate_criterion
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,17 +38,150 @@ MIME_TYPE_MAP = {
     ".txt": "text/plain",
 }
 
+# Bump whenever the prompt or response schema changes so cached results made
+# with the old prompt are no longer served.
+PROMPT_VERSION = "1"
 
-def grade_work(
+
+async def grade_work(
     rubric: bytes,
     rubric_filename: str,
     notes: str,
     assignment: bytes,
     assignment_filename: str,
+    cache_mode: str = "use",
+    assignment_text: asyncio.Future[ExtractedText] | None = None,
+    priority: Priority = Priority.INTERACTIVE,
 ) -> dict:
+    """
+    Grade an assignment against a rubric with Gemini.
+
+    Assignments with a usable text layer (see ``ExtractedText.usable``) are
+    graded from their extracted text, which is far cheaper than the file;
+    scans and images still send the file, as does any assignment whose text
+    can't be extracted. ``assignment_text`` may be a task already extracting
+    it, shared with the caller's other uses of the text. ``priority`` picks
+    the Gemini scheduler lane: batches and queued jobs use ``Priority.BULK``.
+
+    When a result cache is configured, requests with the same rubric,
+    assignment (bytes and filename), notes and model are served from it and
+    the response reports ``cache`` as ``hit`` or ``miss``.
+    ``cache_mode="bypass"`` skips the lookup but still stores the fresh
+    result.
+    """
     logger.info(
         f"Starting grade_work with rubric: {rubric_filename}, assignment: {assignment_filename}"
     )
+    rubric_ext = os.path.splitext(rubric_filename)[1].lower()
+    error = _check_extensions(rubric_filename, assignment_filename)
+    if error is not None:
+        return error
+
+    model = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+    text = await _text_for_grading(assignment, assignment_filename, assignment_text)
+
+    cache = get_result_cache()
+    if cache is None:
+        return await _grade(
+            rubric,
+            rubric_ext,
+            notes,
+            assignment,
+            assignment_filename,
+            model,
+            text,
+            priority,
+        )
+
+    key = await _cache_key(
+        rubric, rubric_filename, assignment, assignment_filename, notes, model, text
+    )
+    if cache_mode != "bypass":
+        cached = await _cache_lookup(cache, key)
+        if cached is not None:
+            return {**cached, "cache": "hit"}
+
+    result = await _grade(
+        rubric,
+        rubric_ext,
+        notes,
+        assignment,
+        assignment_filename,
+        model,
+        text,
+        priority,
+    )
+    if "error" in result:
+        return result
+
+    await asyncio.to_thread(cache.set, key, result)
+    return {**result, "cache": "bypass" if cache_mode == "bypass" else "miss"}
+
+
+async def stream_grade_work(
+    rubric: bytes,
+    rubric_filename: str,
+    notes: str,
+    assignment: bytes,
+    assignment_filename: str,
+    cache_mode: str = "use",
+    priority: Priority = Priority.INTERACTIVE,
+) -> AsyncIterator[tuple[str, dict]]:
+    """
+    Grade like ``grade_work``, yielding feedback while Gemini generates it.
+
+    Yields ``(event, data)`` pairs: ``criterion`` for each
+    ``criteria_feedback`` item as soon as it is complete (with its
+    ``index``), ``overall_feedback`` once that is complete, then ``result``
+    with the same validated dict ``grade_work`` returns, or ``error``.
+    Cache hits replay the cached result as the same events.
+    """
+    logger.info(
+        f"Starting stream_grade_work with rubric: {rubric_filename}, assignment: {assignment_filename}"
+    )
+    rubric_ext = os.path.splitext(rubric_filename)[1].lower()
+    error = _check_extensions(rubric_filename, assignment_filename)
+    if error is not None:
+        yield "error", error
+        return
+
+    model = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+    text = await _text_for_grading(assignment, assignment_filename, None)
+
+    cache = get_result_cache()
+    key = None
+    if cache is not None:
+        key = await _cache_key(
+            rubric, rubric_filename, assignment, assignment_filename, notes, model, text
+        )
+        if cache_mode != "bypass":
+            cached = await _cache_lookup(cache, key)
+            if cached is not None:
+                for index, item in enumerate(cached.get("criteria_feedback", [])):
+                    yield "criterion", {"index": index, **item}
+                yield "overall_feedback", {
+                    "overall_feedback": cached.get("overall_feedback", "")
+                }
+                yield "result", {**cached, "cache": "hit"}
+                return
+
+    async for event, data in _grade_stream(
+        rubric,
+        rubric_ext,
+        notes,
+        assignment,
+        assignment_filename,
+        model,
+        text,
+        priority,
+    ):
+        if event == "result" and cache is not None:
+            await asyncio.to_thread(cache.set, key, data)
+            data = {**data, "cache": "bypass" if cache_mode == "bypass" else "miss"}
+        yield event, data
+
+
+def _check_extensions(rubric_filename: str, assignment_filename: str) -> dict | None:
     rubric_ext = os.path.splitext(rubric_filename)[1].lower()
     assignment_ext = os.path.splitext(assignment_filename)[1].lower()
 
@@ -44,117 +193,407 @@ def grade_work(
         logger.error(f"Unsupported assignment file type: {assignment_ext}")
         return {"error": f"Unsupported file type: {assignment_ext}"}
 
-    logger.info("Checking API key configuration")
-    api_key = (
-        os.getenv("GEMINI_API_KEY", "").strip()
-        or os.getenv("GOOGLE_API_KEY", "").strip()
+    return None
+
+
+async def _text_for_grading(
+    assignment: bytes,
+    assignment_filename: str,
+    assignment_text: asyncio.Future[ExtractedText] | None,
+) -> str | None:
+    """The assignment's text when it should be graded from text, else None."""
+    assignment_ext = os.path.splitext(assignment_filename)[1].lower()
+    if not get_gemini_text_first() or assignment_ext not in TEXT_EXTRACTABLE_EXTENSIONS:
+        return None
+    try:
+        if assignment_text is None:
+            assignment_text = await asyncio.to_thread(
+                get_extracted_text, assignment, assignment_ext
+            )
+        else:
+            assignment_text = await assignment_text
+    except Exception as e:
+        logger.warning(
+            f"Text extraction failed for {assignment_filename}, sending the file: {e}"
+        )
+        return None
+    if not assignment_text.usable:
+        return None
+    logger.info(f"Grading {assignment_filename} from its extracted text")
+    return _format_pages(assignment_text)
+
+
+async def _cache_key(
+    rubric: bytes,
+    rubric_filename: str,
+    assignment: bytes,
+    assignment_filename: str,
+    notes: str,
+    model: str,
+    text: str | None,
+) -> str:
+    # Text-first and file grading send different prompts for the same bytes.
+    prompt_version = PROMPT_VERSION if text is None else f"{PROMPT_VERSION}-text"
+    return await asyncio.to_thread(
+        grading_cache_key,
+        rubric,
+        rubric_filename,
+        assignment,
+        assignment_filename,
+        notes,
+        model,
+        prompt_version,
     )
-    if not api_key:
-        logger.error("GEMINI_API_KEY not configured")
-        return {"error": "Grading failed", "detail": "GEMINI_API_KEY not configured"}
 
-    logger.info("Initializing Gemini client")
-    client = genai.Client(api_key=api_key)
-    model = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 
+async def _cache_lookup(cache, key: str) -> dict | None:
+    with timed("cache"):
+        cached = await asyncio.to_thread(cache.get, key)
+    record_cache("grade", cached is not None)
+    if cached is not None:
+        logger.info("Grading result cache hit")
+    return cached
+
+
+def _format_pages(extracted: ExtractedText) -> str:
+    if len(extracted.pages) == 1:
+        return extracted.pages[0]
+    return "\n".join(
+        f"--- Page {number} ---\n{page}"
+        for number, page in enumerate(extracted.pages, 1)
+    )
+
+
+@dataclass
+class _Parts:
+    """The rubric and assignment as prompt parts, plus what to clean up."""
+
+    rubric_key: str | None
+    rubric_part: types.Part | types.File
+    assignment_file: types.File | None
+    assignment_part: str | types.Part | types.File
+
+
+async def _prepare_parts(
+    client,
+    scheduler,
+    rubric: bytes,
+    rubric_ext: str,
+    assignment: bytes,
+    assignment_filename: str,
+    assignment_text: str | None,
+) -> _Parts | dict:
+    """Upload or inline the rubric and assignment (an error dict on failure)."""
+    assignment_ext = os.path.splitext(assignment_filename)[1].lower()
     rubric_mime = MIME_TYPE_MAP.get(rubric_ext, "application/octet-stream")
     assignment_mime = MIME_TYPE_MAP.get(assignment_ext, "application/octet-stream")
 
-    logger.info(f"Uploading rubric file: {rubric_filename}")
-    rubric_file = client.files.upload(
-        file=io.BytesIO(rubric),
-        config={"display_name": "rubric", "mime_type": rubric_mime},
-    )
+    # Small payloads are sent inline with the request; only larger ones go
+    # through the Files API upload/delete round trips.
+    inline_max = get_inline_max_bytes()
 
-    logger.info(f"Uploading assignment file: {assignment_filename}")
-    assignment_file = client.files.upload(
-        file=io.BytesIO(assignment),
-        config={"display_name": "assignment", "mime_type": assignment_mime},
-    )
+    async def no_upload():
+        return None
 
-    try:
-        logger.info("Building response schema")
-        response_schema = types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                "name": types.Schema(type=types.Type.STRING),
-                "overall_feedback": types.Schema(type=types.Type.STRING),
-                "criteria_feedback": types.Schema(
-                    type=types.Type.ARRAY,
-                    items=types.Schema(
-                        type=types.Type.OBJECT,
-                        properties={
-                            "criteria_title": types.Schema(type=types.Type.STRING),
-                            "score": types.Schema(type=types.Type.NUMBER),
-                            "score_max": types.Schema(type=types.Type.NUMBER),
-                            "feedback": types.Schema(type=types.Type.STRING),
-                        },
-                        required=["criteria_title", "score", "score_max", "feedback"],
-                    ),
-                ),
-            },
-            required=["overall_feedback", "criteria_feedback"],
+    if len(rubric) > inline_max:
+        rubric_task = scheduler.retry(
+            lambda: rubric_cache.get_or_upload(client, rubric, rubric_mime)
+        )
+    else:
+        rubric_task = no_upload()
+
+    if assignment_text is None and len(assignment) > inline_max:
+        logger.info(f"Uploading assignment file: {assignment_filename}")
+
+        async def upload_assignment():
+            with timed("upload"):
+                uploaded = await client.files.upload(
+                    file=io.BytesIO(assignment),
+                    config={
+                        "display_name": ASSIGNMENT_DISPLAY_NAME,
+                        "mime_type": assignment_mime,
+                    },
+                )
+            GEMINI_UPLOAD_BYTES.inc(len(assignment), file="assignment")
+            return uploaded
+
+        assignment_task = scheduler.retry(upload_assignment)
+    else:
+        assignment_task = no_upload()
+
+    rubric_upload, assignment_upload = await asyncio.gather(
+        rubric_task, assignment_task, return_exceptions=True
+    )
+    if isinstance(rubric_upload, BaseException) or isinstance(
+        assignment_upload, BaseException
+    ):
+        error = (
+            rubric_upload
+            if isinstance(rubric_upload, BaseException)
+            else assignment_upload
         )
+        logger.error(f"File upload failed: {error}")
+        if isinstance(assignment_upload, types.File):
+            file_cleanup.enqueue(assignment_upload.name)
+        if isinstance(rubric_upload, tuple):
+            rubric_cache.release(rubric_upload[1])
+        return {"error": "Grading failed", "detail": str(error)}
 
-        system_instruction = (
-            "You are an expert educational grading assistant.\n"
-            f"Instructor notes: {notes}\n\n"
-            "Grade the student assignment based on the attached rubric.\n"
-            "Provide detailed feedback for each criterion.\n"
-            "Calculate the score for each criterion and an overall score if applicable.\n"
-            "When possible, make sure the name field is filled with the student's name\n"
-            "Respond with valid JSON only."
+    if rubric_upload is not None:
+        rubric_key, rubric_part = rubric_upload
+    else:
+        rubric_key = None
+        rubric_part = types.Part.from_bytes(data=rubric, mime_type=rubric_mime)
+
+    if assignment_text is not None:
+        assignment_part = assignment_text
+    elif assignment_upload is not None:
+        assignment_part = assignment_upload
+    else:
+        assignment_part = types.Part.from_bytes(
+            data=assignment, mime_type=assignment_mime
         )
+    return _Parts(rubric_key, rubric_part, assignment_upload, assignment_part)
+
+
+def _grading_request(
+    notes: str,
+    parts: _Parts,
+    assignment_filename: str,
+    criteria_first: bool = False,
+) -> tuple[list, types.GenerateContentConfig]:
+    """
+    Build the grading prompt and config.
+
+    ``criteria_first`` asks for ``criteria_feedback`` before
+    ``overall_feedback``, so a streamed response reaches the first
+    criterion sooner.
+    """
+    logger.info("Building response schema")
+    response_schema = types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "name": types.Schema(type=types.Type.STRING),
+            "overall_feedback": types.Schema(type=types.Type.STRING),
+            "criteria_feedback": types.Schema(
+                type=types.Type.ARRAY,
+                items=types.Schema(
+                    type=types.Type.OBJECT,
+                    properties={
+                        "criteria_title": types.Schema(type=types.Type.STRING),
+                        "score": types.Schema(type=types.Type.NUMBER),
+                        "score_max": types.Schema(type=types.Type.NUMBER),
+                        "feedback": types.Schema(type=types.Type.STRING),
+                    },
+                    required=["criteria_title", "score", "score_max", "feedback"],
+                ),
+            ),
+        },
+        required=["overall_feedback", "criteria_feedback"],
+        property_ordering=(
+            ["name", "criteria_feedback", "overall_feedback"]
+            if criteria_first
+            else None
+        ),
+    )
+
+    system_instruction = (
+        "You are an expert educational grading assistant.\n"
+        f"Instructor notes: {notes}\n\n"
+        "Grade the student assignment based on the attached rubric.\n"
+        "Provide detailed feedback for each criterion.\n"
+        "Calculate the score for each criterion and an overall score if applicable.\n"
+        "When possible, make sure the name field is filled with the student's name\n"
+        "Respond with valid JSON only."
+    )
+
+    contents = [
+        "=== RUBRIC ===",
+        parts.rubric_part,
+        "\n=== STUDENT ASSIGNMENT ===",
+        f"\n file: {assignment_filename}\n",
+        parts.assignment_part,
+        "\nGrade this assignment according to the rubric. Following the instructor notes",
+    ]
+    config = types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        response_mime_type="application/json",
+        response_schema=response_schema,
+        temperature=0.1,
+        max_output_tokens=4000,
+    )
+    return contents, config
+
+
+def _grading_result(text: str) -> dict:
+    logger.info("Parsing AI response")
+    return parse_grading_response(text)
+
 
+def _grading_failed(error: Exception, parts: _Parts) -> dict:
+    logger.error(f"Grading failed with exception: {str(error)}")
+    if parts.rubric_key is not None and _rejects_file(error, parts.rubric_part):
+        # The cached rubric handle is gone or no longer ours; upload it anew.
+        rubric_cache.forget(parts.rubric_key, parts.rubric_part)
+    return {"error": "Grading failed", "detail": str(error)}
+
+
+def _rejects_file(error: Exception, file: types.File) -> bool:
+    """Whether Gemini refused ``error``'s request because ``file`` is unusable."""
+    if not isinstance(error, errors.ClientError) or error.code not in (403, 404):
+        return False
+    # Gemini names the file in the message, with or without "files/".
+    return file.name.removeprefix("files/") in str(error)
+
+
+def _cleanup(parts: _Parts) -> None:
+    # The rubric upload stays cached for the next grade; only the
+    # assignment is removed here.
+    if parts.rubric_key is not None:
+        rubric_cache.release(parts.rubric_part)
+    if parts.assignment_file is not None:
+        logger.info("Queueing uploaded assignment file for cleanup")
+        file_cleanup.enqueue(parts.assignment_file.name)
+
+
+async def _grade(
+    rubric: bytes,
+    rubric_ext: str,
+    notes: str,
+    assignment: bytes,
+    assignment_filename: str,
+    model: str,
+    assignment_text: str | None = None,
+    priority: Priority = Priority.INTERACTIVE,
+) -> dict:
+    client = get_client()
+    if client is None:
+        logger.error("GEMINI_API_KEY not configured")
+        return {"error": "Grading failed", "detail": "GEMINI_API_KEY not configured"}
+    scheduler = get_gemini_scheduler()
+
+    parts = await _prepare_parts(
+        client,
+        scheduler,
+        rubric,
+        rubric_ext,
+        assignment,
+        assignment_filename,
+        assignment_text,
+    )
+    if isinstance(parts, dict):
+        return parts
+
+    try:
+        contents, config = _grading_request(notes, parts, assignment_filename)
         logger.info("Sending request to Gemini API for grading")
-        response = client.models.generate_content(
-            model=model,
-            contents=[
-                "=== RUBRIC ===",
-                rubric_file,
-                "\n=== STUDENT ASSIGNMENT ===",
-                f"\n file: {assignment_filename}\n",
-                assignment_file,
-                "\nGrade this assignment according to the rubric. Following the instructor notes",
-            ],
-            config=types.GenerateContentConfig(
-                system_instruction=system_instruction,
-                response_mime_type="application/json",
-                response_schema=response_schema,
-                temperature=0.1,
-                max_output_tokens=4000,
+        response = await scheduler.run(
+            lambda: client.models.generate_content(
+                model=model, contents=contents, config=config
             ),
+            tokens=estimate_tokens([config.system_instruction, *contents]),
+            priority=priority,
         )
 
         if response.text is None:
             logger.error("No content received from AI")
             return {"error": "Grading failed", "detail": "No content received from AI"}
 
-        logger.info("Parsing AI response")
-        result = parse_json_response(response.text.strip())
-
+        result = _grading_result(response.text)
         logger.info("Grading completed successfully")
-        return {
-            "name": result.get("name", ""),
-            "overall_feedback": result.get("overall_feedback", ""),
-            "criteria_feedback": result.get("criteria_feedback", []),
+        return result
+
+    except Exception as e:
+        return _grading_failed(e, parts)
+
+    finally:
+        _cleanup(parts)
+
+
+async def _grade_stream(
+    rubric: bytes,
+    rubric_ext: str,
+    notes: str,
+    assignment: bytes,
+    assignment_filename: str,
+    model: str,
+    assignment_text: str | None = None,
+    priority: Priority = Priority.INTERACTIVE,
+) -> AsyncIterator[tuple[str, dict]]:
+    client = get_client()
+    if client is None:
+        logger.error("GEMINI_API_KEY not configured")
+        yield "error", {
+            "error": "Grading failed",
+            "detail": "GEMINI_API_KEY not configured",
         }
+        return
+    scheduler = get_gemini_scheduler()
+
+    parts = await _prepare_parts(
+        client,
+        scheduler,
+        rubric,
+        rubric_ext,
+        assignment,
+        assignment_filename,
+        assignment_text,
+    )
+    if isinstance(parts, dict):
+        yield "error", parts
+        return
+
+    try:
+        contents, config = _grading_request(
+            notes, parts, assignment_filename, criteria_first=True
+        )
+        logger.info("Streaming grading response from Gemini API")
+        started = time.perf_counter()
+        first_criterion = True
+        parser = JsonStreamParser()
+        text: list[str] = []
+        chunks = scheduler.stream(
+            lambda: client.models.generate_content_stream(
+                model=model, contents=contents, config=config
+            ),
+            tokens=estimate_tokens([config.system_instruction, *contents]),
+            priority=priority,
+        )
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                if not chunk.text:
+                    continue
+                text.append(chunk.text)
+                for path, value in parser.feed(chunk.text):
+                    if path[0] == "criteria_feedback" and len(path) == 2:
+                        try:
+                            value = validate_criterion(value, path[1])
+                        except ValueError:
+                            # Reported by the final result instead.
+                            continue
+                        if first_criterion:
+                            first_criterion = False
+                            STAGE_SECONDS.observe(
+                                time.perf_counter() - started, stage="first_criterion"
+                            )
+                        yield "criterion", {"index": path[1], **value}
+                    elif path == ("overall_feedback",):
+                        yield "overall_feedback", {"overall_feedback": value}
+
+        if not text:
+            logger.error("No content received from AI")
+            yield "error", {
+                "error": "Grading failed",
+                "detail": "No content received from AI",
+            }
+            return
+
+        result = _grading_result("".join(text))
+        logger.info("Streamed grading completed successfully")
+        yield "result", result
 
     except Exception as e:
-        logger.error(f"Grading failed with exception: {str(e)}")
-        return {"error": "Grading failed", "detail": str(e)}
+        yield "error", _grading_failed(e, parts)
 
     finally:
-        logger.info("Cleaning up uploaded files")
-        if rubric_file.name:
-            try:
-                client.files.delete(name=rubric_file.name)
-                logger.info(f"Deleted rubric file: {rubric_file.name}")
-            except Exception as e:
-                logger.warning(f"Failed to delete rubric file: {e}")
-        if assignment_file.name:
-            try:
-                client.files.delete(name=assignment_file.name)
-                logger.info(f"Deleted assignment file: {assignment_file.name}")
-            except Exception as e:
-                logger.warning(f"Failed to delete assignment file: {e}")
+        _cleanup(parts)
@@ -0,0 +1,459 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass, field
+
+from config import (
+    get_job_lease_seconds,
+    get_job_retention_seconds,
+    get_job_store_path,
+    get_job_workers,
+)
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+FINISHED_STATUSES = {"succeeded", "failed"}
+
+# A job whose worker died mid-run is picked up again, at most this many runs
+# in total, so one upload that crashes the process can't take it down forever.
+MAX_JOB_ATTEMPTS = 3
+
+# Idle workers also poll, to pick up jobs submitted to other server processes
+# and jobs whose lease ran out.
+POLL_INTERVAL_SECONDS = 1.0
+PRUNE_INTERVAL_SECONDS = 60 * 60
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different request."""
+
+
+@dataclass
+class JobInput:
+    """Everything a worker needs to run a grading job."""
+
+    rubric: bytes
+    rubric_filename: str
+    assignment: bytes
+    assignment_filename: str
+    params: dict = field(default_factory=dict)
+
+    def request_hash(self) -> str:
+        digest = hashlib.sha256()
+        for part in (
+            hashlib.sha256(self.rubric).digest(),
+            self.rubric_filename.encode("utf-8"),
+            hashlib.sha256(self.assignment).digest(),
+            self.assignment_filename.encode("utf-8"),
+            json.dumps(self.params, sort_keys=True).encode("utf-8"),
+        ):
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.hexdigest()
+
+
+JobRunner = Callable[[JobInput], Awaitable[dict]]
+
+
+class JobStore:
+    """
+    Grading jobs and their uploads in SQLite.
+
+    A worker claims a job by taking a lease on it and renews the lease while
+    it runs. A job whose lease runs out (its process crashed or was killed)
+    can be claimed again, which is how interrupted jobs resume after a
+    restart and how several server processes share one queue. Uploads are
+    dropped once a job finishes; results are kept until pruned.
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, idempotency_key TEXT UNIQUE, "
+                "request_hash TEXT NOT NULL, status TEXT NOT NULL, "
+                "filename TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "lease_until REAL, result TEXT, created REAL NOT NULL, "
+                "started REAL, finished REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_inputs ("
+                "job_id TEXT PRIMARY KEY, rubric BLOB NOT NULL, "
+                "rubric_filename TEXT NOT NULL, assignment BLOB NOT NULL, "
+                "params TEXT NOT NULL)"
+            )
+
+    def submit(
+        self, job_input: JobInput, idempotency_key: str | None = None
+    ) -> tuple[dict, bool]:
+        """
+        Queue a job and return it with whether it was created.
+
+        A known idempotency key returns the existing job instead, or raises
+        ``IdempotencyConflict`` if it was used for a different request.
+        """
+        request_hash = job_input.request_hash()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO jobs (id, idempotency_key, request_hash, "
+                        "status, filename, created) VALUES (?, ?, ?, 'queued', ?, ?)",
+                        (
+                            job_id,
+                            idempotency_key,
+                            request_hash,
+                            job_input.assignment_filename,
+                            self._clock(),
+                        ),
+                    )
+                    self._conn.execute(
+                        "INSERT INTO job_inputs (job_id, rubric, rubric_filename, "
+                        "assignment, params) VALUES (?, ?, ?, ?, ?)",
+                        (
+                            job_id,
+                            job_input.rubric,
+                            job_input.rubric_filename,
+                            job_input.assignment,
+                            json.dumps(job_input.params),
+                        ),
+                    )
+                return self._get(job_id), True
+            except sqlite3.IntegrityError:
+                row = self._conn.execute(
+                    "SELECT id, request_hash FROM jobs WHERE idempotency_key = ?",
+                    (idempotency_key,),
+                ).fetchone()
+                if idempotency_key is None or row is None:
+                    raise
+        existing_id, existing_hash = row
+        if existing_hash != request_hash:
+            raise IdempotencyConflict(
+                f"Idempotency key {idempotency_key!r} was used for a different request"
+            )
+        return self.get(existing_id), False
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            return self._get(job_id)
+
+    def claim(self, lease_seconds: float) -> tuple[str, JobInput] | None:
+        """Lease the oldest runnable job, preferring ones whose worker died."""
+        while True:
+            now = self._clock()
+            with self._lock:
+                row = (
+                    self._conn.execute(
+                        "SELECT id, status, attempts, filename FROM jobs "
+                        "WHERE status = 'running' AND lease_until < ? "
+                        "ORDER BY created LIMIT 1",
+                        (now,),
+                    ).fetchone()
+                    or self._conn.execute(
+                        "SELECT id, status, attempts, filename FROM jobs "
+                        "WHERE status = 'queued' ORDER BY created LIMIT 1"
+                    ).fetchone()
+                )
+                if row is None:
+                    return None
+                job_id, status, attempts, filename = row
+
+                if attempts >= MAX_JOB_ATTEMPTS:
+                    logger.warning(f"Job {job_id} interrupted {attempts} times")
+                    self._finish(
+                        job_id,
+                        {
+                            "error": "Grading failed",
+                            "detail": f"Job was interrupted {attempts} times",
+                        },
+                    )
+                    continue
+
+                # Conditional on the state just read, so two processes can't
+                # both claim the job.
+                with self._conn:
+                    cursor = self._conn.execute(
+                        "UPDATE jobs SET status = 'running', lease_until = ?, "
+                        "attempts = attempts + 1, started = ? WHERE id = ? "
+                        "AND status = ? AND attempts = ?",
+                        (now + lease_seconds, now, job_id, status, attempts),
+                    )
+                if cursor.rowcount == 0:
+                    continue
+                inputs = self._conn.execute(
+                    "SELECT rubric, rubric_filename, assignment, params "
+                    "FROM job_inputs WHERE job_id = ?",
+                    (job_id,),
+                ).fetchone()
+
+            if status == "running":
+                logger.info(f"Resuming interrupted job {job_id}")
+            rubric, rubric_filename, assignment, params = inputs
+            return job_id, JobInput(
+                rubric=rubric,
+                rubric_filename=rubric_filename,
+                assignment=assignment,
+                assignment_filename=filename,
+                params=json.loads(params),
+            )
+
+    def renew(self, job_id: str, lease_seconds: float) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+                (self._clock() + lease_seconds, job_id),
+            )
+
+    def release(self, job_ids: list[str]) -> None:
+        """Hand running jobs back to the queue without counting the attempt."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'queued', lease_until = NULL, "
+                "attempts = attempts - 1 WHERE id = ? AND status = 'running'",
+                [(job_id,) for job_id in job_ids],
+            )
+
+    def finish(self, job_id: str, result: dict) -> None:
+        """Record a job's result; results with an ``error`` mark it failed."""
+        with self._lock:
+            self._finish(job_id, result)
+
+    def prune(self, max_age_seconds: float) -> int:
+        """Delete jobs that finished more than ``max_age_seconds`` ago."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') "
+                "AND finished < ?",
+                (self._clock() - max_age_seconds,),
+            )
+        return cursor.rowcount
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def _finish(self, job_id: str, result: dict) -> None:
+        status = "failed" if "error" in result else "succeeded"
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished = ?, "
+                "lease_until = NULL WHERE id = ?",
+                (status, json.dumps(result), self._clock(), job_id),
+            )
+            self._conn.execute("DELETE FROM job_inputs WHERE job_id = ?", (job_id,))
+
+    def _get(self, job_id: str) -> dict | None:
+        row = self._conn.execute(
+            "SELECT id, status, filename, attempts, result, created, started, "
+            "finished FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, status, filename, attempts, result, created, started, finished = row
+        job = {
+            "id": job_id,
+            "status": status,
+            "filename": filename,
+            "attempts": attempts,
+            "created_at": created,
+            "started_at": started,
+            "finished_at": finished,
+        }
+        if status == "succeeded":
+            job["result"] = json.loads(result)
+        elif status == "failed":
+            job.update(json.loads(result))
+        return job
+
+
+class JobQueue:
+    """
+    Runs queued grading jobs on a pool of asyncio workers.
+
+    Submissions return at once; the HTTP request no longer waits on Gemini.
+    Jobs are persisted first, so a burst just lengthens the queue, and a
+    restart picks interrupted jobs up again once their lease runs out.
+    """
+
+    def __init__(self):
+        self._store: JobStore | None = None
+        self._runner: JobRunner | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+        self._running: set[str] = set()
+        self._watchers: dict[str, set[asyncio.Event]] = {}
+        self._store_lock = threading.Lock()
+
+    @property
+    def store(self) -> JobStore:
+        with self._store_lock:
+            if self._store is None:
+                self._store = JobStore(get_job_store_path())
+            return self._store
+
+    def start(self, runner: JobRunner, workers: int | None = None) -> None:
+        if self._tasks:
+            return
+        self._runner = runner
+        self._wakeup = asyncio.Event()
+        for _ in range(workers or get_job_workers()):
+            self._tasks.append(asyncio.create_task(self._worker_loop()))
+        self._tasks.append(asyncio.create_task(self._prune_loop()))
+
+    async def stop(self) -> None:
+        """Stop the workers and hand their unfinished jobs back to the queue."""
+        if not self._tasks:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._running:
+            logger.info(f"Requeueing {len(self._running)} unfinished jobs")
+            await asyncio.to_thread(self.store.release, list(self._running))
+            self._running.clear()
+
+    async def submit(
+        self, job_input: JobInput, idempotency_key: str | None = None
+    ) -> tuple[dict, bool]:
+        job, created = await asyncio.to_thread(
+            self.store.submit, job_input, idempotency_key
+        )
+        if created and self._wakeup is not None:
+            self._wakeup.set()
+        return job, created
+
+    async def get(self, job_id: str) -> dict | None:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def watch(
+        self, job_id: str, interval: float = 5.0
+    ) -> AsyncIterator[dict | None]:
+        """
+        Yield the job each time its status changes, until it finishes.
+
+        Yields None after ``interval`` seconds without a change, so callers
+        can keep the connection alive; the job is re-read then too, which
+        picks up jobs run by other server processes.
+        """
+        changed = asyncio.Event()
+        self._watchers.setdefault(job_id, set()).add(changed)
+        try:
+            last_status = None
+            while True:
+                changed.clear()
+                job = await self.get(job_id)
+                if job is None:
+                    return
+                if job["status"] != last_status:
+                    last_status = job["status"]
+                    yield job
+                    if last_status in FINISHED_STATUSES:
+                        return
+                try:
+                    await asyncio.wait_for(changed.wait(), interval)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            watchers = self._watchers.get(job_id)
+            if watchers is not None:
+                watchers.discard(changed)
+                if not watchers:
+                    del self._watchers[job_id]
+
+    def stats(self) -> dict:
+        return {
+            **self.store.counts(),
+            "workers": max(0, len(self._tasks) - 1),
+            "active": len(self._running),
+        }
+
+    def _notify(self, job_id: str) -> None:
+        for changed in self._watchers.get(job_id, ()):
+            changed.set()
+
+    async def _worker_loop(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = await asyncio.to_thread(
+                    self.store.claim, get_job_lease_seconds()
+                )
+            except Exception as e:
+                logger.error(f"Claiming a job failed: {str(e)}")
+                claimed = None
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(*claimed)
+
+    async def _run(self, job_id: str, job_input: JobInput) -> None:
+        self._running.add(job_id)
+        self._notify(job_id)
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            result = await self._runner(job_input)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            result = {"error": "Grading failed", "detail": str(e)}
+        finally:
+            heartbeat.cancel()
+
+        await asyncio.to_thread(self.store.finish, job_id, result)
+        self._running.discard(job_id)
+        self._notify(job_id)
+        logger.info(f"Job {job_id} finished")
+
+    async def _heartbeat(self, job_id: str) -> None:
+        lease = get_job_lease_seconds()
+        while True:
+            await asyncio.sleep(lease / 3)
+            try:
+                await asyncio.to_thread(self.store.renew, job_id, lease)
+            except Exception as e:
+                logger.warning(f"Renewing the lease of job {job_id} failed: {e}")
+
+    async def _prune_loop(self) -> None:
+        while True:
+            try:
+                pruned = await asyncio.to_thread(
+                    self.store.prune, get_job_retention_seconds()
+                )
+                if pruned:
+                    logger.info(f"Pruned {pruned} finished jobs")
+            except Exception as e:
+                logger.warning(f"Pruning finished jobs failed: {e}")
+            await asyncio.sleep(PRUNE_INTERVAL_SECONDS)
+
+
+job_queue = JobQueue()
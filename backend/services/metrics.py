@@ -0,0 +1,230 @@
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+
+# Prometheus text exposition format, rendered by /metrics.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+_registry: list["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple[str, ...], extra: tuple = ()) -> str:
+        pairs = [*zip(self.labelnames, key), *extra]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self._samples(),
+        ]
+
+    @abstractmethod
+    def _samples(self) -> list[str]: ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._labels(key)} {value}" for key, value in values]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._labels(key)} {value}" for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (last is +Inf), sum]
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else repr(float(bound))
+                lines.append(
+                    f"{self.name}_bucket{self._labels(key, (('le', le),))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "grader_stage_seconds", "Time spent in each grading stage.", ("stage",)
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "grader_http_request_seconds",
+    "Time to response headers, by route.",
+    ("method", "route", "status"),
+)
+CACHE_REQUESTS = Counter(
+    "grader_cache_requests_total",
+    "Cache lookups by cache and result.",
+    ("cache", "result"),
+)
+GEMINI_ERRORS = Counter(
+    "grader_gemini_errors_total",
+    "Failed Gemini calls by status code or exception.",
+    ("type",),
+)
+GEMINI_UPLOAD_BYTES = Counter(
+    "grader_gemini_upload_bytes_total",
+    "Bytes uploaded to the Gemini Files API.",
+    ("file",),
+)
+PAGES_RENDERED = Counter(
+    "grader_pages_rendered_total", "Page images rendered (render cache misses)."
+)
+GEMINI_CONCURRENCY_LIMIT = Gauge(
+    "grader_gemini_concurrency_limit", "Current adaptive Gemini concurrency limit."
+)
+GEMINI_IN_FLIGHT = Gauge("grader_gemini_in_flight", "Gemini calls in progress.")
+GEMINI_QUEUED = Gauge(
+    "grader_gemini_queued", "Gemini calls waiting for the scheduler.", ("lane",)
+)
+JOBS = Gauge("grader_jobs", "Grading jobs by status.", ("status",))
+
+
+# Stage durations of the current HTTP request, for its Server-Timing header.
+# Tasks and threads started by the request inherit the same dict.
+request_timings: ContextVar[dict[str, float] | None] = ContextVar(
+    "request_timings", default=None
+)
+_timings_lock = threading.Lock()
+
+
+class timed:
+    """Context manager recording how long its block takes as ``stage``."""
+
+    __slots__ = ("stage", "_started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> None:
+        self._started = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = time.perf_counter() - self._started
+        STAGE_SECONDS.observe(elapsed, stage=self.stage)
+        timings = request_timings.get()
+        if timings is not None:
+            with _timings_lock:
+                timings[self.stage] = timings.get(self.stage, 0.0) + elapsed
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def server_timing(timings: dict[str, float], total: float) -> str:
+    """
+    Format a ``Server-Timing`` header value in milliseconds.
+
+    Stages that ran concurrently (e.g. grading and rendering) each report
+    their own duration, so they can add up to more than ``total``.
+    """
+    with _timings_lock:
+        stages = list(timings.items())
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
@@ -1,67 +1,149 @@
-import os
+import asyncio
 
-from utils import parse_json_response
+import numpy as np
 
+from services.metrics import timed
+from services.minhash import (
+    candidate_pairs,
+    matching_spans,
+    overlap,
+    shingle,
+    signature,
+)
 
-def check_plagiarism(texts: list[str], filenames: list[str] | None = None) -> dict:
+
+def find_similar_pairs(
+    texts: list[str],
+    filenames: list[str] | None = None,
+    top_k: int = 10,
+    min_similarity: float = 0.0,
+) -> list[dict]:
+    """
+    Find the most similar pairs of essays, locally and without API calls.
+
+    Essays are reduced to word-shingle MinHash signatures; LSH banding picks
+    candidate pairs, whose exact shingle overlap is then measured. Returns up
+    to ``top_k`` pairs, most similar first, each with the indices (and
+    filenames, when given) of both essays, Jaccard similarity and containment
+    as percentages, and the character spans of the longest shared passages.
     """
-    Use Gemini to compare essays and return the highest pairwise similarity as a percentage.
+    if len(texts) < 2:
+        return []
+
+    shingles = [shingle(text or "") for text in texts]
+    unique = [s.unique() for s in shingles]
+    signatures = np.stack([signature(u) for u in unique])
+
+    scored = []
+    for first, second in candidate_pairs(signatures):
+        similarity, containment = overlap(unique[first], unique[second])
+        if similarity <= 0 or similarity < min_similarity:
+            continue
+        scored.append((similarity, containment, first, second))
+
+    scored.sort(reverse=True)
+    pairs = []
+    for similarity, containment, first, second in scored[:top_k]:
+        pair = {
+            "pair": [first, second],
+            "similarity_percent": round(similarity * 100, 2),
+            "containment_percent": round(containment * 100, 2),
+            "spans": matching_spans(shingles[first], shingles[second]),
+        }
+        if filenames:
+            pair["filenames"] = [filenames[first], filenames[second]]
+        pairs.append(pair)
+    return pairs
+
+
+async def check_plagiarism(
+    texts: list[str],
+    filenames: list[str] | None = None,
+    top_k: int = 10,
+    use_corpus: bool = False,
+    corpus_ids: list[str] | None = None,
+) -> dict:
+    """
+    Compare essays pairwise and report the most similar pairs.
 
     Args:
         texts: List of essay text strings.
-        filenames: Optional (unused in Gemini version).
+        filenames: Optional names reported alongside each pair.
+        top_k: Number of pairs to return.
+        use_corpus: Also match each essay against the corpus of past
+            submissions (see services.corpus_index).
+        corpus_ids: The essays' ``corpus_id``s, so an essay already in the
+            corpus (backfilled or graded before) doesn't match itself.
 
     Returns:
-        {"overall_max_percent": 35.2}
+        {"overall_max_percent": 35.2, "pairs": [...]} (see find_similar_pairs),
+        plus "corpus_matches" when ``use_corpus`` is set.
     """
-    n = len(texts)
-    if n < 2:
-        return {"overall_max_percent": 0.0}
-
-    valid = [t.strip() for t in texts if t and len(t.strip()) > 50]
-    if len(valid) < 2:
-        return {"overall_max_percent": 0.0}
-
-    api_key = (
-        os.getenv("GEMINI_API_KEY", "").strip()
-        or os.getenv("GOOGLE_API_KEY", "").strip()
-    )
-    if not api_key:
-        return {"overall_max_percent": 0.0}
-
-    max_chars_per_essay = 4000
-    truncated = [t[:max_chars_per_essay] for t in valid]
-
-    parts = []
-    for i, t in enumerate(truncated, 1):
-        parts.append(f"=== Essay {i} ===\n{t}\n")
-    parts.append(
-        "Compare the above essays for plagiarism/similarity (content overlap, phrasing, structure). "
-        "Return a single JSON object with one number: the highest similarity percentage (0-100) between ANY two essays. "
-        'Example: {"overall_max_percent": 35}. Return ONLY valid JSON, nothing else.'
-    )
-    prompt = "\n".join(parts)
-
-    try:
-        from google import genai
-
-        client = genai.Client(api_key=api_key)
-        model = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
-        response = client.models.generate_content(
-            model=model,
-            contents=prompt,
-            config={
-                "temperature": 0.2,
-                "max_output_tokens": 100,
-                "response_mime_type": "application/json",
-            },
-        )
-        content = response.text
-        if content is None:
-            return {"overall_max_percent": 0.0}
-        data = parse_json_response(content.strip())
-        pct = float(data.get("overall_max_percent", 0))
-        pct = max(0.0, min(100.0, pct))
-        return {"overall_max_percent": round(pct, 2)}
-    except Exception:
-        return {"overall_max_percent": 0.0}
+    if len(texts) < 2 and not use_corpus:
+        return {"overall_max_percent": 0.0, "pairs": []}
+
+    with timed("plagiarism"):
+        pairs = await asyncio.to_thread(find_similar_pairs, texts, filenames, top_k)
+    overall = pairs[0]["similarity_percent"] if pairs else 0.0
+    result = {"overall_max_percent": overall, "pairs": pairs}
+
+    if use_corpus:
+        with timed("plagiarism"):
+            corpus_matches = await asyncio.to_thread(
+                _corpus_matches, texts, filenames, top_k, corpus_ids
+            )
+        for item in corpus_matches:
+            overall = max(overall, item["matches"][0]["similarity_percent"])
+        result["overall_max_percent"] = overall
+        result["corpus_matches"] = corpus_matches
+
+    return result
+
+
+async def add_to_corpus(
+    texts: list[str],
+    external_ids: list[str],
+    term: str | None = None,
+    filenames: list[str] | None = None,
+) -> int:
+    """
+    Index submissions in the corpus so later checks match against them.
+
+    Re-adding an id replaces the earlier submission. Empty texts are skipped.
+    Returns how many submissions were indexed.
+    """
+    from services.corpus_index import get_corpus_index
+
+    items = [
+        (text, external_id, term, filenames[i] if filenames else None)
+        for i, (text, external_id) in enumerate(zip(texts, external_ids))
+        if text
+    ]
+    if not items:
+        return 0
+    with timed("plagiarism"):
+        return await asyncio.to_thread(get_corpus_index().add_many, items)
+
+
+def _corpus_matches(
+    texts: list[str],
+    filenames: list[str] | None,
+    top_k: int,
+    corpus_ids: list[str] | None,
+) -> list[dict]:
+    from services.corpus_index import get_corpus_index
+
+    index = get_corpus_index()
+    corpus_matches = []
+    for i, text in enumerate(texts):
+        matches = index.query(text or "", top_k=top_k + 1)
+        if corpus_ids:
+            matches = [m for m in matches if m["id"] != corpus_ids[i]]
+        matches = matches[:top_k]
+        if not matches:
+            continue
+        item = {"index": i, "matches": matches}
+        if filenames:
+            item["filename"] = filenames[i]
+        corpus_matches.append(item)
+    return corpus_matches
@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable
+
+from config import get_render_cache_dir, get_render_cache_max_bytes
+from services.metrics import PAGES_RENDERED, record_cache
+
+logger = logging.getLogger(__name__)
+
+META_FILENAME = "meta.json"
+
+# Unfinished entries older than this are left over from a crashed writer.
+STALE_TMP_SECONDS = 60 * 60
+
+
+class RenderCache:
+    """
+    Content-addressed disk cache of rendered page images.
+
+    Each entry is a directory named by its key holding one pre-encoded file
+    per page plus a small meta file. Entries are written to a temp directory
+    and renamed into place, so readers only ever see complete documents.
+    The cache is bounded by total size and evicts least recently used
+    documents. Concurrent renders of the same key are coalesced.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] | None = None
+        self._total_bytes = 0
+        self._inflight: dict[str, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get_pages(self, key: str) -> list[bytes] | None:
+        """Return every cached page for ``key``, or None on a miss."""
+        meta = self._read_meta(key)
+        if meta is None:
+            return None
+        entry_dir = self._entry_dir(key)
+        try:
+            pages = []
+            for index in range(meta["page_count"]):
+                with open(os.path.join(entry_dir, _page_filename(index)), "rb") as f:
+                    pages.append(f.read())
+        except OSError:
+            return None
+        self._touch(key)
+        return pages
+
+    def get_page(self, key: str, index: int) -> bytes | None:
+        """Return a single cached page, reading only that page's file."""
+        meta = self._read_meta(key)
+        if meta is None or not 0 <= index < meta["page_count"]:
+            return None
+        try:
+            with open(
+                os.path.join(self._entry_dir(key), _page_filename(index)), "rb"
+            ) as f:
+                page = f.read()
+        except OSError:
+            return None
+        self._touch(key)
+        return page
+
+    def get_or_render(self, key: str, render: Callable[[], list[bytes]]) -> list[bytes]:
+        """Serve ``key`` from the cache, rendering and storing it on a miss."""
+        if not self.enabled:
+            pages = render()
+            PAGES_RENDERED.inc(len(pages))
+            return pages
+
+        while True:
+            pages = self.get_pages(key)
+            if pages is not None:
+                self.record_hit()
+                return pages
+
+            with self._lock:
+                event = self._inflight.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._inflight[key] = event
+                    owner = True
+                else:
+                    owner = False
+
+            if not owner:
+                # Someone else is rendering this document; wait and re-check.
+                event.wait()
+                continue
+
+            try:
+                self.record_miss()
+                pages = render()
+                PAGES_RENDERED.inc(len(pages))
+                self.store(key, pages)
+                return pages
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+    def record_hit(self) -> None:
+        self.hits += 1
+        record_cache("render", True)
+
+    def record_miss(self) -> None:
+        self.misses += 1
+        record_cache("render", False)
+
+    def store(self, key: str, pages: list[bytes]) -> None:
+        writer = self.open_writer(key)
+        if writer is None:
+            return
+        for page in pages:
+            writer.add(page)
+        writer.commit()
+
+    def open_writer(self, key: str) -> "_EntryWriter | None":
+        """Start writing an entry page by page (None when the cache is off)."""
+        if not self.enabled:
+            return None
+        tmp_dir = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        try:
+            os.makedirs(tmp_dir)
+        except OSError as e:
+            logger.warning(f"Failed to open render cache entry: {e}")
+            return None
+        return _EntryWriter(self, key, tmp_dir)
+
+    def _commit(self, key: str, tmp_dir: str, page_count: int, size: int) -> None:
+        with self._lock:
+            # Index existing entries before this one lands on disk.
+            self._load_entries()
+        try:
+            with open(os.path.join(tmp_dir, META_FILENAME), "w") as f:
+                json.dump({"page_count": page_count, "size": size}, f)
+            entry_dir = self._entry_dir(key)
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Either another worker stored the same document first or the
+            # write failed; both leave the cache consistent.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        with self._lock:
+            entries = self._load_entries()
+            self._total_bytes += size - entries.get(key, 0)
+            entries[key] = size
+            evicted = self._pop_over_budget()
+        self._remove(evicted)
+
+    def _read_meta(self, key: str) -> dict | None:
+        if not self.enabled:
+            return None
+        try:
+            with open(os.path.join(self._entry_dir(key), META_FILENAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _touch(self, key: str) -> None:
+        try:
+            os.utime(os.path.join(self._entry_dir(key), META_FILENAME))
+        except OSError:
+            pass
+        with self._lock:
+            entries = self._load_entries()
+            if key in entries:
+                entries.move_to_end(key)
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_entries(self) -> OrderedDict[str, int]:
+        """Index existing entries by last use, scanning the directory once."""
+        if self._entries is not None:
+            return self._entries
+
+        found = []
+        if os.path.isdir(self.directory):
+            for shard in os.listdir(self.directory):
+                shard_dir = os.path.join(self.directory, shard)
+                if shard.startswith(".tmp-"):
+                    try:
+                        age = time.time() - os.path.getmtime(shard_dir)
+                    except OSError:
+                        continue
+                    if age > STALE_TMP_SECONDS:
+                        shutil.rmtree(shard_dir, ignore_errors=True)
+                    continue
+                if not os.path.isdir(shard_dir):
+                    continue
+                for key in os.listdir(shard_dir):
+                    meta_path = os.path.join(shard_dir, key, META_FILENAME)
+                    try:
+                        with open(meta_path) as f:
+                            size = json.load(f)["size"]
+                        found.append((os.path.getmtime(meta_path), key, size))
+                    except (OSError, ValueError, KeyError):
+                        continue
+
+        self._entries = OrderedDict()
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        return self._entries
+
+    def _pop_over_budget(self) -> list[str]:
+        evicted = []
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            evicted.append(key)
+        return evicted
+
+    def _remove(self, keys: list[str]) -> None:
+        for key in keys:
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        if keys:
+            logger.info(f"Evicted {len(keys)} documents from the render cache")
+
+
+class _EntryWriter:
+    def __init__(self, cache: RenderCache, key: str, tmp_dir: str):
+        self._cache = cache
+        self._key = key
+        self._tmp_dir = tmp_dir
+        self._page_count = 0
+        self._size = 0
+        self._failed = False
+
+    def add(self, page: bytes) -> None:
+        if self._failed:
+            return
+        try:
+            path = os.path.join(self._tmp_dir, _page_filename(self._page_count))
+            with open(path, "wb") as f:
+                f.write(page)
+        except OSError as e:
+            logger.warning(f"Failed to write rendered page to cache: {e}")
+            self._failed = True
+            return
+        self._page_count += 1
+        self._size += len(page)
+
+    def commit(self) -> None:
+        if self._failed:
+            self.abort()
+            return
+        self._cache._commit(self._key, self._tmp_dir, self._page_count, self._size)
+
+    def abort(self) -> None:
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+def _page_filename(index: int) -> str:
+    return f"{index}.page"
+
+
+_render_cache: RenderCache | None = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> RenderCache:
+    global _render_cache
+    with _render_cache_lock:
+        if _render_cache is None:
+            _render_cache = RenderCache(
+                get_render_cache_dir(), get_render_cache_max_bytes()
+            )
+        return _render_cache
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from config import (
+    get_grade_cache_backend,
+    get_grade_cache_max_bytes,
+    get_grade_cache_max_entries,
+    get_grade_cache_path,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def grading_cache_key(
+    rubric: bytes,
+    rubric_filename: str,
+    assignment: bytes,
+    assignment_filename: str,
+    notes: str,
+    model: str,
+    prompt_version: str,
+) -> str:
+    """
+    Build a deterministic cache key for one grading call.
+
+    The assignment filename is part of the prompt and, like the rubric's
+    extension, decides the mime type, so the same bytes under another name
+    get their own entry.
+    """
+    digest = hashlib.sha256()
+    for part in (
+        hashlib.sha256(rubric).digest(),
+        os.path.splitext(rubric_filename)[1].lower().encode("utf-8"),
+        hashlib.sha256(assignment).digest(),
+        assignment_filename.encode("utf-8"),
+        notes.encode("utf-8"),
+        model.encode("utf-8"),
+        prompt_version.encode("utf-8"),
+    ):
+        # Length-prefix each part so adjacent fields can't run into each other.
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache(ABC):
+    """Base class for grading result cache backends."""
+
+    @abstractmethod
+    def get(self, key: str) -> dict | None: ...
+
+    @abstractmethod
+    def set(self, key: str, value: dict) -> None: ...
+
+
+class MemoryResultCache(ResultCache):
+    """In-process LRU of grading results, bounded by entry count."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                return None
+            self._entries.move_to_end(key)
+        # Stored serialized so callers can't mutate the cached copy.
+        return json.loads(value)
+
+    def set(self, key: str, value: dict) -> None:
+        serialized = json.dumps(value)
+        with self._lock:
+            self._entries[key] = serialized
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SqliteResultCache(ResultCache):
+    """On-disk grading results in SQLite, evicted least-recently-used by size."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+            )
+
+    def get(self, key: str) -> dict | None:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict) -> None:
+        serialized = json.dumps(value)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (key, serialized, len(serialized), time.time()),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM results ORDER BY accessed ASC"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+        logger.info(f"Evicted {len(evicted)} cached grading results")
+
+
+_cache: ResultCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache | None:
+    """Get the configured grading result cache, or None when caching is off."""
+    global _cache
+    backend = get_grade_cache_backend()
+    if backend == "off":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            if backend == "sqlite":
+                _cache = SqliteResultCache(
+                    get_grade_cache_path(), get_grade_cache_max_bytes()
+                )
+            else:
+                _cache = MemoryResultCache(get_grade_cache_max_entries())
+            logger.info(f"Grading result cache enabled: {backend}")
+        return _cache
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import io
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from google.genai import types
+from google.genai.client import AsyncClient
+
+from config import get_rubric_cache_max_entries, get_rubric_cache_ttl_seconds
+from services.file_cleanup import RUBRIC_DISPLAY_NAME, file_cleanup
+from services.metrics import GEMINI_UPLOAD_BYTES, record_cache, timed
+
+logger = logging.getLogger(__name__)
+
+# Uploaded files are dropped by the Files API 48 hours after upload. Entries are
+# retired a little earlier so a handle is never used right as it disappears.
+EXPIRY_SAFETY_MARGIN_SECONDS = 60 * 60
+
+
+@dataclass
+class _Entry:
+    file: types.File
+    expires_at: float
+
+
+def rubric_cache_key(data: bytes, mime_type: str) -> str:
+    """Key a rubric by the SHA-256 of its bytes plus its mime type."""
+    return f"{hashlib.sha256(data).hexdigest()}:{mime_type}"
+
+
+class RubricFileCache:
+    """
+    LRU/TTL cache of rubric uploads in the Gemini Files API.
+
+    The same rubric is sent for every student in a section, so its uploaded
+    handle is reused instead of uploading it again for every grade. Remote
+    files are only deleted when their entry is evicted or forgotten, and not
+    before every grade that was handed the file has called ``release``.
+    """
+
+    def __init__(
+        self, max_entries: int | None = None, ttl_seconds: float | None = None
+    ):
+        # Limits left as None are read from config on use, after .env is loaded.
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        # Per-key upload locks, dropped once no grade is using them.
+        self._key_locks: dict[str, asyncio.Lock] = {}
+        self._key_lock_users: dict[str, int] = {}
+        # Grades currently sending each file, and dropped files whose remote
+        # delete waits for those grades to finish.
+        self._file_users: dict[str, int] = {}
+        self._retired: set[str] = set()
+
+    @property
+    def max_entries(self) -> int:
+        if self._max_entries is None:
+            return get_rubric_cache_max_entries()
+        return self._max_entries
+
+    @property
+    def ttl_seconds(self) -> float:
+        if self._ttl_seconds is None:
+            return get_rubric_cache_ttl_seconds()
+        return self._ttl_seconds
+
+    async def get_or_upload(
+        self, client: AsyncClient, data: bytes, mime_type: str
+    ) -> tuple[str, types.File]:
+        """
+        Return the cache key and an uploaded handle for the rubric bytes.
+
+        The caller must ``release`` the handle once its request is done.
+        """
+        key = rubric_cache_key(data, mime_type)
+        key_lock = self._key_locks.setdefault(key, asyncio.Lock())
+        self._key_lock_users[key] = self._key_lock_users.get(key, 0) + 1
+
+        # Concurrent grades of the same rubric wait for a single upload.
+        try:
+            async with key_lock:
+                entry = self._lookup(key)
+                record_cache("rubric", entry is not None)
+                if entry is not None:
+                    logger.info(f"Rubric cache hit: {entry.file.name}")
+                    self._acquire(entry.file)
+                    return key, entry.file
+
+                logger.info("Rubric cache miss, uploading rubric file")
+                with timed("upload"):
+                    uploaded = await client.files.upload(
+                        file=io.BytesIO(data),
+                        config={
+                            "display_name": RUBRIC_DISPLAY_NAME,
+                            "mime_type": mime_type,
+                        },
+                    )
+                GEMINI_UPLOAD_BYTES.inc(len(data), file="rubric")
+                self._acquire(uploaded)
+                self._store(key, uploaded)
+                return key, uploaded
+        finally:
+            self._release_key_lock(key)
+
+    def release(self, file: types.File) -> None:
+        """Mark a handle from ``get_or_upload`` as no longer in use."""
+        users = self._file_users.get(file.name, 0) - 1
+        if users > 0:
+            self._file_users[file.name] = users
+            return
+        self._file_users.pop(file.name, None)
+        if file.name in self._retired:
+            self._retired.discard(file.name)
+            self._delete_remote(file)
+
+    def forget(self, key: str, file: types.File) -> None:
+        """
+        Drop a handle Gemini rejected and delete the remote file.
+
+        The entry is only dropped if it still holds ``file``, so a grade
+        failing on an old handle can't evict a fresh upload.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.file.name == file.name:
+            del self._entries[key]
+        self._delete_remote(file)
+
+    def file_names(self) -> set[str]:
+        """Remote names of the uploads the cache holds or grades still use."""
+        names = {entry.file.name for entry in self._entries.values() if entry.file.name}
+        return names | self._file_users.keys()
+
+    def clear(self) -> None:
+        evicted = list(self._entries.values())
+        self._entries.clear()
+        for entry in evicted:
+            self._delete_remote(entry.file)
+
+    def _lookup(self, key: str) -> _Entry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at > time.time():
+            self._entries.move_to_end(key)
+            return entry
+        del self._entries[key]
+        self._delete_remote(entry.file)
+        return None
+
+    def _store(self, key: str, uploaded: types.File) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        if uploaded.expiration_time is not None:
+            expires_at = min(
+                expires_at,
+                uploaded.expiration_time.timestamp() - EXPIRY_SAFETY_MARGIN_SECONDS,
+            )
+
+        self._entries[key] = _Entry(file=uploaded, expires_at=expires_at)
+        self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            _, entry = self._entries.popitem(last=False)
+            evicted.append(entry)
+
+        for entry in evicted:
+            self._delete_remote(entry.file)
+
+    def _release_key_lock(self, key: str) -> None:
+        users = self._key_lock_users[key] - 1
+        if users:
+            self._key_lock_users[key] = users
+            return
+        # Nobody else holds or waits on it; whether the rubric was cached,
+        # expired or failed to upload, a later grade starts a fresh lock.
+        del self._key_lock_users[key]
+        del self._key_locks[key]
+
+    def _acquire(self, file: types.File) -> None:
+        self._file_users[file.name] = self._file_users.get(file.name, 0) + 1
+
+    def _delete_remote(self, file: types.File) -> None:
+        if self._file_users.get(file.name):
+            # A grade is still sending it; the last one to release deletes it.
+            self._retired.add(file.name)
+            return
+        logger.info(f"Evicting rubric file: {file.name}")
+        file_cleanup.enqueue(file.name)
+
+
+rubric_cache = RubricFileCache()
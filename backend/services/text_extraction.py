@@ -0,0 +1,139 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import fitz  # PyMuPDF
+
+from config import get_text_cache_max_entries, get_text_min_chars_per_page
+from services.metrics import record_cache, timed
+
+TEXT_EXTRACTABLE_EXTENSIONS = {".pdf", ".txt", ".docx"}
+
+# Share of extracted characters that must be letters, digits, whitespace or
+# ordinary punctuation. PDFs with broken font encodings extract as mostly
+# symbols and replacement characters.
+MIN_READABLE_RATIO = 0.85
+_PUNCTUATION = set(".,;:!?'\"()[]{}-–—/&%$#@*+=<>…‘’“”")
+
+
+@dataclass(frozen=True)
+class ExtractedText:
+    """Plain text of an upload, one entry per page (a single page for TXT/DOCX)."""
+
+    pages: tuple[str, ...]
+    ext: str
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(self.pages)
+
+    @property
+    def usable(self) -> bool:
+        """
+        Whether the text stands in for the file: true for TXT/DOCX, and for
+        PDFs whose text layer is dense and readable (not a scan).
+        """
+        text = self.text
+        if not text.strip():
+            return False
+        if self.ext != ".pdf":
+            return True
+
+        chars = sum(len(page.strip()) for page in self.pages)
+        if chars < get_text_min_chars_per_page() * len(self.pages):
+            return False
+        readable = sum(
+            1 for c in text if c.isalnum() or c.isspace() or c in _PUNCTUATION
+        )
+        return readable / len(text) >= MIN_READABLE_RATIO
+
+
+def extract_pages(data: bytes, ext: str) -> list[str]:
+    """
+    Pull the plain text out of an upload, page by page.
+
+    PDFs are read from their text layer, so scans yield little or nothing.
+    Images have no text and yield no pages.
+    """
+    ext = ext.lower()
+    if ext == ".txt":
+        return [data.decode("utf-8", errors="replace")]
+    if ext == ".pdf":
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            return [page.get_text() for page in doc]
+    if ext == ".docx":
+        from docx import Document
+
+        return ["\n".join(p.text for p in Document(io.BytesIO(data)).paragraphs)]
+    return []
+
+
+def extract_text(data: bytes, ext: str) -> str:
+    return get_extracted_text(data, ext).text
+
+
+class TextCache:
+    """
+    LRU of extracted text keyed by content hash.
+
+    Concurrent requests for the same upload wait for a single extraction,
+    so grading, detection and plagiarism checks share one pass over the file.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, ExtractedText] = OrderedDict()
+        self._inflight: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def get_or_extract(
+        self, data: bytes, ext: str, digest: str | None = None
+    ) -> ExtractedText:
+        ext = ext.lower()
+        key = f"{digest or hashlib.sha256(data).hexdigest()}{ext}"
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    record_cache("text", True)
+                    return entry
+                event = self._inflight.get(key)
+                owner = event is None
+                if owner:
+                    event = self._inflight[key] = threading.Event()
+
+            if not owner:
+                event.wait()
+                continue
+
+            try:
+                record_cache("text", False)
+                with timed("extract"):
+                    entry = ExtractedText(tuple(extract_pages(data, ext)), ext)
+                with self._lock:
+                    self._entries[key] = entry
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                return entry
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+
+_text_cache: TextCache | None = None
+_text_cache_lock = threading.Lock()
+
+
+def get_extracted_text(
+    data: bytes, ext: str, digest: str | None = None
+) -> ExtractedText:
+    """Extract an upload's text, reusing the result for bytes seen before."""
+    global _text_cache
+    with _text_cache_lock:
+        if _text_cache is None:
+            _text_cache = TextCache(get_text_cache_max_entries())
+    return _text_cache.get_or_extract(data, ext, digest)
@@ -0,0 +1,99 @@
+import asyncio
+import random
+
+import pytest
+
+import services.corpus_index as corpus_index
+from services.corpus_index import CorpusIndex, bulk_load, corpus_id
+from services.plagiarism import add_to_corpus, check_plagiarism
+
+TERM = "2026-spring"
+
+
+def _essay(seed: int, words: int = 400) -> str:
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = CorpusIndex(str(tmp_path / "corpus.sqlite3"))
+    monkeypatch.setattr(corpus_index, "_index", index)
+    return index
+
+
+def test_backfilled_essay_does_not_match_itself_when_graded(index, tmp_path):
+    submissions = tmp_path / "submissions"
+    submissions.mkdir()
+    data = _essay(1).encode()
+    (submissions / "essay.txt").write_bytes(data)
+    (submissions / "other.txt").write_bytes(_essay(2).encode())
+    assert bulk_load(index, [str(submissions)], TERM) == 2
+
+    # The same file graded in a batch of the same term.
+    texts = [data.decode()]
+    ids = [corpus_id(data, TERM)]
+    report = asyncio.run(
+        check_plagiarism(texts, ["upload.txt"], use_corpus=True, corpus_ids=ids)
+    )
+    assert report["corpus_matches"] == []
+
+    asyncio.run(add_to_corpus(texts, ids, TERM, ["upload.txt"]))
+    assert index.stats()["documents"] == 2
+
+
+def test_add_query_and_replace(index):
+    essay = _essay(1)
+    assert index.add(essay, "a", TERM, "a.txt")
+    assert not index.add("too short", "b", TERM)
+    assert index.add(_essay(2), "c", "2025-fall")
+
+    matches = index.query(essay)
+    assert [m["id"] for m in matches] == ["a"]
+    assert matches[0]["similarity_percent"] == 100.0
+    assert matches[0]["filename"] == "a.txt"
+    assert index.query(essay, exclude_term=TERM) == []
+
+    # Re-adding an id replaces the earlier submission.
+    assert index.add(_essay(3), "a", TERM)
+    assert index.query(essay) == []
+    assert index.stats() == {
+        "documents": 2,
+        "removed": 0,
+        "terms": {"2025-fall": 1, TERM: 1},
+    }
+
+
+def _bucket_rows(index: CorpusIndex) -> int:
+    return index._conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+
+def test_removed_submissions_free_their_candidate_slots(index, monkeypatch):
+    monkeypatch.setattr(corpus_index, "MAX_CANDIDATES", 3)
+    essay = _essay(1)
+    for i in range(3):
+        index.add(essay, f"old/{i}", TERM)
+    words = essay.split()
+    words[::40] = ["edited"] * len(words[::40])
+    index.add(" ".join(words), "live", TERM)
+    assert "live" not in [m["id"] for m in index.query(essay)]
+
+    for i in range(3):
+        assert index.remove(f"old/{i}")
+    assert not index.remove("old/0")
+    assert [m["id"] for m in index.query(essay)] == ["live"]
+    assert index.stats()["removed"] == 3
+
+
+def test_compact_purges_removed_submissions(index):
+    index.add(_essay(1), "a", TERM)
+    index.add(_essay(2), "b", TERM)
+    rows = _bucket_rows(index)
+    index.remove("a")
+    assert _bucket_rows(index) < rows
+
+    assert index.compact() == 1
+    assert index.stats() == {"documents": 1, "removed": 0, "terms": {TERM: 1}}
+    assert _bucket_rows(index) == rows // 2
+    assert index.compact() == 0
@@ -0,0 +1,226 @@
+import asyncio
+
+import pytest
+from google.genai import errors
+
+import services.gemini_scheduler as gemini_scheduler
+from services.gemini_scheduler import (
+    INITIAL_CONCURRENCY,
+    GeminiScheduler,
+    Priority,
+    TokenBucket,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _throttled(retry_delay: str | None = None) -> errors.ClientError:
+    details = [{"retryDelay": retry_delay}] if retry_delay else []
+    return errors.ClientError(
+        429,
+        {
+            "error": {
+                "message": "quota",
+                "status": "RESOURCE_EXHAUSTED",
+                "details": details,
+            }
+        },
+    )
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(gemini_scheduler, "_retry_delay", lambda error, attempt: 0)
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(60, now=0.0)
+    bucket.take(60, now=0.0)
+    assert bucket.wait_time(1, now=0.0) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now=0.5) == pytest.approx(0.5)
+    assert bucket.wait_time(1, now=1.0) == 0.0
+    # Requests larger than the capacity wait for a full bucket, not forever.
+    assert bucket.wait_time(600, now=1.0) == pytest.approx(59.0)
+
+
+def test_token_bucket_adjust_and_zero_rate():
+    bucket = TokenBucket(100, now=0.0)
+    bucket.take(50, now=0.0)
+    bucket.adjust(-80)  # the call cost less than estimated
+    assert bucket.level == 100
+    unlimited = TokenBucket(0, now=0.0)
+    unlimited.take(10**9, now=0.0)
+    assert unlimited.wait_time(10**9, now=0.0) == 0.0
+
+
+def test_initial_limit_depends_on_quota():
+    assert GeminiScheduler(0, 0, 32, 0).limit == 32
+    assert GeminiScheduler(60, 0, 32, 0).limit == INITIAL_CONCURRENCY
+    assert GeminiScheduler(0, 1000, 2, 0).limit == 2
+
+
+def test_throttling_halves_once_per_window():
+    clock = FakeClock()
+    scheduler = GeminiScheduler(0, 0, 32, 0, clock=clock)
+    scheduler._on_throttle(_throttled())
+    scheduler._on_throttle(_throttled())
+    assert scheduler.limit == 16
+    clock.now += 1.0
+    scheduler._on_throttle(_throttled("5s"))
+    assert scheduler.limit == 8
+    assert scheduler._paused_until == clock.now + 5
+    for _ in range(10):
+        clock.now += 1.0
+        scheduler._on_throttle(_throttled())
+    assert scheduler.limit == 1
+
+
+def test_saturated_successes_grow_the_limit_additively():
+    clock = FakeClock()
+    scheduler = GeminiScheduler(60, 0, 5, 0, clock=clock)
+    scheduler._on_success(1.0, saturated=False)
+    assert scheduler.limit == INITIAL_CONCURRENCY
+    scheduler._on_success(1.0, saturated=True)
+    assert scheduler.limit == pytest.approx(
+        INITIAL_CONCURRENCY + 1 / INITIAL_CONCURRENCY
+    )
+    for _ in range(20):
+        scheduler._on_success(1.0, saturated=True)
+    assert scheduler.limit == 5
+
+
+def test_latency_backoff_only_applies_under_a_quota():
+    for rpm, expected in ((60, INITIAL_CONCURRENCY * 0.9), (0, 32)):
+        clock = FakeClock()
+        scheduler = GeminiScheduler(rpm, 0, 32, 0, clock=clock)
+        for _ in range(20):
+            scheduler._on_success(1.0, saturated=False)
+        clock.now += 100
+        for _ in range(3):
+            scheduler._on_success(20.0, saturated=False)
+        assert scheduler.limit == pytest.approx(expected)
+
+
+def test_interactive_calls_are_dispatched_before_bulk():
+    async def main():
+        scheduler = GeminiScheduler(0, 0, 1, 0)
+        release = asyncio.Event()
+        order = []
+
+        async def call(name):
+            order.append(name)
+            if name == "first":
+                await release.wait()
+            return name
+
+        first = asyncio.create_task(scheduler.run(lambda: call("first")))
+        await asyncio.sleep(0)
+        bulk = asyncio.create_task(
+            scheduler.run(lambda: call("bulk"), priority=Priority.BULK)
+        )
+        interactive = asyncio.create_task(scheduler.run(lambda: call("interactive")))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == {"interactive": 1, "bulk": 1}
+        release.set()
+        await asyncio.gather(first, bulk, interactive)
+        return order
+
+    assert asyncio.run(main()) == ["first", "interactive", "bulk"]
+
+
+def test_requests_wait_for_the_rpm_bucket():
+    async def main():
+        clock = FakeClock()
+        scheduler = GeminiScheduler(2, 0, 8, 0, clock=clock)
+
+        async def call():
+            return "ok"
+
+        await scheduler.run(call)
+        await scheduler.run(call)
+        third = asyncio.create_task(scheduler.run(call))
+        await asyncio.sleep(0)
+        assert not third.done() and scheduler._timer is not None
+        clock.now += 30  # one request's worth of refill at 2 RPM
+        scheduler._dispatch()
+        return await third
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_retries_throttled_calls_then_gives_up():
+    async def main(failures, max_retries):
+        scheduler = GeminiScheduler(0, 0, 4, max_retries)
+        attempts = 0
+
+        async def call():
+            nonlocal attempts
+            attempts += 1
+            if attempts <= failures:
+                raise _throttled()
+            return attempts
+
+        try:
+            return await scheduler.run(call), scheduler.stats()
+        except errors.ClientError:
+            return None, scheduler.stats()
+
+    result, stats = asyncio.run(main(failures=2, max_retries=2))
+    assert result == 3
+    assert stats["retries"] == 2 and stats["throttled"] == 2
+    assert stats["in_flight"] == 0 and stats["completed"] == 1
+
+    result, stats = asyncio.run(main(failures=3, max_retries=2))
+    assert result is None and stats["in_flight"] == 0
+
+
+def test_client_errors_are_not_retried():
+    async def main():
+        scheduler = GeminiScheduler(0, 0, 4, 3)
+        attempts = 0
+
+        async def call():
+            nonlocal attempts
+            attempts += 1
+            raise errors.ClientError(400, {"error": {"message": "bad request"}})
+
+        with pytest.raises(errors.ClientError):
+            await scheduler.run(call)
+        return attempts
+
+    assert asyncio.run(main()) == 1
+
+
+def test_streams_retry_only_before_the_first_chunk():
+    async def main(fail_after):
+        scheduler = GeminiScheduler(0, 0, 4, 3)
+        attempts = 0
+
+        async def call():
+            nonlocal attempts
+            attempts += 1
+
+            async def chunks():
+                for i in range(3):
+                    if attempts == 1 and i == fail_after:
+                        raise _throttled()
+                    yield i
+
+            return chunks()
+
+        received = []
+        try:
+            async for chunk in scheduler.stream(call):
+                received.append(chunk)
+        except errors.ClientError:
+            received.append("error")
+        return received, attempts
+
+    assert asyncio.run(main(fail_after=0)) == ([0, 1, 2], 2)
+    assert asyncio.run(main(fail_after=1)) == ([0, "error"], 1)
@@ -0,0 +1,181 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services.jobs import MAX_JOB_ATTEMPTS, IdempotencyConflict, JobInput, JobStore
+
+LEASE = 60.0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    store = JobStore(str(tmp_path / "jobs" / "jobs.db"), clock=clock)
+    yield store
+    store._conn.close()
+
+
+def _input(assignment: bytes = b"essay", **params) -> JobInput:
+    return JobInput(
+        rubric=b"rubric",
+        rubric_filename="rubric.pdf",
+        assignment=assignment,
+        assignment_filename="essay.txt",
+        params=params,
+    )
+
+
+def test_claim_leases_the_oldest_queued_job(store, clock):
+    first, created = store.submit(_input(b"one"))
+    assert created and first["status"] == "queued" and first["attempts"] == 0
+    clock.now += 1
+    second, _ = store.submit(_input(b"two"))
+
+    job_id, job_input = store.claim(LEASE)
+    assert job_id == first["id"]
+    assert job_input == _input(b"one")
+    job = store.get(job_id)
+    assert job["status"] == "running" and job["attempts"] == 1
+    assert job["started_at"] == clock.now
+
+    assert store.claim(LEASE)[0] == second["id"]
+    assert store.claim(LEASE) is None
+    assert store.counts() == {"queued": 0, "running": 2, "succeeded": 0, "failed": 0}
+
+
+def test_expired_lease_is_reclaimed_and_renew_extends_it(store, clock):
+    job, _ = store.submit(_input())
+    job_id, _ = store.claim(LEASE)
+
+    clock.now += LEASE - 1
+    store.renew(job_id, LEASE)
+    clock.now += LEASE - 1
+    assert store.claim(LEASE) is None
+
+    clock.now += 2
+    reclaimed_id, job_input = store.claim(LEASE)
+    assert reclaimed_id == job["id"] and job_input == _input()
+    assert store.get(job_id)["attempts"] == 2
+
+
+def test_job_interrupted_too_often_fails(store, clock):
+    job, _ = store.submit(_input())
+    for _ in range(MAX_JOB_ATTEMPTS):
+        assert store.claim(LEASE)[0] == job["id"]
+        clock.now += LEASE + 1
+    assert store.claim(LEASE) is None
+    failed = store.get(job["id"])
+    assert failed["status"] == "failed"
+    assert failed["error"] == "Grading failed"
+    assert str(MAX_JOB_ATTEMPTS) in failed["detail"]
+
+
+def test_release_requeues_without_counting_the_attempt(store):
+    job, _ = store.submit(_input())
+    store.claim(LEASE)
+    store.release([job["id"]])
+    requeued = store.get(job["id"])
+    assert requeued["status"] == "queued" and requeued["attempts"] == 0
+    assert store.claim(LEASE)[0] == job["id"]
+
+
+def test_finish_records_results_and_errors(store):
+    ok, _ = store.submit(_input(b"one"))
+    bad, _ = store.submit(_input(b"two"))
+    store.claim(LEASE)
+    store.claim(LEASE)
+    store.finish(ok["id"], {"name": "Ada", "criteria_feedback": []})
+    store.finish(bad["id"], {"error": "Grading failed", "detail": "boom"})
+
+    assert store.get(ok["id"])["status"] == "succeeded"
+    assert store.get(ok["id"])["result"] == {"name": "Ada", "criteria_feedback": []}
+    failed = store.get(bad["id"])
+    assert failed["status"] == "failed" and failed["detail"] == "boom"
+    # Uploads are dropped once a job finishes; nothing is left to claim.
+    assert store._conn.execute("SELECT COUNT(*) FROM job_inputs").fetchone() == (0,)
+    # A renew after the job finished must not resurrect it.
+    store.renew(ok["id"], LEASE)
+    assert store.get(ok["id"])["status"] == "succeeded"
+
+
+def test_idempotency_key_returns_the_existing_job(store):
+    job, created = store.submit(_input(), "key-1")
+    again, created_again = store.submit(_input(), "key-1")
+    assert created and not created_again
+    assert again == job
+    assert store.counts()["queued"] == 1
+
+    other, created_other = store.submit(_input(), "key-2")
+    assert created_other and other["id"] != job["id"]
+
+
+@pytest.mark.parametrize(
+    "changed",
+    [
+        _input(b"another essay"),
+        _input(notes="be strict"),
+        JobInput(b"other rubric", "rubric.pdf", b"essay", "essay.txt"),
+    ],
+    ids=["assignment", "params", "rubric"],
+)
+def test_idempotency_key_reused_for_a_different_request(store, changed):
+    store.submit(_input(), "key-1")
+    with pytest.raises(IdempotencyConflict):
+        store.submit(changed, "key-1")
+
+
+def test_prune_deletes_only_old_finished_jobs(store, clock):
+    old, _ = store.submit(_input(b"old"))
+    store.claim(LEASE)
+    store.finish(old["id"], {"result": 1})
+    clock.now += 100
+    recent, _ = store.submit(_input(b"recent"))
+    store.claim(LEASE)
+    store.finish(recent["id"], {"result": 2})
+    queued, _ = store.submit(_input(b"queued"))
+
+    assert store.prune(150) == 0
+    clock.now += 100
+    assert store.prune(150) == 1
+    assert store.get(old["id"]) is None
+    assert store.get(recent["id"]) is not None
+    assert store.get(queued["id"]) is not None
+
+
+def test_create_job_maps_a_reused_key_to_409(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(main.job_queue, "_store", store)
+    client = TestClient(main.app)
+
+    def post(essay: bytes):
+        return client.post(
+            "/api/jobs",
+            files={
+                "assignment": ("essay.txt", essay, "text/plain"),
+                "rubric": ("rubric.txt", b"rubric", "text/plain"),
+            },
+            headers={"Idempotency-Key": "key-1"},
+        )
+
+    try:
+        first = post(b"essay")
+        assert first.status_code == 202
+        repeat = post(b"essay")
+        assert repeat.status_code == 200
+        assert repeat.json()["id"] == first.json()["id"]
+        conflict = post(b"another essay")
+        assert conflict.status_code == 409
+    finally:
+        store._conn.close()
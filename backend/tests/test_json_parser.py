@@ -0,0 +1,154 @@
+import json
+import random
+
+import pytest
+
+from utils import (
+    JsonStreamParser,
+    parse_grading_response,
+    parse_json_response,
+    validate_criterion,
+    validate_grading_result,
+)
+
+RESULT = {
+    "name": "Ada",
+    "overall_feedback": 'Uses "quotes", {braces} and a \\ backslash.',
+    "criteria_feedback": [
+        {"criteria_title": "Thesis", "score": 8, "score_max": 10, "feedback": "ok"},
+        {"criteria_title": "Style", "score": 4.5, "score_max": 5, "feedback": "}{"},
+    ],
+}
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        json.dumps(RESULT),
+        f"  {json.dumps(RESULT, indent=2)}\n",
+        f"```json\n{json.dumps(RESULT)}\n```",
+        f"Here is the grade:\n{json.dumps(RESULT)}\nLet me know.",
+        f"Scores use {{0..10}}.\n{json.dumps(RESULT)}",
+    ],
+    ids=["bare", "indented", "fenced", "prose", "braces-before"],
+)
+def test_parse_json_response_finds_the_object(content):
+    assert parse_json_response(content) == RESULT
+
+
+@pytest.mark.parametrize(
+    "content",
+    ["", "no json here", json.dumps(RESULT)[:-10], '```json\n{"a": }\n```'],
+    ids=["empty", "prose", "truncated", "invalid"],
+)
+def test_parse_json_response_rejects_malformed(content):
+    with pytest.raises(ValueError):
+        parse_json_response(content)
+
+
+def test_parse_grading_response_validates():
+    result = parse_grading_response(f"```json\n{json.dumps(RESULT)}\n```")
+    assert result == RESULT
+
+
+@pytest.mark.parametrize(
+    "score, score_max, expected",
+    [
+        ("7.5", 10, (7.5, 10)),
+        (" 7 ", "10", (7, 10)),
+        ("7.5/10", None, (7.5, 10)),
+        (12, 10, (10, 10)),
+        (-3, 10, (0, 10)),
+        (10, 10, (10, 10)),
+        (0, 10, (0, 10)),
+        (5, 0, (0, 0)),
+        (-5, 0, (0, 0)),
+        ("3/0", None, (0, 0)),
+    ],
+)
+def test_validate_criterion_coerces_and_clamps(score, score_max, expected):
+    item = validate_criterion({"score": score, "score_max": score_max})
+    assert (item["score"], item["score_max"]) == expected
+
+
+@pytest.mark.parametrize(
+    "item",
+    [
+        {"score": True, "score_max": 10},
+        {"score": "seven", "score_max": 10},
+        {"score": None, "score_max": 10},
+        {"score": float("nan"), "score_max": 10},
+        {"score": 1, "score_max": -5},
+        ["not", "an", "object"],
+    ],
+    ids=["bool", "text", "missing", "nan", "negative-max", "list"],
+)
+def test_validate_criterion_rejects(item):
+    with pytest.raises(ValueError):
+        validate_criterion(item)
+
+
+def test_validate_criterion_defaults_text_and_keeps_extra_keys():
+    item = validate_criterion({"score": 1, "score_max": 2, "level": "B"})
+    assert item == {
+        "score": 1,
+        "score_max": 2,
+        "level": "B",
+        "criteria_title": "",
+        "feedback": "",
+    }
+
+
+@pytest.mark.parametrize("criteria", [{}, "none", 3])
+def test_validate_grading_result_requires_a_criteria_list(criteria):
+    with pytest.raises(ValueError):
+        validate_grading_result({"criteria_feedback": criteria})
+
+
+def test_validate_grading_result_defaults():
+    assert validate_grading_result({}) == {
+        "name": "",
+        "overall_feedback": "",
+        "criteria_feedback": [],
+    }
+
+
+def _expected_events(obj: dict) -> list:
+    events = []
+    for key, value in obj.items():
+        if isinstance(value, list):
+            events.extend(((key, i), item) for i, item in enumerate(value))
+        else:
+            events.append(((key,), value))
+    return events
+
+
+STREAMED = {
+    "name": "Ada",
+    "empty": [],
+    "nested": {"a": [1, {"b": "}]"}], "c": None},
+    "criteria_feedback": RESULT["criteria_feedback"],
+    "overall_feedback": RESULT["overall_feedback"],
+    "flag": True,
+}
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_stream_parser_matches_whole_parse(seed):
+    text = f"```json\n{json.dumps(STREAMED, indent=seed % 3 or None)}\n```"
+    rng = random.Random(seed)
+    parser = JsonStreamParser()
+    events = []
+    start = 0
+    while start < len(text):
+        end = start + rng.randint(1, 16)
+        events.extend(parser.feed(text[start:end]))
+        start = end
+    assert parser.done
+    assert events == _expected_events(STREAMED)
+
+
+def test_stream_parser_ignores_input_after_the_object():
+    parser = JsonStreamParser()
+    assert parser.feed('{"a": 1}') == [(("a",), 1)]
+    assert parser.feed('{"b": 2}') == []
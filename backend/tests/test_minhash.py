@@ -0,0 +1,86 @@
+import random
+
+import numpy as np
+
+from services.minhash import (
+    LSH_BANDS,
+    NUM_PERM,
+    band_keys,
+    candidate_pairs,
+    matching_spans,
+    overlap,
+    shingle,
+    signature,
+)
+
+
+def _essay(seed: int, words: int = 300) -> str:
+    rng = random.Random(seed)
+    return " ".join(f"word{rng.randrange(5000)}" for _ in range(words))
+
+
+def test_shingle_hashes_every_window():
+    shingles = shingle("one two three four five six seven", size=5)
+    assert len(shingles.hashes) == 3
+    assert len(shingle("one two three four", size=5).hashes) == 0
+
+
+def test_shingle_ignores_case_and_punctuation():
+    first = shingle("The quick brown fox jumps over", size=3)
+    second = shingle("the QUICK, brown... fox jumps; over", size=3)
+    assert np.array_equal(first.hashes, second.hashes)
+
+
+def test_shingle_spans_index_the_original_text():
+    # "İ" lowercases to two characters; spans must not drift after it.
+    text = "İstanbul İzmir and Ankara are Turkish cities"
+    shingles = shingle(text, size=2)
+    spans = [text[start:end] for start, end in zip(shingles.starts, shingles.ends)]
+    assert spans[0] == "İstanbul İzmir"
+    assert spans[-1] == "Turkish cities"
+
+
+def test_signature_is_deterministic_and_empty_safe():
+    unique = shingle(_essay(1)).unique()
+    sig = signature(unique)
+    assert sig.shape == (NUM_PERM,) and sig.dtype == np.uint32
+    assert np.array_equal(sig, signature(unique.copy()))
+    assert np.all(signature(np.empty(0, dtype=np.uint64)) == np.iinfo(np.uint32).max)
+
+
+def test_band_keys_round_trip():
+    signatures = np.stack([signature(shingle(_essay(i)).unique()) for i in range(3)])
+    keys = band_keys(signatures)
+    assert keys.shape == (3, LSH_BANDS)
+    assert np.array_equal(band_keys(signatures[1]), keys[1:2])
+    # Stored signatures are read back from bytes as uint32.
+    restored = np.frombuffer(signatures[0].tobytes(), dtype=np.uint32)
+    assert np.array_equal(band_keys(restored)[0], keys[0])
+
+
+def test_candidate_pairs_find_near_duplicates_only():
+    base = _essay(1)
+    edited = base.replace("word1", "changed", 3)
+    texts = [base, _essay(2), edited, ""]
+    signatures = np.stack([signature(shingle(t).unique()) for t in texts])
+    assert candidate_pairs(signatures) == {(0, 2)}
+
+
+def test_overlap():
+    first = np.array([1, 2, 3, 4], dtype=np.uint64)
+    second = np.array([3, 4, 5], dtype=np.uint64)
+    similarity, containment = overlap(first, second)
+    assert similarity == 2 / 5
+    assert containment == 2 / 3
+    assert overlap(first, np.array([9], dtype=np.uint64)) == (0.0, 0.0)
+
+
+def test_matching_spans_cover_the_shared_passage():
+    passage = "the mitochondria is the powerhouse of the cell and more"
+    first_text = f"{_essay(1, 20)} {passage} {_essay(2, 20)}"
+    second_text = f"Intro text here. {passage}. The end."
+    spans = matching_spans(shingle(first_text), shingle(second_text))
+    start, end = spans[0]["first"]
+    assert first_text[start:end] == passage
+    start, end = spans[0]["second"]
+    assert second_text[start:end] == passage
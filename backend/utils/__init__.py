@@ -1,3 +1,15 @@
-from .json_parser import parse_json_response
+from .json_parser import (
+    JsonStreamParser,
+    parse_grading_response,
+    parse_json_response,
+    validate_criterion,
+    validate_grading_result,
+)
 
-__all__ = ["parse_json_response"]
+__all__ = [
+    "JsonStreamParser",
+    "parse_grading_response",
+    "parse_json_response",
+    "validate_criterion",
+    "validate_grading_result",
+]
@@ -1,10 +1,76 @@
 import json
+import logging
+import math
 import re
+from collections.abc import Iterator
+
+try:
+    import orjson
+except ImportError:  # optional, decodes several times faster when installed
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder()
+
+# The object scanner only stops at these characters; everything in between
+# (string contents, numbers, whitespace) is skipped by the regex engine.
+_OBJECT_TOKENS = re.compile(r'[{}"\\]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+# A score given as a string: "7.5", or "7.5/10" which also implies score_max.
+_SCORE_TEXT = re.compile(r"\s*([-+]?\d+(?:\.\d+)?)\s*(?:/\s*(\d+(?:\.\d+)?))?\s*$")
+
+
+def _loads(text: str):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _object_spans(content: str) -> Iterator[str]:
+    """
+    Yield each balanced top-level ``{...}`` span of ``content`` in order.
+
+    Braces inside JSON strings are ignored. Text outside objects (prose,
+    code fences) is never tokenized as JSON, so stray quotes there don't
+    matter. One pass, linear in the length of ``content``.
+    """
+    depth = 0
+    start = 0
+    in_string = False
+    escaped_until = -1
+    for match in _OBJECT_TOKENS.finditer(content):
+        i = match.start()
+        if i < escaped_until:
+            continue
+        char = content[i]
+        if in_string:
+            if char == "\\":
+                escaped_until = i + 2
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = depth > 0
+        elif char == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                yield content[start : i + 1]
 
 
 def parse_json_response(content: str) -> dict:
     """
-    Extract JSON from Gemini response (handles markdown/code blocks).
+    Extract the JSON object from a Gemini response.
+
+    Bare JSON, which JSON mode returns, is decoded directly (with orjson when
+    it is installed). Otherwise the object is decoded from the first ``{``,
+    which skips code fences and prose around it. Failing that, the response
+    is scanned once for balanced top-level ``{...}`` spans and the first one
+    that decodes wins. Every step is linear in the length of the response.
 
     Args:
         content: The raw response content from Gemini
@@ -13,39 +79,283 @@ def parse_json_response(content: str) -> dict:
         Parsed JSON dictionary
 
     Raises:
-        ValueError: If no valid JSON can be extracted
+        ValueError: If no valid JSON object can be extracted
     """
     content = content.strip()
 
-    try:
-        return json.loads(content)
-    except json.JSONDecodeError:
-        pass
-
-    if "```" in content:
-        lines = content.split("\n")
-        json_lines = []
-        inside = False
-        for line in lines:
-            if line.startswith("```"):
-                if not inside:
-                    inside = True
-                else:
-                    break
-                continue
-            if inside:
-                json_lines.append(line)
-        if json_lines:
-            try:
-                return json.loads("\n".join(json_lines))
-            except json.JSONDecodeError:
-                pass
-
-    m = re.search(r"\{[\s\S]*\}", content)
-    if m:
+    if content.startswith("{") and content.endswith("}"):
         try:
-            return json.loads(m.group())
-        except json.JSONDecodeError:
+            return _loads(content)
+        except ValueError:
             pass
 
+    # Usually the object starts at the first brace, after a fence or a
+    # sentence; decode from there and ignore whatever follows it.
+    start = content.find("{")
+    if start >= 0:
+        try:
+            result, _ = _decoder.raw_decode(content, start)
+            return result
+        except ValueError:
+            pass
+
+    # Otherwise look for a later object, e.g. after prose containing braces.
+    for candidate in _object_spans(content):
+        try:
+            return _loads(candidate)
+        except ValueError:
+            continue
+
     raise ValueError(f"Could not extract valid JSON from response: {content[:200]}")
+
+
+def parse_grading_response(content: str) -> dict:
+    """Extract and validate a grading result (see ``validate_grading_result``)."""
+    return validate_grading_result(parse_json_response(content))
+
+
+def validate_grading_result(result: dict) -> dict:
+    """
+    Check and normalize a grading result against the response schema.
+
+    Returns ``name``, ``overall_feedback`` and ``criteria_feedback``, with
+    each criterion passed through ``validate_criterion``.
+
+    Raises:
+        ValueError: If the result or one of its criteria is malformed
+    """
+    if not isinstance(result, dict):
+        raise ValueError("Grading result is not a JSON object")
+    criteria = result.get("criteria_feedback")
+    if criteria is None:
+        criteria = []
+    elif not isinstance(criteria, list):
+        raise ValueError("criteria_feedback is not a list")
+    return {
+        "name": _text(result.get("name")),
+        "overall_feedback": _text(result.get("overall_feedback")),
+        "criteria_feedback": [
+            validate_criterion(item, index) for index, item in enumerate(criteria)
+        ],
+    }
+
+
+def validate_criterion(item: dict, index: int = 0) -> dict:
+    """
+    Normalize one ``criteria_feedback`` item.
+
+    Text fields default to ``""``. Scores must be numbers or numeric strings
+    (``"7.5"``, or ``"7.5/10"``, which also supplies a missing ``score_max``)
+    and are clamped to ``0..score_max``. Other keys are kept as they are.
+
+    Raises:
+        ValueError: If the item isn't an object or a score isn't a number
+    """
+    field = f"criteria_feedback[{index}]"
+    if not isinstance(item, dict):
+        raise ValueError(f"{field} is not an object")
+
+    score, implied_max = _score(item.get("score"), f"{field}.score")
+    if item.get("score_max") is None and implied_max is not None:
+        score_max = implied_max
+    else:
+        score_max, _ = _score(item.get("score_max"), f"{field}.score_max")
+    if score_max < 0:
+        raise ValueError(f"{field}.score_max is negative: {score_max}")
+
+    if score < 0:
+        score = 0
+    elif score > score_max:
+        logger.warning(f"{field}.score {score} exceeds score_max {score_max}")
+        score = score_max
+
+    return {
+        **item,
+        "criteria_title": _text(item.get("criteria_title")),
+        "score": score,
+        "score_max": score_max,
+        "feedback": _text(item.get("feedback")),
+    }
+
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+
+def _number(text: str) -> int | float:
+    return float(text) if "." in text else int(text)
+
+
+def _score(value, field: str) -> tuple[int | float, int | float | None]:
+    """A score as a number, plus the maximum a ``"x/y"`` string implies."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if not math.isfinite(value):
+            raise ValueError(f"{field} is not a finite number")
+        return value, None
+    if isinstance(value, str):
+        match = _SCORE_TEXT.match(value)
+        if match:
+            implied_max = match.group(2)
+            return _number(match.group(1)), (
+                _number(implied_max) if implied_max else None
+            )
+    raise ValueError(f"{field} is not a number: {value!r}")
+
+
+class JsonStreamParser:
+    """
+    Incrementally parse a JSON object as it is streamed in.
+
+    ``feed`` returns ``(path, value)`` for every value the chunk completed:
+    top-level members as ``(key,)`` and elements of top-level arrays as
+    ``(key, index)`` (such arrays are only reported element by element).
+    Text before the opening ``{``, such as a code fence, is skipped. Only the
+    value in progress is buffered, so memory stays bounded by the largest
+    member or element rather than the whole response.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._stack: list[str] = []
+        self._in_string = False
+        self._done = False
+        self._expect_key = False
+        self._key: str | None = None
+        self._key_start: int | None = None
+        self._index = 0
+        self._awaiting_value = False
+        self._value_start: int | None = None
+        self._value_depth = 0
+
+    @property
+    def done(self) -> bool:
+        """Whether the top-level object has been closed."""
+        return self._done
+
+    def feed(self, chunk: str) -> list[tuple[tuple, object]]:
+        if self._done:
+            return []
+        self._buffer += chunk
+        buffer = self._buffer
+        events: list[tuple[tuple, object]] = []
+        i = self._pos
+        n = len(buffer)
+
+        while i < n:
+            if self._in_string:
+                match = _STRING_SPECIAL.search(buffer, i)
+                if match is None:
+                    i = n
+                    break
+                j = match.start()
+                if buffer[j] == "\\":
+                    if j + 1 >= n:
+                        # The escaped character is in the next chunk.
+                        i = j
+                        break
+                    i = j + 2
+                    continue
+                i = j + 1
+                self._in_string = False
+                self._end_string(i, events)
+                continue
+
+            char = buffer[i]
+            if char in " \t\r\n":
+                i += 1
+                continue
+            depth = len(self._stack)
+            if depth == 0:
+                start = buffer.find("{", i)
+                if start == -1:
+                    i = n
+                    break
+                self._stack.append("{")
+                self._expect_key = True
+                i = start + 1
+                continue
+
+            if self._awaiting_value:
+                self._awaiting_value = False
+                if char == "[" and depth == 1:
+                    self._stack.append(char)
+                    self._index = 0
+                    self._awaiting_value = True
+                    i += 1
+                    continue
+                if char not in "]}":
+                    self._value_start = i
+                    self._value_depth = depth
+
+            if char == '"':
+                self._in_string = True
+                if depth == 1 and self._expect_key:
+                    self._key_start = i
+            elif char in "{[":
+                self._stack.append(char)
+            elif char in ",]}":
+                if self._value_start is not None and depth == self._value_depth:
+                    # A number, true, false or null ends here.
+                    self._emit(self._value_start, i, events)
+                if char == ",":
+                    if depth == 1:
+                        self._expect_key = True
+                    elif depth == 2 and self._stack[1] == "[":
+                        self._index += 1
+                        self._awaiting_value = True
+                else:
+                    self._stack.pop()
+                    if not self._stack:
+                        self._done = True
+                        i += 1
+                        break
+                    if (
+                        self._value_start is not None
+                        and len(self._stack) == self._value_depth
+                    ):
+                        self._emit(self._value_start, i + 1, events)
+            elif char == ":" and depth == 1:
+                self._awaiting_value = True
+            i += 1
+
+        self._pos = i
+        self._trim()
+        return events
+
+    def _end_string(self, end: int, events: list) -> None:
+        depth = len(self._stack)
+        if self._key_start is not None:
+            self._key = _loads(self._buffer[self._key_start : end])
+            self._key_start = None
+            self._expect_key = False
+        elif self._value_start is not None and depth == self._value_depth:
+            self._emit(self._value_start, end, events)
+
+    def _emit(self, start: int, end: int, events: list) -> None:
+        self._value_start = None
+        try:
+            value = _loads(self._buffer[start:end])
+        except ValueError:
+            return
+        if self._value_depth == 1:
+            events.append(((self._key,), value))
+        else:
+            events.append(((self._key, self._index), value))
+
+    def _trim(self) -> None:
+        """Drop text that no pending key or value still needs."""
+        keep = self._pos
+        for start in (self._key_start, self._value_start):
+            if start is not None:
+                keep = min(keep, start)
+        if keep == 0:
+            return
+        self._buffer = self._buffer[keep:]
+        self._pos -= keep
+        if self._key_start is not None:
+            self._key_start -= keep
+        if self._value_start is not None:
+            self._value_start -= keep
@@ -14,10 +14,14 @@ export const GradingResultSchema = z.object({
 	overall_feedback: z.string(),
 	criteria_feedback: z.array(CriteriaFeedbackSchema),
 	images: z.array(z.string()).optional(),
+	image_mime_type: z.string().optional(),
 	ai_detection: z
 		.object({
 			is_ai_generated: z.boolean(),
-			confidence: z.number()
+			ai_probability: z.number(),
+			confidence: z.string(),
+			authentic: z.boolean().optional(),
+			error: z.string().optional()
 		})
 		.optional()
 });